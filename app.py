@@ -2,11 +2,13 @@
 
 import streamlit as st
 import os
-from dotenv import load_dotenv
+import uuid
 
 # Import our custom modules
 import templates
 import utils
+import history
+import store
 
 # 1. Page configuration
 st.set_page_config(
@@ -18,78 +20,20 @@ st.set_page_config(
     }
 )
 
-# Apply theme
-st.markdown("""
-    <style>
-    :root {
-        --primary-color: #2563EB;
-        --background-color: #FFFFFF;
-        --secondary-background-color: #F8FAFC;
-        --text-color: #374151;
-        --font: "sans-serif";
-    }
-    </style>
-    """, unsafe_allow_html=True)
-
-# Apply balanced spacing CSS
-st.markdown("""
-<style>
-/* Header styling with better colors */
-h1, h2, h3, .stSubheader {
-    color: #2563EB !important;
-    margin-bottom: 0.2rem !important;
-    padding-bottom: 0.1rem !important;
-}
-
-/* Add some space at the top to prevent title cutoff */
-.main .block-container {
-    padding-top: 2rem !important;
-}
-
-/* Target the specific gap between header and input */
-label[data-testid="stText"], .stMarkdown p {
-    margin-bottom: 0.2rem !important;
-    padding-bottom: 0.1rem !important;
-    line-height: 1.3 !important;
-}
-
-/* Target spaces around text inputs and areas */
-.stTextInput div, .stTextArea div {
-    padding-top: 0.2rem !important;
-    margin-top: 0.1rem !important;
-}
-
-/* Reduce caption spacing but keep it readable */
-small {
-    margin-top: 0.1rem !important;
-    margin-bottom: 0.1rem !important;
-    line-height: 1.2 !important;
-}
-
-/* More balanced space between sections */
-section > div {
-    padding-top: 0.7rem !important;
-    padding-bottom: 0.7rem !important;
-}
-
-/* Chat message styling */
-.stChatMessage[data-testid="stChatMessageUser"] {
-    background-color: #EFF6FF !important;
-}
-
-.stChatMessage[data-testid="stChatMessageAssistant"] {
-    background-color: #F8FAFC !important;
-}
-</style>
-""", unsafe_allow_html=True)
+# Apply theme and spacing CSS, read once per process
+st.markdown(f"<style>\n{utils.load_asset('theme.css')}</style>", unsafe_allow_html=True)
 
 # 3. Load environment variables
-load_dotenv()
+utils.load_environment()
 
 # 4. Initialize session state variables
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
+# Number of earlier messages of the conversation that are only in the store
+if "messages_offset" not in st.session_state:
+    st.session_state.messages_offset = 0
+
 if "bot_name" not in st.session_state:
     st.session_state.bot_name = "Gemini Assistant"
 
@@ -108,12 +52,50 @@ if "model" not in st.session_state:
 if "initial_prompts" not in st.session_state:
     st.session_state.initial_prompts = templates.get_default_initial_prompts("Basic Assistant")
 
-if "document_context" not in st.session_state:
-    st.session_state.document_context = ""
+if "documents" not in st.session_state:
+    st.session_state.documents = {}
+
+if "document_index" not in st.session_state:
+    st.session_state.document_index = None
+
+if "retrieval_method" not in st.session_state:
+    st.session_state.retrieval_method = "Keyword"
+
+if "retrieval_top_k" not in st.session_state:
+    st.session_state.retrieval_top_k = 5
+
+if "retrieval_budget" not in st.session_state:
+    st.session_state.retrieval_budget = 4000
+
+if "show_retrieved_chunks" not in st.session_state:
+    st.session_state.show_retrieved_chunks = False
+
+if "history_budgets" not in st.session_state:
+    st.session_state.history_budgets = dict(history.DEFAULT_HISTORY_BUDGETS)
+
+if "history_manager" not in st.session_state:
+    st.session_state.history_manager = history.HistoryManager()
+
+if "stream_responses" not in st.session_state:
+    st.session_state.stream_responses = True
+
+if "turn_timings" not in st.session_state:
+    st.session_state.turn_timings = []
+
+if "failed_turn" not in st.session_state:
+    st.session_state.failed_turn = None
+
+if "context_caching" not in st.session_state:
+    st.session_state.context_caching = False
 
 if "current_view" not in st.session_state:
     st.session_state.current_view = "Bot Builder"
 
+# Restore the session named in the URL, or start a new one
+if "session_id" not in st.session_state:
+    if not utils.restore_session(st.query_params.get("session")):
+        st.session_state.session_id = uuid.uuid4().hex
+
 # 5. Title & top description - ONLY shown in Bot Builder mode
 if st.session_state.current_view == "Bot Builder":
     st.title("Chatbot Builder")
@@ -132,13 +114,25 @@ with st.sidebar:
         st.session_state["GOOGLE_API_KEY"] = api_key
 
     # Model selection
+    model_options = list(history.DEFAULT_HISTORY_BUDGETS)
     model_option = st.selectbox(
         "Select Gemini Model",
-        ["gemini-1.5-pro", "gemini-1.5-flash", "gemini-pro"],
-        index=["gemini-1.5-pro", "gemini-1.5-flash", "gemini-pro"].index(st.session_state.model)
+        model_options,
+        index=model_options.index(st.session_state.model)
     )
     if model_option != st.session_state.model:
         st.session_state.model = model_option
+
+    # History budget for the selected model
+    history_budget = st.number_input(
+        "History budget (tokens)",
+        min_value=1000,
+        max_value=1000000,
+        step=1000,
+        value=history.get_history_budget(st.session_state.model, st.session_state.history_budgets),
+        help="Older messages beyond this budget are summarized in the background"
+    )
+    st.session_state.history_budgets[st.session_state.model] = history_budget
     
     # Temperature slider
     temperature = st.slider(
@@ -152,6 +146,15 @@ with st.sidebar:
     if temperature != st.session_state.temperature:
         st.session_state.temperature = temperature
 
+    # Streaming toggle
+    stream_responses = st.toggle(
+        "Stream responses",
+        value=st.session_state.stream_responses,
+        help="Show the answer as it is generated instead of waiting for the full response"
+    )
+    if stream_responses != st.session_state.stream_responses:
+        st.session_state.stream_responses = stream_responses
+
     # Navigation header and radio buttons that look like links
     st.header("Navigation")
     
@@ -173,12 +176,23 @@ with st.sidebar:
     # Reference Documents
     utils.render_document_uploader()
 
+    # Response cache
+    utils.render_cache_section()
+
+    # Telemetry
+    utils.render_telemetry_section()
+
     # Export Configuration
     utils.render_export_section()
 
+    # Session
+    utils.render_session_section()
+
     # Reset chat
     if st.button("Reset Chat"):
+        store.get_store().clear_history(st.session_state.session_id)
         st.session_state.messages = []
+        utils.reset_chat_state()
         st.rerun()
 
     # Add space before footer with reduced gap
@@ -197,7 +211,5 @@ with st.sidebar:
 if st.session_state.current_view == "Bot Builder":
     utils.render_bot_builder()
 else:
-    # Load and display the prompt guidance content from the markdown file
-    with open("prompt_guidance.md", "r") as f:
-        guidance_content = f.read()
-    st.markdown(guidance_content)
+    # Display the prompt guidance content from the markdown file
+    st.markdown(utils.load_asset("prompt_guidance.md"))
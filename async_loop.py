@@ -0,0 +1,28 @@
+# async_loop.py
+
+import asyncio
+import threading
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_loop():
+    """
+    Return the process-wide asyncio event loop running on a background thread.
+
+    The Gemini async client binds to the loop it is first used on, so every
+    coroutine is run on this one long-lived loop instead of a fresh
+    asyncio.run() per Streamlit rerun.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="async-loop", daemon=True).start()
+        return _loop
+
+
+def submit(coroutine):
+    """Schedule a coroutine on the background loop and return a concurrent.futures.Future."""
+    return asyncio.run_coroutine_threadsafe(coroutine, get_loop())
@@ -0,0 +1,148 @@
+# batch_eval.py
+"""
+Run a set of test prompts through a bot configuration without the Streamlit UI.
+
+Example:
+    python batch_eval.py --settings settings.json --system-prompt system_prompt.txt \
+        --prompts tests.jsonl --output results.jsonl --concurrency 4 --rpm 60
+
+Each line of the prompts file is either a JSON string or an object with a
+"prompt" key and an optional "history" list of {"role", "content"} messages.
+Without --prompts, the bot's suggested initial prompts are used.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+import bot_config
+import conversation
+import retrieval
+import scheduler
+import telemetry
+
+
+def load_test_cases(prompts_path, initial_prompts):
+    """Load test cases from a JSONL file, or from the initial prompts (one per line)."""
+    if not prompts_path:
+        return [{"prompt": line.strip(), "history": []} for line in initial_prompts.splitlines() if line.strip()]
+
+    cases = []
+    with open(prompts_path, "r") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            case = json.loads(line)
+            if isinstance(case, str):
+                case = {"prompt": case}
+            case.setdefault("history", [])
+            cases.append(case)
+    return cases
+
+
+async def run_case(case, config, index, args, semaphore, api_key):
+    """Run one test case and return its result record."""
+    reference = ""
+    if index is not None:
+        chunks = conversation.retrieve_chunks(index, case["prompt"], case["history"], args.top_k, args.budget)
+        reference = retrieval.format_chunks(chunks)
+    contents = conversation.build_contents(case["prompt"], reference, "", case["history"])
+    model = conversation.get_gemini_model(config["model"], config["temperature"], config["system_prompt"])
+
+    async with semaphore:
+        start = time.perf_counter()
+        record = {"prompt": case["prompt"], "model": config["model"], "temperature": config["temperature"]}
+        try:
+            with telemetry.track("batch", config["model"]) as telemetry_record:
+                response = await scheduler.get_scheduler().call_async(
+                    api_key,
+                    config["model"],
+                    lambda: model.generate_content_async(contents)
+                )
+                telemetry.set_usage(telemetry_record, response)
+            usage = response.usage_metadata
+            record.update({
+                "response": response.text,
+                "latency": time.perf_counter() - start,
+                "prompt_tokens": usage.prompt_token_count,
+                "completion_tokens": usage.candidates_token_count,
+                "error": None,
+                "error_type": None
+            })
+        except Exception as e:
+            failure = scheduler.GeminiCallError.from_exception(e)
+            record.update({
+                "response": None,
+                "latency": time.perf_counter() - start,
+                "prompt_tokens": None,
+                "completion_tokens": None,
+                "error": str(failure),
+                "error_type": failure.error_type
+            })
+        return record
+
+
+async def run_batch(cases, config, index, args, output, api_key=None):
+    """Run all test cases with bounded concurrency, writing each result as it finishes."""
+    semaphore = asyncio.Semaphore(args.concurrency)
+    # Retries and the per-minute limit are handled by the process-wide scheduler
+    scheduler.get_scheduler().configure(rate_per_minute=args.rpm, burst=args.concurrency)
+    tasks = [asyncio.create_task(run_case(case, config, index, args, semaphore, api_key)) for case in cases]
+    records = []
+    for task in asyncio.as_completed(tasks):
+        record = await task
+        records.append(record)
+        output.write(json.dumps(record, ensure_ascii=False) + "\n")
+        output.flush()
+    return records
+
+
+def summarize(records, wall_time):
+    """Compute latency percentiles and token totals for a batch run."""
+    ok = [record for record in records if record["error"] is None]
+    latencies = np.array([record["latency"] for record in ok]) if ok else np.zeros(1)
+    return {
+        "requests": len(records),
+        "errors": len(records) - len(ok),
+        "wall_time": wall_time,
+        "latency_p50": float(np.percentile(latencies, 50)),
+        "latency_p95": float(np.percentile(latencies, 95)),
+        "latency_max": float(latencies.max()),
+        "prompt_tokens": sum(record["prompt_tokens"] for record in ok),
+        "completion_tokens": sum(record["completion_tokens"] for record in ok)
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run test prompts through a bot configuration.")
+    bot_config.add_arguments(parser)
+    parser.add_argument("--prompts", help="JSONL file of test prompts (default: the initial prompts)")
+    parser.add_argument("--output", default="results.jsonl", help="JSONL file for the results")
+    parser.add_argument("--concurrency", type=int, default=4, help="Maximum requests in flight")
+    parser.add_argument("--rpm", type=float, default=60, help="Maximum requests per minute (0 for no limit)")
+    args = parser.parse_args(argv)
+
+    bot_config.configure_backend(parser, args)
+    config, index = bot_config.load_from_args(args)
+    cases = load_test_cases(args.prompts, config["initial_prompts"])
+
+    start = time.perf_counter()
+    with open(args.output, "w") as output:
+        records = asyncio.run(run_batch(cases, config, index, args, output, os.environ.get("GOOGLE_API_KEY")))
+    summary = summarize(records, time.perf_counter() - start)
+
+    summary_path = f"{os.path.splitext(args.output)[0]}.summary.json"
+    with open(summary_path, "w") as f:
+        json.dump(summary, f, indent=2)
+    json.dump(summary, sys.stdout, indent=2)
+    print()
+    return 1 if summary["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
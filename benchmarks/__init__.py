@@ -0,0 +1 @@
+"""Benchmarks for the chatbot builder, run against a local fake Gemini backend."""
@@ -0,0 +1,91 @@
+# benchmarks/__main__.py
+"""
+Run the benchmark suite against the local fake Gemini backend.
+
+Usage:
+    python -m benchmarks [--quick] [--suite context] [--output bench.json] [--compare previous.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+SUITES = ["context", "ingestion", "templates", "app", "startup"]
+
+
+def result_key(record):
+    return record["name"], json.dumps(record["params"], sort_keys=True)
+
+
+def compare(results, previous_path, threshold):
+    """Print median changes against a previous results file; return the number of regressions."""
+    with open(previous_path, "r") as f:
+        previous = {result_key(record): record for record in json.load(f)["results"]}
+    regressions = 0
+    for record in results:
+        before = previous.get(result_key(record))
+        if before is None:
+            continue
+        ratio = record["stats"]["median"] / max(before["stats"]["median"], 1e-12)
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(f"{record['name']:<26} {json.dumps(record['params']):<60} {ratio:6.2f}x{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the chatbot builder.")
+    parser.add_argument("--suite", action="append", choices=SUITES, help="Suite to run (default: all)")
+    parser.add_argument("--quick", action="store_true", help="Smaller sizes and fewer repeats")
+    parser.add_argument("--output", default="bench_results.json", help="JSON file for the results")
+    parser.add_argument("--compare", help="Previous results file to compare medians against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Slowdown that counts as a regression")
+    parser.add_argument("--latency", type=float, default=0.0, help="Fake backend first-token latency in seconds")
+    parser.add_argument("--chunk-latency", type=float, default=0.0, help="Fake backend latency between chunks")
+    args = parser.parse_args(argv)
+
+    # Keep benchmark caches away from the app's own, before any app module reads the setting
+    os.environ["CHATBOT_CACHE_DIR"] = tempfile.mkdtemp(prefix="chatbot-bench-")
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    import fake_gemini
+    fake_gemini.install(first_token_latency=args.latency, chunk_latency=args.chunk_latency)
+
+    # Measure the app, not the request rate limit
+    import scheduler
+    scheduler.get_scheduler().configure(rate_per_minute=0)
+
+    import importlib
+    results = []
+    for suite in args.suite or SUITES:
+        print(f"Running {suite} benchmarks...", file=sys.stderr)
+        module = importlib.import_module(f"benchmarks.bench_{suite}")
+        for record in module.run(quick=args.quick):
+            record["suite"] = suite
+            results.append(record)
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "quick": args.quick,
+        "fake_latency": args.latency,
+        "results": results
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}", file=sys.stderr)
+
+    if args.compare:
+        return 1 if compare(results, args.compare, args.threshold) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,37 @@
+# benchmarks/bench_app.py
+"""Full-script run and rerun time of app.py through Streamlit's AppTest."""
+
+import os
+import time
+
+from streamlit.testing.v1 import AppTest
+
+from benchmarks import fixtures
+from benchmarks.timing import measure, result
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+
+def run(quick=False):
+    repeat = 5 if quick else 20
+    results = []
+
+    start = time.perf_counter()
+    app = AppTest.from_file(APP_PATH, default_timeout=60).run()
+    results.append(result("app_first_run", {"repeat": 1, "median": time.perf_counter() - start}))
+
+    results.append(result("app_rerun", measure(app.run, repeat=repeat, warmup=1), history_messages=0))
+
+    # Reruns once an API key is entered, which configures the Gemini client
+    app.sidebar.text_input[0].input("benchmark-key").run()
+    results.append(result("app_rerun_with_key", measure(app.run, repeat=repeat, warmup=1)))
+
+    # Reruns with a long chat, e.g. when a slider moves
+    for num_messages in [50] if quick else [50, 200]:
+        app.session_state["messages"] = fixtures.make_messages(num_messages)
+        results.append(result(
+            "app_rerun",
+            measure(app.run, repeat=repeat, warmup=1),
+            history_messages=num_messages
+        ))
+    return results
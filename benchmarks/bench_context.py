@@ -0,0 +1,88 @@
+# benchmarks/bench_context.py
+"""Cost of building and sending a chat turn as history and documents grow."""
+
+import streamlit as st
+
+import history
+import ingestion
+import retrieval
+import templates
+import utils
+from benchmarks import fixtures
+from benchmarks.timing import measure, result
+
+
+def reset_session(messages, index):
+    """Put the builder's session state into a known configuration."""
+    st.session_state.clear()
+    st.session_state.GOOGLE_API_KEY = "benchmark"
+    st.session_state.model = "gemini-1.5-flash"
+    st.session_state.temperature = 0.7
+    st.session_state.system_prompt = templates.get_template_text("Basic Assistant", bot_name="Benchmark")
+    st.session_state.messages = list(messages)
+    # Large enough that the whole history is sent verbatim
+    st.session_state.history_budgets = {st.session_state.model: 10 ** 9}
+    st.session_state.history_manager = history.HistoryManager()
+    st.session_state.document_index = index
+    st.session_state.documents = {}
+    st.session_state.retrieval_top_k = 5
+    st.session_state.retrieval_budget = 4000
+    st.session_state.cache_fresh_samples = True
+
+
+def build_index(num_pages):
+    """Index a generated PDF with the given number of pages."""
+    if not num_pages:
+        return None
+    _, chunks, _, _ = ingestion.ingest_file("benchmark.pdf", fixtures.make_pdf(num_pages, seed=num_pages))
+    return retrieval.BM25Index(chunks, load_text=ingestion.read_chunk)
+
+
+def run(quick=False):
+    history_sizes = [0, 20, 200] if quick else [0, 20, 100, 400, 1000]
+    document_pages = [0, 20] if quick else [0, 20, 100, 400]
+    repeat = 10 if quick else 30
+    results = []
+
+    for num_pages in document_pages:
+        index = build_index(num_pages)
+        for num_messages in history_sizes:
+            reset_session(fixtures.make_messages(num_messages), index)
+            counter = iter(range(10 ** 9))
+
+            def turn():
+                # A new prompt each time so the response cache never answers
+                prompt = f"question {next(counter)} about photosynthesis"
+                st.session_state.messages.append({"role": "user", "content": prompt})
+                response = utils.get_gemini_response(prompt)
+                st.session_state.messages.append({"role": "assistant", "content": response})
+
+            results.append(result(
+                "chat_turn",
+                measure(turn, repeat=repeat),
+                history_messages=num_messages,
+                document_pages=num_pages
+            ))
+
+            # Cost of rebuilding the chat session, e.g. after a configuration change
+            def rebuild():
+                st.session_state.chat_session = None
+                st.session_state.messages.append({"role": "user", "content": "rebuild"})
+                utils.get_chat_session()
+                st.session_state.messages.pop()
+
+            results.append(result(
+                "chat_session_rebuild",
+                measure(rebuild, repeat=repeat),
+                history_messages=num_messages,
+                document_pages=num_pages
+            ))
+
+        if index is not None:
+            results.append(result(
+                "retrieval",
+                measure(lambda: retrieval.retrieve(index, "photosynthesis in the chloroplast", 5, 4000), repeat=repeat),
+                document_pages=num_pages,
+                chunks=len(index)
+            ))
+    return results
@@ -0,0 +1,50 @@
+# benchmarks/bench_ingestion.py
+"""Document ingestion throughput on generated PDF and DOCX files."""
+
+import tempfile
+import time
+
+import ingestion
+from benchmarks import fixtures
+from benchmarks.timing import measure, result, summarize
+
+
+def run(quick=False):
+    pdf_pages = [10, 50] if quick else [10, 50, 200]
+    docx_paragraphs = [100] if quick else [100, 1000]
+    repeat = 3 if quick else 5
+    results = []
+
+    # Start the worker processes outside the timed runs
+    ingestion.get_executor()
+
+    files = [(f"generated-{pages}.pdf", fixtures.make_pdf(pages), {"pages": pages}) for pages in pdf_pages]
+    files += [
+        (f"generated-{paragraphs}.docx", fixtures.make_docx(paragraphs), {"paragraphs": paragraphs})
+        for paragraphs in docx_paragraphs
+    ]
+
+    for name, data, params in files:
+        samples = []
+        for _ in range(repeat):
+            # A fresh cache each time so every run parses the file
+            with tempfile.TemporaryDirectory() as directory:
+                cache = ingestion.DocumentCache(directory)
+                start = time.perf_counter()
+                ingestion.ingest_file(name, data, cache=cache)
+                samples.append(time.perf_counter() - start)
+        stats = summarize(samples)
+        stats["megabytes_per_second"] = len(data) / 1e6 / stats["median"]
+        results.append(result("ingest_parse", stats, file=name, bytes=len(data), **params))
+
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ingestion.DocumentCache(directory)
+            ingestion.ingest_file(name, data, cache=cache)
+            results.append(result(
+                "ingest_cached",
+                measure(lambda: ingestion.ingest_file(name, data, cache=cache), repeat=repeat),
+                file=name,
+                bytes=len(data),
+                **params
+            ))
+    return results
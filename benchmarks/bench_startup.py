@@ -0,0 +1,64 @@
+# benchmarks/bench_startup.py
+"""Cold import time of the app modules, with a report of the slowest imports."""
+
+import os
+import subprocess
+import sys
+
+from benchmarks.timing import result, summarize
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = ["utils", "server", "batch_eval"]
+
+# Imports listed per module in the report
+REPORT_TOP = 12
+
+
+def import_profile(module):
+    """
+    Import a module in a fresh interpreter with -X importtime.
+
+    Returns:
+        (total seconds, {imported module: cumulative seconds})
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_DIR,
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    cumulative = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, total, name = line.split("|")
+        cumulative[name.strip()] = int(total) / 1e6
+    return cumulative[module], cumulative
+
+
+def print_report(module, cumulative):
+    """Print the slowest top-level packages imported by a module."""
+    packages = {}
+    for name, seconds in cumulative.items():
+        package = name.split(".")[0]
+        if package != module:
+            packages[package] = max(packages.get(package, 0.0), seconds)
+    lazy = "not imported" if "google.generativeai" not in cumulative else "imported"
+    print(f"  {module}: {cumulative[module]:.3f}s (Gemini SDK {lazy})", file=sys.stderr)
+    for package, seconds in sorted(packages.items(), key=lambda item: -item[1])[:REPORT_TOP]:
+        print(f"    {package:<32} {seconds:.3f}s", file=sys.stderr)
+
+
+def run(quick=False):
+    repeat = 2 if quick else 5
+    results = []
+    for module in MODULES:
+        samples = []
+        for _ in range(repeat):
+            seconds, cumulative = import_profile(module)
+            samples.append(seconds)
+        print_report(module, cumulative)
+        results.append(result("import_cold", summarize(samples), module=module))
+    return results
@@ -0,0 +1,67 @@
+# benchmarks/bench_templates.py
+"""Template rendering and registry cost."""
+
+import json
+import os
+import tempfile
+
+import templates
+from benchmarks.timing import measure, result
+
+
+def write_packs(directory, num_packs, per_pack):
+    """Write template packs with num_packs * per_pack parameterized templates."""
+    for pack in range(num_packs):
+        entries = [
+            {
+                "name": f"Template {pack}-{i}",
+                "parameters": [{"name": "topic", "default": "Science"}],
+                "prompt": "You are {bot_name}, an expert in {topic}. " * 20,
+                "initial_prompts": ["Tell me about {topic}.", "What is new in {topic}?"]
+            }
+            for i in range(per_pack)
+        ]
+        with open(os.path.join(directory, f"pack_{pack:04d}.json"), "w") as f:
+            json.dump({"templates": entries}, f)
+
+
+def run(quick=False):
+    repeat = 200 if quick else 2000
+    results = []
+    for name in templates.get_template_names():
+        params = {"bot_name": "Benchmark", **templates.get_template_defaults(name)}
+        results.append(result(
+            "template_text",
+            measure(lambda: templates.get_template_text(name, **params), repeat=repeat),
+            template=name
+        ))
+        results.append(result(
+            "template_initial_prompts",
+            measure(lambda: templates.get_default_initial_prompts(name, **params), repeat=repeat),
+            template=name
+        ))
+    results.append(result("template_names", measure(templates.get_template_names, repeat=repeat)))
+
+    # A deployment with many packs: loading once, lookups on a rerun, and a rescan with nothing changed
+    num_packs = 20 if quick else 100
+    with tempfile.TemporaryDirectory() as directory:
+        write_packs(directory, num_packs, per_pack=5)
+        registry = templates.TemplateRegistry(directory)
+        results.append(result(
+            "template_registry_load",
+            measure(lambda: templates.TemplateRegistry(directory).refresh(), repeat=5 if quick else 20, warmup=1),
+            templates=num_packs * 5
+        ))
+        registry.refresh()
+        results.append(result(
+            "template_registry_lookup",
+            measure(lambda: registry.get("Template 0-0")["prompt"].render({"bot_name": "B", "topic": "Art"}),
+                    repeat=repeat),
+            templates=num_packs * 5
+        ))
+        results.append(result(
+            "template_registry_rescan",
+            measure(lambda: registry.refresh(force=True), repeat=repeat // 10),
+            templates=num_packs * 5
+        ))
+    return results
@@ -0,0 +1,70 @@
+# benchmarks/fixtures.py
+
+import io
+import random
+
+WORDS = (
+    "photosynthesis mitochondria energy cell membrane protein enzyme reaction "
+    "chloroplast light water carbon dioxide glucose oxygen respiration gene "
+    "student teacher lesson analogy example concept theory evidence experiment"
+).split()
+
+
+def make_text(num_words, seed=0):
+    """Generate deterministic filler text."""
+    rng = random.Random(seed)
+    return " ".join(rng.choice(WORDS) for _ in range(num_words))
+
+
+def make_messages(num_messages, words_per_message=60, seed=0):
+    """Generate an alternating user/assistant chat history."""
+    return [
+        {
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": make_text(words_per_message, seed=seed + i)
+        }
+        for i in range(num_messages)
+    ]
+
+
+def make_pdf(num_pages, words_per_page=300, seed=0):
+    """Generate a PDF with one block of text per page, using Helvetica."""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>"]
+    kids = " ".join(f"{3 + 2 * i} 0 R" for i in range(num_pages))
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {num_pages} >>")
+    font_id = 3 + 2 * num_pages
+    for i in range(num_pages):
+        words = make_text(words_per_page, seed=seed + i).split()
+        lines = [" ".join(words[j:j + 12]) for j in range(0, len(words), 12)]
+        text = " T* ".join(f"({line}) Tj" for line in lines)
+        stream = f"BT /F1 10 Tf 14 TL 50 750 Td {text} ET"
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {4 + 2 * i} 0 R "
+            f"/Resources << /Font << /F1 {font_id} 0 R >> >> >>"
+        )
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+    objects.append("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for i, body in enumerate(objects):
+        offsets.append(out.tell())
+        out.write(f"{i + 1} 0 obj\n{body}\nendobj\n".encode("latin-1"))
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+    for offset in offsets:
+        out.write(f"{offset:010d} 00000 n \n".encode())
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+    return out.getvalue()
+
+
+def make_docx(num_paragraphs, words_per_paragraph=80, seed=0):
+    """Generate a DOCX file with the given number of paragraphs."""
+    import docx
+    document = docx.Document()
+    for i in range(num_paragraphs):
+        document.add_paragraph(make_text(words_per_paragraph, seed=seed + i))
+    out = io.BytesIO()
+    document.save(out)
+    return out.getvalue()
@@ -0,0 +1,515 @@
+# benchmarks/load_test.py
+"""
+Load test a real app.py server with many concurrent simulated users.
+
+Each simulated user connects over Streamlit's websocket the way a browser
+tab does and goes through the builder: it enters an API key, switches
+template, uploads and processes a document, and sends chat messages. Every
+script run it triggers is timed. The server runs the local fake Gemini
+backend with the given latency, so the numbers measure the app and Streamlit
+rather than the API.
+
+Usage:
+    python -m benchmarks.load_test [--sessions 20] [--turns 3] [--latency 0.3] [--output load.json]
+
+The simulated users need websockets (the client side of Streamlit's
+websocket) and requests (document uploads), which the app itself does not
+use and must be installed separately:
+    pip install websockets requests
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import numpy as np
+
+from benchmarks import fixtures
+from benchmarks.timing import result, summarize
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(REPO_DIR, "app.py")
+
+API_KEY = "load-test-key"
+
+# Seconds to wait for the server to answer its health check
+STARTUP_TIMEOUT = 60
+
+
+def serve(port, latency, chunk_latency):
+    """Run app.py under `streamlit run` with the fake Gemini backend installed in the same process."""
+    sys.path.insert(0, REPO_DIR)
+
+    import fake_gemini
+    fake_gemini.install(first_token_latency=latency, chunk_latency=chunk_latency)
+
+    # Measure the app, not the request rate limit
+    import scheduler
+    scheduler.get_scheduler().configure(rate_per_minute=0)
+
+    from streamlit.web import cli
+    sys.argv = [
+        "streamlit", "run", APP_PATH,
+        "--server.port", str(port),
+        "--server.address", "127.0.0.1",
+        "--server.headless", "true",
+        "--server.enableXsrfProtection", "false",
+        "--server.fileWatcherType", "none",
+        "--logger.level", "error",
+        "--browser.gatherUsageStats", "false"
+    ]
+    return cli.main()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port, latency, chunk_latency, cache_dir):
+    """Start the app server in a subprocess and wait until it is healthy."""
+    env = dict(os.environ, CHATBOT_CACHE_DIR=cache_dir, CHATBOT_RPM="0")
+    process = subprocess.Popen(
+        [
+            sys.executable, "-m", "benchmarks.load_test", "--serve",
+            "--port", str(port), "--latency", str(latency), "--chunk-latency", str(chunk_latency)
+        ],
+        cwd=REPO_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"The app server exited with code {process.returncode}")
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=1) as response:
+                if response.status == 200:
+                    return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"The app server did not start within {STARTUP_TIMEOUT}s")
+
+
+def process_tree_rss(pid):
+    """
+    Return the resident memory in bytes of a process and its children,
+    e.g. the ingestion workers, or None where /proc is not available.
+    """
+    pids = [pid]
+    try:
+        for entry in os.scandir("/proc"):
+            if not entry.name.isdigit():
+                continue
+            try:
+                with open(os.path.join(entry.path, "stat"), "r") as f:
+                    # The parent ID is the second field after the parenthesized command name
+                    if int(f.read().rsplit(")", 1)[1].split()[1]) == pid:
+                        pids.append(int(entry.name))
+            except (OSError, ValueError, IndexError):
+                continue
+    except OSError:
+        return None
+
+    total = 0
+    for child in pids:
+        try:
+            with open(f"/proc/{child}/status", "r") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+        except OSError:
+            continue
+    return total
+
+
+def process_cpu_seconds(pid):
+    """Return the user and system CPU time a process has used, or None where /proc is not available."""
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def latency_stats(samples):
+    """Return summarize's statistics plus the p50, p90 and p99 of a list of timings."""
+    stats = summarize(samples)
+    for percentile in (50, 90, 99):
+        stats[f"p{percentile}"] = float(np.percentile(samples, percentile))
+    return stats
+
+
+class SessionError(Exception):
+    """A simulated session could not go on, e.g. after a timeout or a missing widget."""
+
+
+class SimulatedSession:
+    """
+    One browser tab talking to the app over Streamlit's websocket protocol.
+
+    Widget values the user has set are sent with every rerun, as the browser
+    does; button clicks and chat messages only with the rerun they trigger.
+    The elements of the last completed run are kept by type and label so the
+    next interaction can find its widget.
+    """
+
+    def __init__(self, port, name, timeout):
+        self.port = port
+        self.name = name
+        self.timeout = timeout
+        self.session_id = None
+        self.elements = {}      # (element type, label) -> element proto
+        self.errors = []        # messages of exceptions and errors shown by the app
+        self.timings = []       # (action, seconds)
+        self._widget_states = {}  # widget ID -> WidgetState sent with every rerun
+        self._websocket = None
+        self._request_ids = itertools.count(1)
+
+    async def connect(self):
+        from websockets.asyncio.client import connect
+
+        self._websocket = await connect(
+            f"ws://127.0.0.1:{self.port}/_stcore/stream",
+            subprotocols=["streamlit"],
+            max_size=None,
+            open_timeout=self.timeout
+        )
+
+    async def close(self):
+        if self._websocket is not None:
+            await self._websocket.close()
+
+    async def _send(self, back_msg):
+        await self._websocket.send(back_msg.SerializeToString())
+
+    async def _receive(self):
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        data = await asyncio.wait_for(self._websocket.recv(), self.timeout)
+        return ForwardMsg.FromString(data)
+
+    def _handle_delta(self, msg):
+        delta = msg.delta
+        if delta.WhichOneof("type") != "new_element":
+            return
+        element = delta.new_element
+        element_type = element.WhichOneof("type")
+        proto = getattr(element, element_type)
+        if element_type == "exception":
+            self.errors.append(f"{proto.type}: {proto.message}")
+        elif element_type == "alert" and proto.format == proto.ERROR:
+            self.errors.append(proto.body)
+        # Chat inputs have no label and are known by their placeholder
+        label = proto.placeholder if element_type == "chat_input" else getattr(proto, "label", None)
+        if label is not None:
+            self.elements[(element_type, label)] = proto
+
+    async def rerun(self, action, trigger=None):
+        """
+        Run the script with the current widget values and wait until it finishes, timing it as action.
+
+        Args:
+            action: Name the run is reported under
+            trigger: WidgetState sent with this run only, e.g. a click
+        """
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        back_msg = BackMsg()
+        widget_states = list(self._widget_states.values()) + ([trigger] if trigger is not None else [])
+        back_msg.rerun_script.widget_states.widgets.extend(widget_states)
+
+        start = time.perf_counter()
+        await self._send(back_msg)
+        while True:
+            try:
+                msg = await self._receive()
+            except asyncio.TimeoutError:
+                raise SessionError(f"{action} did not finish within {self.timeout}s")
+            msg_type = msg.WhichOneof("type")
+            if msg_type == "new_session":
+                # Every run, including one started by st.rerun(), draws the page again
+                self.session_id = msg.new_session.initialize.session_id
+                self.elements = {}
+            elif msg_type == "delta":
+                self._handle_delta(msg)
+            elif msg_type == "script_finished":
+                if msg.script_finished != ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                    break
+        self.timings.append((action, time.perf_counter() - start))
+
+    def widget(self, element_type, label):
+        proto = self.elements.get((element_type, label))
+        if proto is None:
+            raise SessionError(f"No {element_type} labelled {label!r} on the page")
+        return proto
+
+    def set_value(self, element_type, label, **value):
+        """Set a widget's value, e.g. string_value="...", for this and every later rerun."""
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        proto = self.widget(element_type, label)
+        self._widget_states[proto.id] = WidgetState(id=proto.id, **value)
+
+    def trigger(self, element_type, label, **value):
+        """Return the WidgetState of a click or message, sent with the next rerun only."""
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        return WidgetState(id=self.widget(element_type, label).id, **value)
+
+    async def upload(self, label, files):
+        """
+        Upload files to a file uploader the way the browser does.
+
+        Args:
+            label: Label of the file uploader
+            files: List of (file name, bytes, MIME type)
+        """
+        import requests
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.Common_pb2 import FileUploaderState
+
+        request_id = str(next(self._request_ids))
+        back_msg = BackMsg()
+        back_msg.file_urls_request.request_id = request_id
+        back_msg.file_urls_request.session_id = self.session_id
+        back_msg.file_urls_request.file_names.extend(name for name, _, _ in files)
+        await self._send(back_msg)
+        while True:
+            try:
+                msg = await self._receive()
+            except asyncio.TimeoutError:
+                raise SessionError(f"No upload URLs within {self.timeout}s")
+            if msg.WhichOneof("type") == "file_urls_response" and msg.file_urls_response.response_id == request_id:
+                break
+
+        state = FileUploaderState()
+        for (name, data, mime_type), urls in zip(files, msg.file_urls_response.file_urls):
+            response = await asyncio.to_thread(
+                requests.put,
+                f"http://127.0.0.1:{self.port}{urls.upload_url}",
+                files={"file": (name, data, mime_type)},
+                timeout=self.timeout
+            )
+            response.raise_for_status()
+            info = state.uploaded_file_info.add(file_id=urls.file_id, name=name, size=len(data))
+            info.file_urls.CopyFrom(urls)
+        self.set_value("file_uploader", label, file_uploader_state_value=state)
+
+
+async def run_user(session, index, turns, doc_pages, think_time, shared_prompts):
+    """Go through the builder as one user: API key, template, document and chat turns."""
+
+    async def think():
+        if think_time:
+            await asyncio.sleep(think_time)
+
+    await session.rerun("load")
+    await think()
+
+    session.set_value("text_input", "Google Gemini API Key", string_value=API_KEY)
+    await session.rerun("api_key")
+    await think()
+
+    options = list(session.widget("selectbox", "Choose a template:").options)
+    template = options[1 + index % (len(options) - 1)] if len(options) > 1 else options[0]
+    session.set_value("selectbox", "Choose a template:", string_value=template)
+    await session.rerun("template")
+    await think()
+
+    if doc_pages:
+        label = "Upload documents for context (PDF, DOCX, TXT)"
+        # A different document per user, so every session parses and indexes its own
+        document = fixtures.make_pdf(doc_pages, seed=index)
+        await session.upload(label, [(f"load-test-{index}.pdf", document, "application/pdf")])
+        await session.rerun("upload")
+        await session.rerun("process_documents", session.trigger("button", "Process Documents", trigger_value=True))
+        await think()
+
+    for turn in range(turns):
+        owner = "every user" if shared_prompts else f"user {index}"
+        prompt = f"Question {turn + 1} from {owner}: what should I know about {fixtures.make_text(8, seed=turn)}?"
+        chat = session.trigger("chat_input", "Type a message to test your bot...")
+        chat.chat_input_value.data = prompt
+        await session.rerun("chat_turn", chat)
+        await think()
+
+
+async def run_sessions(port, args, ready, connected):
+    """
+    Run every simulated user concurrently and keep them connected until all are done.
+
+    Args:
+        ready: Called once every user has finished, while all sessions are still open
+        connected: Number of users started, for starting them over the ramp-up time
+
+    Returns:
+        (sessions, failures, wall seconds)
+    """
+    from websockets.exceptions import WebSocketException
+
+    sessions = [SimulatedSession(port, f"user-{index}", args.timeout) for index in range(args.sessions)]
+    failures = []
+
+    async def one(index, session):
+        if args.ramp_up and args.sessions > 1:
+            await asyncio.sleep(args.ramp_up * index / (args.sessions - 1))
+        try:
+            await session.connect()
+            connected.append(index)
+            await run_user(session, index, args.turns, args.doc_pages, args.think_time, args.shared_prompts)
+        except (SessionError, WebSocketException, OSError) as e:
+            failures.append(f"{session.name}: {e}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(index, session) for index, session in enumerate(sessions)))
+    wall = time.perf_counter() - start
+    ready()
+    await asyncio.gather(*(session.close() for session in sessions), return_exceptions=True)
+    return sessions, failures, wall
+
+
+def print_report(report):
+    print(f"{report['sessions']} sessions, {report['wall_seconds']:.1f}s", file=sys.stderr)
+    print(f"  {'action':<20} {'runs':>6} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}", file=sys.stderr)
+    for record in report["results"]:
+        if record["name"] != "load_rerun":
+            continue
+        stats = record["stats"]
+        print(
+            f"  {record['params']['action']:<20} {stats['repeat']:>6} {stats['p50']:>7.3f}s "
+            f"{stats['p90']:>7.3f}s {stats['p99']:>7.3f}s {stats['max']:>7.3f}s",
+            file=sys.stderr
+        )
+    throughput = report["throughput"]
+    print(
+        f"  throughput: {throughput['reruns_per_second']:.2f} reruns/s, "
+        f"{throughput['turns_per_second']:.2f} chat turns/s",
+        file=sys.stderr
+    )
+    memory = report["memory"]
+    if memory["per_session_bytes"] is not None:
+        print(
+            f"  memory: {memory['baseline_bytes'] / 1e6:.0f} MB baseline, "
+            f"{memory['peak_bytes'] / 1e6:.0f} MB with all sessions open, "
+            f"{memory['per_session_bytes'] / 1e6:.1f} MB per session",
+            file=sys.stderr
+        )
+    if report["cpu_seconds"] is not None:
+        print(f"  server CPU: {report['cpu_seconds']:.1f}s", file=sys.stderr)
+    print(f"  errors: {len(report['errors'])}, failed sessions: {len(report['failures'])}", file=sys.stderr)
+    for message in (report["failures"] + report["errors"])[:10]:
+        print(f"    {message}", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the chatbot builder with simulated users.")
+    parser.add_argument("--sessions", type=int, default=20, help="Concurrent simulated users")
+    parser.add_argument("--turns", type=int, default=3, help="Chat messages each user sends")
+    parser.add_argument("--doc-pages", type=int, default=5, help="Pages of the PDF each user processes (0 to skip)")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Seconds each user waits between actions")
+    parser.add_argument("--ramp-up", type=float, default=0.0, help="Seconds over which the users connect")
+    parser.add_argument("--shared-prompts", action="store_true",
+                        help="Every user asks the same questions, so the response cache answers most of them")
+    parser.add_argument("--latency", type=float, default=0.3, help="Fake backend first-token latency in seconds")
+    parser.add_argument("--chunk-latency", type=float, default=0.05, help="Fake backend latency between chunks")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Seconds a single rerun may take")
+    parser.add_argument("--port", type=int, default=0, help="Server port (default: a free one)")
+    parser.add_argument("--output", default="load_results.json", help="JSON file for the results")
+    parser.add_argument("--compare", help="Previous results file to compare medians against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Slowdown that counts as a regression")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        return serve(args.port, args.latency, args.chunk_latency)
+
+    port = args.port or free_port()
+    with tempfile.TemporaryDirectory(prefix="chatbot-load-") as cache_dir:
+        print(f"Starting the app server on port {port}...", file=sys.stderr)
+        server = start_server(port, args.latency, args.chunk_latency, cache_dir)
+        try:
+            # One user first, so imports, worker processes and caches are warm before measuring
+            warmup_args = argparse.Namespace(**{**vars(args), "sessions": 1, "ramp_up": 0.0, "think_time": 0.0})
+            _, warmup_failures, _ = asyncio.run(run_sessions(port, warmup_args, lambda: None, []))
+            if warmup_failures:
+                raise RuntimeError(f"The warm-up session failed: {warmup_failures[0]}")
+            baseline = process_tree_rss(server.pid)
+            cpu_start = process_cpu_seconds(server.pid)
+
+            print(f"Running {args.sessions} simulated users...", file=sys.stderr)
+            peak = []
+            connected = []
+            sessions, failures, wall = asyncio.run(run_sessions(
+                port,
+                args,
+                lambda: peak.append(process_tree_rss(server.pid)),
+                connected
+            ))
+            cpu_end = process_cpu_seconds(server.pid)
+        finally:
+            server.terminate()
+            server.wait()
+
+    timings = {}
+    for session in sessions:
+        for action, seconds in session.timings:
+            timings.setdefault(action, []).append(seconds)
+    params = {"sessions": args.sessions, "turns": args.turns, "doc_pages": args.doc_pages}
+    results = [
+        result("load_rerun", latency_stats(samples), action=action, **params)
+        for action, samples in timings.items()
+    ]
+
+    peak_rss = peak[0] if peak else None
+    per_session = None
+    if baseline is not None and peak_rss is not None and connected:
+        per_session = (peak_rss - baseline) / len(connected)
+    reruns = sum(len(samples) for samples in timings.values())
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "sessions": args.sessions,
+        "turns": args.turns,
+        "doc_pages": args.doc_pages,
+        "think_time": args.think_time,
+        "fake_latency": args.latency,
+        "wall_seconds": wall,
+        "throughput": {
+            "reruns_per_second": reruns / wall,
+            "turns_per_second": len(timings.get("chat_turn", [])) / wall
+        },
+        "memory": {"baseline_bytes": baseline, "peak_bytes": peak_rss, "per_session_bytes": per_session},
+        "cpu_seconds": cpu_end - cpu_start if cpu_start is not None and cpu_end is not None else None,
+        "errors": [f"{session.name}: {error}" for session in sessions for error in session.errors],
+        "failures": failures,
+        "results": results
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print_report(report)
+    print(f"Wrote {len(results)} results to {args.output}", file=sys.stderr)
+
+    if args.compare:
+        from benchmarks.__main__ import compare
+        if compare(results, args.compare, args.threshold):
+            return 1
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
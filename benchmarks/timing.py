@@ -0,0 +1,42 @@
+# benchmarks/timing.py
+
+import time
+
+import numpy as np
+
+
+def measure(function, repeat=20, warmup=2):
+    """
+    Time a function call and return summary statistics in seconds.
+
+    Args:
+        function: Callable taking no arguments
+        repeat: Number of timed calls
+        warmup: Number of untimed calls made first
+    """
+    for _ in range(warmup):
+        function()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def summarize(samples):
+    """Return min/mean/median/p95/max statistics for a list of timings."""
+    samples = np.asarray(samples, dtype=float)
+    return {
+        "repeat": int(samples.size),
+        "min": float(samples.min()),
+        "mean": float(samples.mean()),
+        "median": float(np.median(samples)),
+        "p95": float(np.percentile(samples, 95)),
+        "max": float(samples.max())
+    }
+
+
+def result(name, stats, **params):
+    """Build one benchmark result record."""
+    return {"name": name, "params": params, "stats": stats}
@@ -0,0 +1,118 @@
+# bot_config.py
+
+import json
+import os
+
+from dotenv import load_dotenv
+
+import bundle
+import embeddings
+import ingestion
+import retrieval
+import templates
+
+DEFAULT_TEMPLATE = "Basic Assistant"
+DEFAULT_SETTINGS = {"bot_name": "Gemini Assistant", "model": "gemini-1.5-pro", "temperature": 0.7}
+
+
+def parse_params(pairs):
+    """Parse key=value template parameters."""
+    params = {}
+    for pair in pairs or []:
+        key, _, value = pair.partition("=")
+        params[key] = value
+    return params
+
+
+def load_bot_config(settings_path=None, system_prompt_path=None, template=DEFAULT_TEMPLATE,
+                    template_params=None, initial_prompts_path=None):
+    """
+    Load a bot configuration as exported by the builder.
+
+    The system prompt comes from an exported system_prompt.txt if given,
+    otherwise from the named template. Returns a dict with bot_name, model,
+    temperature, system_prompt and initial_prompts.
+    """
+    config = dict(DEFAULT_SETTINGS)
+    if settings_path:
+        with open(settings_path, "r") as f:
+            config.update(json.load(f))
+
+    params = {
+        "bot_name": config["bot_name"],
+        **templates.get_template_defaults(template),
+        **(template_params or {})
+    }
+    if system_prompt_path:
+        with open(system_prompt_path, "r") as f:
+            config["system_prompt"] = f.read()
+    else:
+        config["system_prompt"] = templates.get_template_text(template, **params)
+
+    if initial_prompts_path:
+        with open(initial_prompts_path, "r") as f:
+            config["initial_prompts"] = f.read()
+    else:
+        config["initial_prompts"] = templates.get_default_initial_prompts(template, **params)
+    return config
+
+
+def build_document_index(paths, method="keyword"):
+    """Ingest documents from disk into a keyword or semantic index, or return None without documents."""
+    if not paths:
+        return None
+    documents = []
+    for path in paths:
+        with open(path, "rb") as f:
+            digest, file_chunks, _, _ = ingestion.ingest_file(os.path.basename(path), f.read())
+        documents.append((digest, file_chunks))
+    if method == "semantic":
+        return embeddings.build_semantic_index(documents, ingestion.read_chunk)
+    chunks = [chunk for _, file_chunks in documents for chunk in file_chunks]
+    return retrieval.BM25Index(chunks, load_text=ingestion.read_chunk)
+
+
+def add_arguments(parser):
+    """Add the bot configuration and backend options shared by the headless entry points."""
+    parser.add_argument("--bundle", help="Exported bot bundle (overrides the configuration and document options)")
+    parser.add_argument("--settings", help="Exported settings.json")
+    parser.add_argument("--system-prompt", help="Exported system_prompt.txt (overrides --template)")
+    parser.add_argument("--template", default=DEFAULT_TEMPLATE, choices=templates.get_template_names())
+    parser.add_argument("--param", action="append", metavar="KEY=VALUE", help="Template parameter")
+    parser.add_argument("--initial-prompts", help="Exported initial_prompts.txt")
+    parser.add_argument("--documents", nargs="*", help="Reference documents (PDF, DOCX, TXT)")
+    parser.add_argument("--retrieval", default="keyword", choices=["keyword", "semantic"],
+                        help="How document chunks are matched to messages")
+    parser.add_argument("--top-k", type=int, default=5, help="Document chunks per message")
+    parser.add_argument("--budget", type=int, default=4000, help="Reference budget in characters")
+    parser.add_argument("--fake", action="store_true", help="Use the local fake Gemini backend")
+    parser.add_argument("--fake-latency", type=float, default=0.3, help="Fake backend first-token latency in seconds")
+
+
+def configure_backend(parser, args):
+    """Install the fake backend, or configure Gemini from GOOGLE_API_KEY."""
+    if args.fake:
+        import fake_gemini
+        fake_gemini.install(first_token_latency=args.fake_latency)
+        return
+    load_dotenv()
+    if not os.environ.get("GOOGLE_API_KEY"):
+        parser.error("GOOGLE_API_KEY is not set (use --fake for an offline run)")
+    import google.generativeai as genai
+    genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
+
+
+def load_from_args(args):
+    """Return (config, document index) for parsed command-line arguments."""
+    if args.bundle:
+        imported = bundle.import_bundle(args.bundle)
+        config = {**DEFAULT_SETTINGS, **{k: v for k, v in imported["config"].items() if v is not None}}
+        return config, imported["index"]
+    config = load_bot_config(
+        args.settings,
+        args.system_prompt,
+        args.template,
+        parse_params(args.param),
+        args.initial_prompts
+    )
+    return config, build_document_index(args.documents, args.retrieval)
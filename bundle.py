@@ -0,0 +1,361 @@
+# bundle.py
+
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import threading
+import zipfile
+
+import numpy as np
+
+import embeddings
+import history
+import ingestion
+import response_cache
+import retrieval
+
+BUNDLE_FORMAT = 1
+
+# Index arrays extracted from imported bundles, memory-mapped from here
+BUNDLE_DIR = os.path.join(response_cache.CACHE_DIR, "bundles")
+
+MANIFEST_NAME = "bundle.json"
+
+CONFIG_FIELDS = ("bot_name", "template", "system_prompt", "initial_prompts", "model", "temperature")
+
+BM25_ARRAYS = ("term_ptr", "term_docs", "term_weights")
+
+DIGEST_PATTERN = re.compile(r"[0-9a-f]{64}")
+
+# Largest manifest and stored index an import accepts, in bytes
+MANIFEST_LIMIT = 16 * 1024 * 1024
+INDEX_SIZE_LIMIT = 4 * ingestion.SESSION_TEXT_LIMIT
+
+
+def document_member(digest):
+    return f"documents/{digest}.txt"
+
+
+def vector_member(digest, embedder):
+    return f"vectors/{digest}.{embedder.name}.f32"
+
+
+def index_order_matches(documents, index):
+    """Return True if the index chunks are the documents' chunks in order, as build_document_index makes them."""
+    chunks = [chunk for document in documents.values() for chunk in document["chunks"]]
+    if index is None or len(index) != len(chunks):
+        return False
+    return all(
+        a["path"] == b["path"] and a["start"] == b["start"]
+        for a, b in zip(index.chunks, chunks)
+    )
+
+
+def write_bundle(output, config, documents, index=None, template_params=None, retrieval_settings=None):
+    """
+    Write a bot as a zip bundle: configuration, extracted document text and the document index.
+
+    Document text is compressed. Index arrays are stored uncompressed as
+    .npy and raw float32 files, so an importer can memory-map them as they are.
+
+    Args:
+        output: Path or binary file object to write to
+        config: Dict with the CONFIG_FIELDS
+        documents: Ingested documents keyed by content hash
+        index: The documents' BM25Index or SemanticIndex, if any
+        template_params: Parameters the template was filled in with
+        retrieval_settings: Dict with the retrieval method, top_k and budget
+    """
+    if not index_order_matches(documents, index):
+        index = None
+
+    manifest = {
+        "format": BUNDLE_FORMAT,
+        "config": {field: config.get(field) for field in CONFIG_FIELDS},
+        "template_params": template_params or {},
+        "retrieval": retrieval_settings or {},
+        "documents": [
+            {
+                "digest": digest,
+                "name": document["name"],
+                "size": document["size"],
+                "spans": [[chunk["start"], chunk["end"]] for chunk in document["chunks"]]
+            }
+            for digest, document in documents.items()
+        ],
+        "index": None
+    }
+
+    with zipfile.ZipFile(output, "w", compression=zipfile.ZIP_DEFLATED) as bundle:
+        for digest, document in documents.items():
+            if document["chunks"]:
+                bundle.write(document["chunks"][0]["path"], document_member(digest))
+            else:
+                bundle.writestr(document_member(digest), b"")
+
+        if isinstance(index, retrieval.BM25Index):
+            arrays = index.to_arrays()
+            terms = sorted(arrays["vocabulary"], key=arrays["vocabulary"].get)
+            bundle.writestr("index/vocabulary.json", json.dumps(terms, ensure_ascii=False))
+            for name in BM25_ARRAYS:
+                buffer = io.BytesIO()
+                np.save(buffer, np.ascontiguousarray(arrays[name]))
+                bundle.writestr(f"index/{name}.npy", buffer.getvalue(), compress_type=zipfile.ZIP_STORED)
+            manifest["index"] = {"type": "bm25"}
+        elif isinstance(index, embeddings.SemanticIndex):
+            store = embeddings.VectorStore()
+            for digest, document in documents.items():
+                if document["chunks"]:
+                    bundle.write(
+                        store.path(digest, index.embedder),
+                        vector_member(digest, index.embedder),
+                        compress_type=zipfile.ZIP_STORED
+                    )
+            manifest["index"] = {"type": "semantic", "embedder": index.embedder.name}
+
+        bundle.writestr(MANIFEST_NAME, json.dumps(manifest, ensure_ascii=False, indent=2))
+
+
+def export_bundle(config, documents, index=None, template_params=None, retrieval_settings=None):
+    """Return a bot bundle as bytes; see write_bundle."""
+    output = io.BytesIO()
+    write_bundle(output, config, documents, index, template_params, retrieval_settings)
+    return output.getvalue()
+
+
+def read_manifest(bundle):
+    """Read and check the manifest of an open bundle."""
+    try:
+        manifest = json.loads(bundle.read(MANIFEST_NAME))
+    except KeyError:
+        raise ValueError("Not a bot bundle: bundle.json is missing")
+    if manifest.get("format") != BUNDLE_FORMAT:
+        raise ValueError(f"Unsupported bot bundle format: {manifest.get('format')}")
+    digests = [document["digest"] for document in manifest["documents"]]
+    for digest in digests:
+        if not isinstance(digest, str) or not DIGEST_PATTERN.fullmatch(digest):
+            raise ValueError(f"Invalid document hash in bundle: {digest}")
+    if len(set(digests)) != len(digests):
+        raise ValueError("Duplicate documents in bundle")
+    check_settings(manifest)
+    return manifest
+
+
+def check_settings(manifest):
+    """Check the bot settings of a manifest, which the app puts into session state."""
+    config = manifest.get("config")
+    settings = manifest.get("retrieval")
+    params = manifest.get("template_params")
+    if not isinstance(config, dict) or not isinstance(settings, dict) or not isinstance(params, dict):
+        raise ValueError("Invalid bot settings in bundle")
+    for field in ("bot_name", "template", "system_prompt", "initial_prompts"):
+        if config.get(field) is not None and not isinstance(config[field], str):
+            raise ValueError(f"Invalid {field} in bundle")
+    model = config.get("model")
+    if model is not None and (not isinstance(model, str) or model not in history.DEFAULT_HISTORY_BUDGETS):
+        raise ValueError(f"Unsupported model in bundle: {model}")
+    temperature = config.get("temperature")
+    if temperature is not None and (
+        isinstance(temperature, bool) or not isinstance(temperature, (int, float)) or not 0 <= temperature <= 1
+    ):
+        raise ValueError("Bundle temperature must be a number from 0 to 1")
+    for field in ("top_k", "budget"):
+        value = settings.get(field)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, int)):
+            raise ValueError(f"Invalid retrieval {field} in bundle")
+    if not all(isinstance(name, str) and isinstance(value, str) for name, value in params.items()):
+        raise ValueError("Invalid template parameters in bundle")
+
+
+def bundle_hash(source):
+    """Return the sha256 of a bundle's bytes; a file object is read from the start and rewound."""
+    digest = hashlib.sha256()
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+    source.seek(0)
+    for block in iter(lambda: source.read(1 << 20), b""):
+        digest.update(block)
+    source.seek(0)
+    return digest.hexdigest()
+
+
+def scoped_digest(key, digest):
+    """
+    Return the ID an imported document is cached under.
+
+    Nothing in a bundle can be checked against the content hash of the
+    original file, so imported text and vectors are never cached under it;
+    the ID depends on the bundle's bytes, which determine the text.
+    """
+    return hashlib.sha256(f"bundle:{key}:{digest}".encode("utf-8")).hexdigest()
+
+
+def member_size(bundle, name):
+    """Return the uncompressed size of a member; reading it never yields more than this."""
+    try:
+        return bundle.getinfo(name).file_size
+    except KeyError:
+        raise ValueError(f"Bot bundle is missing {name}")
+
+
+def check_spans(spans, size):
+    """Check that chunk spans lie within their document's text."""
+    if not isinstance(spans, list) or not all(
+        isinstance(span, list) and len(span) == 2 and all(isinstance(offset, int) for offset in span)
+        and 0 <= span[0] <= span[1] <= size
+        for span in spans
+    ):
+        raise ValueError("Invalid chunk spans in bundle")
+
+
+def check_bm25_arrays(arrays, num_terms, num_chunks):
+    """Check that stored BM25 arrays fit the vocabulary and chunks before they are searched."""
+    term_ptr, term_docs, term_weights = (arrays[name] for name in BM25_ARRAYS)
+    if not (
+        term_ptr.ndim == term_docs.ndim == term_weights.ndim == 1
+        and term_ptr.dtype.kind in "iu" and term_docs.dtype.kind in "iu" and term_weights.dtype.kind == "f"
+        and len(term_ptr) == num_terms + 1
+        and len(term_docs) == len(term_weights)
+        and term_ptr[0] == 0 and term_ptr[-1] == len(term_docs)
+        and np.all(np.diff(term_ptr) >= 0)
+        and (len(term_docs) == 0 or (term_docs.min() >= 0 and term_docs.max() < num_chunks))
+    ):
+        raise ValueError("Bundle index does not match its vocabulary and documents")
+
+
+def extract_bm25_arrays(bundle, key, num_terms, num_chunks, directory=BUNDLE_DIR):
+    """
+    Extract a bundle's BM25 arrays once, check them and return them memory-mapped.
+
+    Arrays are kept per bundle (by the hash of its bytes), so importing the
+    same bundle again maps the files already on disk.
+    """
+    target = os.path.join(directory, key)
+    if not os.path.isdir(target):
+        temp_dir = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+        os.makedirs(temp_dir, exist_ok=True)
+        for name in BM25_ARRAYS:
+            with bundle.open(f"index/{name}.npy") as source, open(os.path.join(temp_dir, f"{name}.npy"), "wb") as f:
+                shutil.copyfileobj(source, f)
+        try:
+            os.rename(temp_dir, target)
+        except OSError:
+            # Extracted by another session meanwhile
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    try:
+        arrays = {name: np.load(os.path.join(target, f"{name}.npy"), mmap_mode="r") for name in BM25_ARRAYS}
+        check_bm25_arrays(arrays, num_terms, num_chunks)
+    except ValueError:
+        shutil.rmtree(target, ignore_errors=True)
+        raise
+    return arrays
+
+
+def import_bundle(source, cache=None, api_key=None):
+    """
+    Restore a bot from a bundle without parsing, chunking or embedding anything again.
+
+    Bundles are untrusted: documents are cached under IDs scoped to the
+    bundle (see scoped_digest), member sizes are checked against the
+    session limit before anything is extracted, and the stored index is
+    checked against the documents before it is used.
+
+    Args:
+        source: Path or binary file object of the bundle
+        api_key: API key of the importing session, for a Gemini embedder
+
+    Returns:
+        Dict with "config", "template_params", "retrieval", "documents" keyed
+        by their scoped IDs as process_documents keeps them, and "index"
+        (None without documents)
+    """
+    cache = cache or ingestion.DocumentCache()
+    key = bundle_hash(source)
+    with zipfile.ZipFile(source) as bundle:
+        if member_size(bundle, MANIFEST_NAME) > MANIFEST_LIMIT:
+            raise ValueError("Bot bundle manifest is too large")
+        manifest = read_manifest(bundle)
+        index_info = manifest.get("index") or {}
+
+        sizes = {document["digest"]: member_size(bundle, document_member(document["digest"]))
+                 for document in manifest["documents"]}
+        total_size = sum(sizes.values())
+        if total_size > ingestion.SESSION_TEXT_LIMIT:
+            raise ValueError(
+                f"Bundle documents take {total_size / 1e6:.0f} MB, over the session limit of "
+                f"{ingestion.SESSION_TEXT_LIMIT / 1e6:.0f} MB"
+            )
+        if index_info.get("type") == "bm25":
+            index_members = ["index/vocabulary.json"] + [f"index/{name}.npy" for name in BM25_ARRAYS]
+        elif index_info.get("type") == "semantic":
+            embedder = embeddings.get_embedder_by_name(index_info["embedder"], api_key)
+            index_members = [vector_member(document["digest"], embedder)
+                             for document in manifest["documents"] if document["spans"]]
+        else:
+            index_members = []
+        if sum(member_size(bundle, name) for name in index_members) > INDEX_SIZE_LIMIT:
+            raise ValueError("Bundle index is over the size limit")
+
+        documents = {}
+        for document in manifest["documents"]:
+            digest = document["digest"]
+            check_spans(document["spans"], sizes[digest])
+            document_id = scoped_digest(key, digest)
+            if cache.get_spans(document_id) is None:
+                with bundle.open(document_member(digest)) as text:
+                    cache.add(document_id, text, document["spans"])
+            documents[document_id] = {
+                "name": document["name"],
+                "size": sizes[digest],
+                "chunks": ingestion.make_chunks(document["name"], cache.path(document_id), document["spans"])
+            }
+
+        chunks = [chunk for document in documents.values() for chunk in document["chunks"]]
+        if not documents:
+            index = None
+        elif index_info.get("type") == "bm25":
+            vocabulary = json.loads(bundle.read("index/vocabulary.json"))
+            if not isinstance(vocabulary, list) or not all(isinstance(term, str) for term in vocabulary):
+                raise ValueError("Invalid vocabulary in bundle")
+            index = retrieval.BM25Index.from_arrays(
+                chunks,
+                {term: term_id for term_id, term in enumerate(vocabulary)},
+                load_text=ingestion.read_chunk,
+                **extract_bm25_arrays(bundle, key, len(vocabulary), len(chunks))
+            )
+        elif index_info.get("type") == "semantic":
+            store = embeddings.VectorStore()
+            dimensions = getattr(embedder, "dimensions", None)
+            for (document_id, document), manifest_document in zip(documents.items(), manifest["documents"]):
+                rows = len(document["chunks"])
+                if not rows or store.load(document_id, embedder, rows) is not None:
+                    continue
+                member = vector_member(manifest_document["digest"], embedder)
+                size = member_size(bundle, member)
+                if size == 0 or size % (rows * 4) or dimensions not in (None, size // (rows * 4)):
+                    raise ValueError(f"Bundle vectors of {document['name']} do not match its chunks")
+                dimensions = size // (rows * 4)
+                with bundle.open(member) as vectors:
+                    store.add(document_id, embedder, vectors)
+            index = embeddings.build_semantic_index(
+                [(document_id, document["chunks"]) for document_id, document in documents.items()],
+                ingestion.read_chunk,
+                embedder=embedder,
+                store=store
+            )
+        else:
+            index = retrieval.BM25Index(chunks, load_text=ingestion.read_chunk)
+
+    return {
+        "config": manifest["config"],
+        "template_params": manifest["template_params"],
+        "retrieval": manifest["retrieval"],
+        "documents": documents,
+        "index": index
+    }
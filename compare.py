@@ -0,0 +1,62 @@
+# compare.py
+
+import time
+
+import async_loop
+import scheduler
+import telemetry
+
+
+async def generate(model_name, model, contents, label, context=None, api_key=None):
+    """
+    Generate one comparison answer and time it.
+
+    model_name is the plain name, e.g. "gemini-1.5-pro", as chat calls use it
+    for the rate limit and telemetry; model.model_name has a "models/" prefix.
+    """
+    start = time.perf_counter()
+    try:
+        with telemetry.track("compare", model_name, context=context) as record:
+            response = await scheduler.get_scheduler().call_async(
+                api_key,
+                model_name,
+                lambda: model.generate_content_async(contents)
+            )
+            telemetry.set_usage(record, response)
+            record["first_token"] = time.perf_counter() - start
+        return {
+            "label": label,
+            "text": response.text,
+            "latency": time.perf_counter() - start,
+            "prompt_tokens": record["prompt_tokens"],
+            "completion_tokens": record["completion_tokens"],
+            "error": None
+        }
+    except Exception as e:
+        return {
+            "label": label,
+            "text": "",
+            "latency": time.perf_counter() - start,
+            "prompt_tokens": None,
+            "completion_tokens": None,
+            "error": str(e)
+        }
+
+
+def start_comparison(runs, contents, context=None, api_key=None):
+    """
+    Send the same contents to several models at once.
+
+    Args:
+        runs: List of (label, model name, GenerativeModel) tuples
+        contents: Gemini contents (history plus the new user turn)
+        context: Context sizes recorded in telemetry
+        api_key: API key of the session, whose rate limit the calls count against
+
+    Returns:
+        A list of concurrent.futures.Future, one per run, each resolving to a result dict
+    """
+    return [
+        async_loop.submit(generate(model_name, model, contents, label, context, api_key))
+        for label, model_name, model in runs
+    ]
@@ -0,0 +1,219 @@
+# context_cache.py
+
+import datetime
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+import scheduler
+
+# Lifetime of a cached context on Gemini, in seconds; extended while it is in use
+CONTEXT_CACHE_TTL = int(os.environ.get("CHATBOT_CONTEXT_CACHE_TTL", 60 * 60))
+
+# Extend a cached context when it is used within this many seconds of expiring
+REFRESH_MARGIN = 5 * 60
+
+# Smallest context Gemini will cache, in tokens
+MIN_CACHE_TOKENS = 32768
+
+# Context caching needs a pinned model version
+CACHE_MODEL_VERSIONS = {
+    "gemini-1.5-pro": "models/gemini-1.5-pro-002",
+    "gemini-1.5-flash": "models/gemini-1.5-flash-002"
+}
+
+
+def estimate_document_tokens(documents):
+    """Roughly estimate the tokens in a set of documents from their text size."""
+    return sum(document["size"] for document in documents.values()) // 4
+
+
+def read_documents(documents):
+    """Read the full text of ingested documents from their spill files."""
+    parts = []
+    for document in documents.values():
+        if not document["chunks"]:
+            continue
+        with open(document["chunks"][0]["path"], "rb") as f:
+            text = f.read().decode("utf-8", errors="replace")
+        parts.append(f"Document: {document['name']}\n{text}")
+    return "\n\n".join(parts)
+
+
+def make_key(model_name, system_prompt, documents):
+    """Hash the model, system prompt and document set into a context key."""
+    payload = json.dumps([model_name, system_prompt, sorted(documents)], separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ContextCache:
+    """
+    Process-wide registry of system prompt plus document contexts cached on Gemini.
+
+    Sessions with the same model, system prompt and documents share one
+    cached context. A context is extended while it is in use, and deleted
+    as soon as no session uses it any more, e.g. after the prompt or the
+    documents change; contexts of abandoned sessions expire on Gemini
+    after their TTL. All Gemini calls go through genai.caching, so the
+    local stand-in in fake_gemini can replace them.
+    """
+
+    def __init__(self, ttl=CONTEXT_CACHE_TTL, min_tokens=MIN_CACHE_TOKENS):
+        self.ttl = ttl
+        self.min_tokens = min_tokens
+        self.entries = {}   # context key -> {"name", "key", "tokens", "expires", "cached", "models", "users"}
+        self.owners = {}    # owner -> context key
+        self.created = 0
+        self._pending = {}  # context key -> Future of the entry being created
+        self._lock = threading.Lock()
+
+    def acquire(self, owner, api_key, model_name, system_prompt, documents):
+        """
+        Return the cached context entry for a configuration, creating or extending it.
+
+        Gemini calls are made outside the registry lock, so a slow create does
+        not hold up other sessions; sessions asking for a context that is being
+        created wait for that one call.
+
+        Args:
+            owner: ID of the session using the context
+            api_key: Gemini API key, for the scheduler
+            model_name: Model name as selected in the app
+            system_prompt: The bot's system prompt
+            documents: Ingested documents keyed by content hash
+
+        Returns:
+            A dict with the cached content "name", its "key" and "tokens", or
+            None when the model cannot cache or the context is too small
+        """
+        cache_model = CACHE_MODEL_VERSIONS.get(model_name)
+        if cache_model is None or not documents or estimate_document_tokens(documents) < self.min_tokens:
+            self.release(owner)
+            return None
+
+        import google.generativeai as genai
+        key = make_key(cache_model, system_prompt, documents)
+        if self.owners.get(owner) not in (None, key):
+            self.release(owner)
+
+        while True:
+            now = time.monotonic()
+            with self._lock:
+                entry = self.entries.get(key)
+                if entry is not None and entry["expires"] <= now:
+                    del self.entries[key]
+                    entry = None
+                if entry is not None:
+                    entry["users"].add(owner)
+                    self.owners[owner] = key
+                    expires = entry["expires"]
+                    if expires - now >= REFRESH_MARGIN:
+                        return entry
+                    # Only one session extends the context
+                    entry["expires"] = now + self.ttl
+                    break
+                pending = self._pending.get(key)
+                leader = pending is None
+                if leader:
+                    pending = self._pending[key] = Future()
+            if not leader:
+                # Check again once created, in case it was released meanwhile
+                pending.result()
+                continue
+
+            try:
+                cached = scheduler.get_scheduler().call(
+                    api_key,
+                    cache_model,
+                    lambda: genai.caching.CachedContent.create(
+                        cache_model,
+                        display_name=f"chatbot-{key[:16]}",
+                        system_instruction=system_prompt or None,
+                        contents=[{"role": "user", "parts": [read_documents(documents)]}],
+                        ttl=datetime.timedelta(seconds=self.ttl)
+                    )
+                )
+            except scheduler.GeminiCallError as e:
+                with self._lock:
+                    del self._pending[key]
+                pending.set_exception(e)
+                raise
+            with self._lock:
+                entry = self.entries[key] = {
+                    "name": cached.name,
+                    "key": key,
+                    "tokens": cached.usage_metadata.total_token_count,
+                    "expires": now + self.ttl,
+                    "cached": cached,
+                    "models": {},
+                    "users": {owner}
+                }
+                self.owners[owner] = key
+                self.created += 1
+                del self._pending[key]
+            pending.set_result(entry)
+            return entry
+
+        try:
+            scheduler.get_scheduler().call(
+                api_key, cache_model, lambda: entry["cached"].update(ttl=datetime.timedelta(seconds=self.ttl))
+            )
+        except scheduler.GeminiCallError:
+            with self._lock:
+                entry["expires"] = expires
+            raise
+        return entry
+
+    def get_model(self, entry, temperature):
+        """Return a model that answers on top of a cached context."""
+        import google.generativeai as genai
+        with self._lock:
+            model = entry["models"].get(temperature)
+            if model is None:
+                model = entry["models"][temperature] = genai.GenerativeModel.from_cached_content(
+                    entry["cached"], generation_config={"temperature": temperature}
+                )
+            return model
+
+    def release(self, owner):
+        """Stop using a session's context, deleting it on Gemini when no session is left."""
+        if owner not in self.owners:
+            return
+        with self._lock:
+            key = self.owners.pop(owner, None)
+            entry = self.entries.get(key)
+            if entry is None:
+                return
+            entry["users"].discard(owner)
+            if entry["users"]:
+                return
+            del self.entries[key]
+        try:
+            entry["cached"].delete()
+        except Exception:
+            # Left to expire on its own
+            pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "contexts": len(self.entries),
+                "tokens": sum(entry["tokens"] for entry in self.entries.values()),
+                "created": self.created
+            }
+
+
+_context_cache = None
+_context_cache_lock = threading.Lock()
+
+
+def get_context_cache():
+    """Return the context cache shared by every session in the process."""
+    global _context_cache
+    with _context_cache_lock:
+        if _context_cache is None:
+            _context_cache = ContextCache()
+        return _context_cache
@@ -0,0 +1,60 @@
+# conversation.py
+
+import functools
+
+import retrieval
+
+# Number of previous messages added to the retrieval query
+HISTORY_QUERY_TURNS = 2
+
+# Number of (model, temperature, system prompt) configurations kept in memory
+MODEL_CACHE_SIZE = 32
+
+
+@functools.lru_cache(maxsize=MODEL_CACHE_SIZE)
+def get_gemini_model(model_name, temperature, system_prompt):
+    """Return a Gemini model for a configuration, reusing it across turns and sessions."""
+    import google.generativeai as genai
+    return genai.GenerativeModel(
+        model_name,
+        generation_config={"temperature": temperature},
+        system_instruction=system_prompt or None
+    )
+
+
+def retrieve_chunks(index, prompt, previous, top_k, budget_chars):
+    """Retrieve document chunks for a query, matching against the most recent turns as well."""
+    recent = previous[-HISTORY_QUERY_TURNS:]
+    query = " ".join([prompt] + [msg["content"] for msg in recent])
+    return retrieval.retrieve(index, query, top_k=top_k, budget_chars=budget_chars)
+
+
+def build_turn_content(prompt, reference):
+    """Build the user turn sent to Gemini, with any reference information for this query."""
+    if reference:
+        return f"Reference Information:\n{reference}\n\nUser Query: {prompt}"
+    return prompt
+
+
+def to_gemini_history(messages):
+    """Convert chat messages into structured Gemini chat history."""
+    return [
+        {"role": "user" if msg["role"] == "user" else "model", "parts": [msg["content"]]}
+        for msg in messages
+    ]
+
+
+def build_chat_history(summary, messages):
+    """Build structured chat history from a rolling summary and recent messages."""
+    chat_history = []
+    if summary:
+        chat_history.append({"role": "user", "parts": [f"Summary of our earlier conversation:\n{summary}"]})
+        chat_history.append({"role": "model", "parts": ["Understood."]})
+    return chat_history + to_gemini_history(messages)
+
+
+def build_contents(prompt, reference, summary, messages):
+    """Build the full Gemini contents for one turn: history followed by the new user turn."""
+    return build_chat_history(summary, messages) + [
+        {"role": "user", "parts": [build_turn_content(prompt, reference)]}
+    ]
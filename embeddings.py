@@ -0,0 +1,224 @@
+# embeddings.py
+
+import os
+import re
+import shutil
+import threading
+import zlib
+
+import numpy as np
+
+import response_cache
+import scheduler
+import telemetry
+
+VECTOR_DIR = os.path.join(response_cache.CACHE_DIR, "vectors")
+
+EMBEDDING_MODEL = "models/text-embedding-004"
+
+# Chunks sent per embedding request (the API accepts at most 100)
+EMBED_BATCH_SIZE = 100
+
+# Which embedder to use: "gemini", or "hashing" for offline runs
+EMBEDDER = os.environ.get("CHATBOT_EMBEDDER", "gemini")
+
+HASHING_DIMENSIONS = 512
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def normalize(vectors):
+    """Scale rows to unit length so a dot product is the cosine similarity."""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class GeminiEmbedder:
+    """Embeds text with a Gemini embedding model, through the call scheduler."""
+
+    def __init__(self, model=EMBEDDING_MODEL, api_key=None):
+        self.model = model
+        self.name = model.split("/")[-1]
+        # Key the calls count against; the command-line tools use GOOGLE_API_KEY
+        self.api_key = api_key
+
+    def embed(self, texts, task_type="retrieval_document"):
+        """Return a float32 array with one unit-length row per text."""
+        import google.generativeai as genai
+        with telemetry.track("embed", self.name, texts=len(texts)):
+            result = scheduler.get_scheduler().call(
+                self.api_key or os.environ.get("GOOGLE_API_KEY"),
+                self.model,
+                lambda: genai.embed_content(model=self.model, content=list(texts), task_type=task_type)
+            )
+        return normalize(np.asarray(result["embedding"], dtype=np.float32))
+
+
+class HashingEmbedder:
+    """
+    Local embedder for offline runs and tests.
+
+    Hashes words and word pairs into a fixed number of dimensions, so texts
+    sharing vocabulary get similar vectors. No network access is needed.
+    """
+
+    def __init__(self, dimensions=HASHING_DIMENSIONS):
+        self.dimensions = dimensions
+        self.name = f"hashing-{dimensions}"
+
+    def embed(self, texts, task_type="retrieval_document"):
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = TOKEN_PATTERN.findall(text.lower())
+            for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+                vectors[row, zlib.crc32(feature.encode("utf-8")) % self.dimensions] += 1.0
+        return normalize(np.log1p(vectors))
+
+
+def get_embedder(name=None, api_key=None):
+    """Return the embedder selected by name or CHATBOT_EMBEDDER, with the API key of its session."""
+    name = name or EMBEDDER
+    if name == "hashing":
+        return HashingEmbedder()
+    if name == "gemini":
+        return GeminiEmbedder(api_key=api_key)
+    raise ValueError(f"Unknown embedder: {name}")
+
+
+def get_embedder_by_name(name, api_key=None):
+    """Return the embedder that produced vectors stored under an embedder name."""
+    if name.startswith("hashing-"):
+        return HashingEmbedder(int(name.split("-", 1)[1]))
+    return GeminiEmbedder(f"models/{name}", api_key=api_key)
+
+
+class VectorStore:
+    """
+    Chunk vectors on disk, one float32 file per document and embedder.
+
+    Files are keyed by document content hash, so a document is embedded
+    once and shared across reruns, sessions and processes. Vectors are
+    read back as read-only memory maps.
+    """
+
+    def __init__(self, directory=VECTOR_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, digest, embedder):
+        return os.path.join(self.directory, f"{digest}.{embedder.name}.f32")
+
+    def load(self, digest, embedder, rows):
+        """Return the memory-mapped vectors of a document, or None if they are not stored."""
+        path = self.path(digest, embedder)
+        if not os.path.exists(path) or rows == 0:
+            return None
+        columns = os.path.getsize(path) // 4 // rows
+        if columns == 0 or rows * columns * 4 != os.path.getsize(path):
+            return None
+        return np.memmap(path, dtype=np.float32, mode="r", shape=(rows, columns))
+
+    def add(self, digest, embedder, source):
+        """Store vectors read from a binary file object, e.g. from a bot bundle."""
+        path = self.path(digest, embedder)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            shutil.copyfileobj(source, f)
+        os.replace(temp_path, path)
+
+    def get_vectors(self, digest, chunks, embedder, load_text):
+        """
+        Return the vectors of a document's chunks, embedding them in batches if needed.
+
+        Args:
+            digest: Content hash of the document
+            chunks: The document's chunks, in order
+            embedder: Embedder producing unit-length vectors
+            load_text: Returns the text of a chunk
+
+        Returns:
+            (vectors, embedded) where embedded is False when they were already stored
+        """
+        vectors = self.load(digest, embedder, len(chunks))
+        if vectors is not None:
+            return vectors, False
+
+        path = self.path(digest, embedder)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        output = None
+        try:
+            for start in range(0, len(chunks), EMBED_BATCH_SIZE):
+                batch = embedder.embed([load_text(chunk) for chunk in chunks[start:start + EMBED_BATCH_SIZE]])
+                if output is None:
+                    output = np.memmap(temp_path, dtype=np.float32, mode="w+", shape=(len(chunks), batch.shape[1]))
+                output[start:start + len(batch)] = batch
+            output.flush()
+            del output
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return self.load(digest, embedder, len(chunks)), True
+
+
+class SemanticIndex:
+    """
+    Cosine-similarity index over chunk embeddings.
+
+    Searched the same way as retrieval.BM25Index: vectors stay in their
+    per-document memory maps and each query is scored against all of them
+    with one matrix-vector product per document.
+    """
+
+    def __init__(self, chunks, vectors, embedder, load_text):
+        """
+        Args:
+            chunks: All chunks, in the order of the vector blocks
+            vectors: List of per-document vector arrays, one row per chunk
+            embedder: Embedder used for the document vectors, for embedding queries
+            load_text: Returns the text of a chunk
+        """
+        self.chunks = chunks
+        self.vectors = vectors
+        self.embedder = embedder
+        self.load_text = load_text
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def memory_bytes(self):
+        """Approximate memory held by the chunk records, in bytes; vectors are memory-mapped."""
+        return 250 * len(self.chunks)
+
+    def search(self, query, top_k=5):
+        """Return up to top_k (chunk_index, score) pairs for the query, best first."""
+        if not self.chunks or not query.strip():
+            return []
+        query_vector = self.embedder.embed([query], task_type="retrieval_query")[0]
+        scores = np.concatenate([block @ query_vector for block in self.vectors])
+        top_k = min(top_k, scores.size)
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return [(int(i), float(scores[i])) for i in best]
+
+
+def build_semantic_index(documents, load_text, embedder=None, store=None):
+    """
+    Build a semantic index over ingested documents, embedding only documents not stored yet.
+
+    Args:
+        documents: List of (content hash, chunks) pairs
+        load_text: Returns the text of a chunk
+    """
+    embedder = embedder or get_embedder()
+    store = store or VectorStore()
+    chunks = []
+    vectors = []
+    for digest, document_chunks in documents:
+        if not document_chunks:
+            continue
+        document_vectors, _ = store.get_vectors(digest, document_chunks, embedder, load_text)
+        chunks.extend(document_chunks)
+        vectors.append(document_vectors)
+    return SemanticIndex(chunks, vectors, embedder, load_text)
@@ -0,0 +1,204 @@
+# fake_gemini.py
+
+import asyncio
+import time
+
+import google.generativeai as genai
+from google.generativeai import protos
+from google.generativeai.types import generation_types
+
+import embeddings
+
+# Default latencies, in seconds
+FIRST_TOKEN_LATENCY = 0.3
+CHUNK_LATENCY = 0.05
+CHUNKS_PER_RESPONSE = 8
+
+
+def estimate_tokens(text):
+    """Roughly estimate the number of tokens in a piece of text."""
+    return len(text) // 4 + 1
+
+
+def contents_text(contents):
+    """Flatten Gemini contents (strings, dicts or protos) into plain text."""
+    if isinstance(contents, str):
+        return contents
+    if isinstance(contents, dict):
+        return " ".join(contents_text(part) for part in contents.get("parts", []))
+    if isinstance(contents, protos.Content):
+        return " ".join(part.text for part in contents.parts)
+    if isinstance(contents, protos.Part):
+        return contents.text
+    if isinstance(contents, (list, tuple)):
+        return " ".join(contents_text(item) for item in contents)
+    return str(contents)
+
+
+def make_response_proto(text, prompt_tokens, completion_tokens, cached_tokens=0):
+    """Build a GenerateContentResponse proto carrying text and usage metadata."""
+    return protos.GenerateContentResponse(
+        candidates=[protos.Candidate(
+            content=protos.Content(role="model", parts=[protos.Part(text=text)]),
+            finish_reason=protos.Candidate.FinishReason.STOP
+        )],
+        usage_metadata=protos.GenerateContentResponse.UsageMetadata(
+            prompt_token_count=prompt_tokens,
+            candidates_token_count=completion_tokens,
+            cached_content_token_count=cached_tokens,
+            total_token_count=prompt_tokens + completion_tokens
+        )
+    )
+
+
+def embed_content(model, content, task_type=None, **kwargs):
+    """Local stand-in for genai.embed_content, using hashed word features."""
+    texts = [content] if isinstance(content, str) else list(content)
+    vectors = embeddings.HashingEmbedder().embed(texts).tolist()
+    return {"embedding": vectors[0] if isinstance(content, str) else vectors}
+
+
+class FakeCachedContent:
+    """Local stand-in for genai.caching.CachedContent, kept in process memory."""
+
+    store = {}
+    created = 0
+
+    def __init__(self, name, model, system_instruction, contents, ttl):
+        self.name = name
+        self.model = model
+        self.system_instruction = system_instruction
+        self.contents = contents
+        self.ttl = ttl
+        self.usage_metadata = protos.CachedContent.UsageMetadata(
+            total_token_count=estimate_tokens(contents_text(contents)) + estimate_tokens(str(system_instruction or ""))
+        )
+
+    @classmethod
+    def create(cls, model, *, display_name=None, system_instruction=None, contents=None, ttl=None, **kwargs):
+        cls.created += 1
+        cached = cls(f"cachedContents/fake-{cls.created}", model, system_instruction, contents, ttl)
+        cls.store[cached.name] = cached
+        return cached
+
+    @classmethod
+    def get(cls, name):
+        return cls.store[name]
+
+    def update(self, *, ttl=None, expire_time=None):
+        self.ttl = ttl
+
+    def delete(self):
+        self.store.pop(self.name, None)
+
+
+class FakeGenerativeModel:
+    """
+    Local stand-in for genai.GenerativeModel.
+
+    Returns a deterministic answer after a configurable delay, with optional
+    streaming in chunks, so the app can be run and measured without network
+    access. Real SDK response types are returned, so ChatSession and the
+    rest of the app behave as they do against the API.
+    """
+
+    first_token_latency = FIRST_TOKEN_LATENCY
+    chunk_latency = CHUNK_LATENCY
+    chunks_per_response = CHUNKS_PER_RESPONSE
+    calls = 0
+
+    def __init__(self, model_name="gemini-1.5-flash", generation_config=None, system_instruction=None, **kwargs):
+        self.model_name = model_name
+        self._generation_config = generation_config or {}
+        self._system_instruction = system_instruction
+        self._cached_content = None
+
+    @classmethod
+    def from_cached_content(cls, cached_content, generation_config=None, **kwargs):
+        if isinstance(cached_content, str):
+            cached_content = FakeCachedContent.get(cached_content)
+        model = cls(cached_content.model.split("/")[-1], generation_config, cached_content.system_instruction)
+        model._cached_content = cached_content
+        return model
+
+    def _get_tools_lib(self, tools):
+        return None
+
+    def _answer(self, contents):
+        """Return (answer chunks, prompt tokens) for a request."""
+        prompt = contents_text(contents)
+        last_line = prompt.strip().splitlines()[-1] if prompt.strip() else ""
+        answer = f"[{self.model_name}] This is a simulated answer to: {last_line[:200]}"
+        words = answer.split(" ")
+        size = max(1, -(-len(words) // self.chunks_per_response))
+        chunks = [" ".join(words[i:i + size]) for i in range(0, len(words), size)]
+        chunks = [chunk + " " for chunk in chunks[:-1]] + chunks[-1:]
+        prompt_tokens = estimate_tokens(prompt) + estimate_tokens(str(self._system_instruction or ""))
+        type(self).calls += 1
+        return chunks, prompt_tokens
+
+    def _cached_tokens(self):
+        """Tokens served from the cached context, which Gemini also counts as prompt tokens."""
+        if self._cached_content is None:
+            return 0
+        return self._cached_content.usage_metadata.total_token_count
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        chunks, prompt_tokens = self._answer(contents)
+        completion_tokens = estimate_tokens("".join(chunks))
+        cached_tokens = self._cached_tokens()
+        if not stream:
+            time.sleep(self.first_token_latency + self.chunk_latency * (len(chunks) - 1))
+            return generation_types.GenerateContentResponse.from_response(
+                make_response_proto("".join(chunks), prompt_tokens + cached_tokens, completion_tokens, cached_tokens)
+            )
+
+        def iterate():
+            time.sleep(self.first_token_latency)
+            for i, chunk in enumerate(chunks):
+                if i:
+                    time.sleep(self.chunk_latency)
+                yield make_response_proto(chunk, prompt_tokens + cached_tokens, completion_tokens, cached_tokens)
+
+        return generation_types.GenerateContentResponse.from_iterator(iterate())
+
+    async def generate_content_async(self, contents, stream=False, **kwargs):
+        chunks, prompt_tokens = self._answer(contents)
+        completion_tokens = estimate_tokens("".join(chunks))
+        cached_tokens = self._cached_tokens()
+        if not stream:
+            await asyncio.sleep(self.first_token_latency + self.chunk_latency * (len(chunks) - 1))
+            return generation_types.AsyncGenerateContentResponse.from_response(
+                make_response_proto("".join(chunks), prompt_tokens + cached_tokens, completion_tokens, cached_tokens)
+            )
+
+        async def iterate():
+            await asyncio.sleep(self.first_token_latency)
+            for i, chunk in enumerate(chunks):
+                if i:
+                    await asyncio.sleep(self.chunk_latency)
+                yield make_response_proto(chunk, prompt_tokens + cached_tokens, completion_tokens, cached_tokens)
+
+        return await generation_types.AsyncGenerateContentResponse.from_aiterator(iterate())
+
+    def count_tokens(self, contents):
+        return protos.CountTokensResponse(total_tokens=estimate_tokens(contents_text(contents)))
+
+    def start_chat(self, history=None, **kwargs):
+        return genai.ChatSession(self, history=history)
+
+
+def install(first_token_latency=FIRST_TOKEN_LATENCY, chunk_latency=CHUNK_LATENCY,
+            chunks_per_response=CHUNKS_PER_RESPONSE):
+    """
+    Replace the Gemini client with the local stand-in for the rest of the process.
+
+    Call before the app or runner creates any models.
+    """
+    FakeGenerativeModel.first_token_latency = first_token_latency
+    FakeGenerativeModel.chunk_latency = chunk_latency
+    FakeGenerativeModel.chunks_per_response = chunks_per_response
+    genai.GenerativeModel = FakeGenerativeModel
+    genai.caching.CachedContent = FakeCachedContent
+    genai.embed_content = embed_content
+    genai.configure = lambda **kwargs: None
@@ -0,0 +1,188 @@
+# history.py
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+import scheduler
+import telemetry
+
+# Default token budget for the conversation history sent with each turn, per model
+DEFAULT_HISTORY_BUDGETS = {
+    "gemini-1.5-pro": 32000,
+    "gemini-1.5-flash": 16000,
+    "gemini-pro": 8000
+}
+FALLBACK_HISTORY_BUDGET = 8000
+
+# Once over budget, older turns are dropped until the window fits in this fraction
+# of the budget, so the chat session is not rebuilt on every turn
+WINDOW_SHRINK_RATIO = 0.5
+
+SUMMARY_MODEL = "gemini-1.5-flash"
+SUMMARY_PROMPT = """Update the running summary of a conversation between a user and an assistant.
+Keep names, facts, decisions, open questions and any instructions the user gave. Be concise.
+
+Current summary:
+{summary}
+
+New messages to fold into the summary:
+{transcript}
+
+Updated summary:"""
+
+# Summaries are produced off the Streamlit script thread, shared by all sessions
+_summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="history-summary")
+
+
+def estimate_tokens(text):
+    """Roughly estimate the number of tokens in a piece of text (about 4 characters per token)."""
+    return len(text) // 4 + 1
+
+
+def get_history_budget(model_name, budgets=None):
+    """Return the history token budget for a model."""
+    budgets = budgets or DEFAULT_HISTORY_BUDGETS
+    return budgets.get(model_name, DEFAULT_HISTORY_BUDGETS.get(model_name, FALLBACK_HISTORY_BUDGET))
+
+
+def summarize_messages(summary, messages, api_key=None):
+    """Fold messages into a running summary using Gemini, counted against the given API key."""
+    import google.generativeai as genai
+    transcript = "\n".join(f"{msg['role'].title()}: {msg['content']}" for msg in messages)
+    model = genai.GenerativeModel(SUMMARY_MODEL, generation_config={"temperature": 0.2})
+    with telemetry.track("summary", SUMMARY_MODEL, context={"history": estimate_tokens(transcript)}) as record:
+        prompt = SUMMARY_PROMPT.format(summary=summary or "(none)", transcript=transcript)
+        response = scheduler.get_scheduler().call(
+            api_key,
+            SUMMARY_MODEL,
+            lambda: model.generate_content(prompt)
+        )
+        telemetry.set_usage(record, response)
+        return response.text.strip()
+
+
+class HistoryManager:
+    """
+    Keeps the conversation sent to Gemini within a token budget.
+
+    Recent turns are sent verbatim. Older turns are folded into a rolling
+    summary by a background thread; until that summary is ready, the turns
+    waiting to be summarized are still sent verbatim so no request blocks.
+    """
+
+    def __init__(self):
+        self.summary = ""
+        self.summary_upto = 0   # messages[:summary_upto] are covered by the summary
+        self.window_start = 0   # messages[window_start:] fit in the budget verbatim
+        self._lock = threading.RLock()
+        self._pending = None
+        self._earlier = None    # loads messages before those passed to select, until summarized
+
+    def reset(self):
+        """Forget the summary and window, e.g. after the chat is reset."""
+        with self._lock:
+            self.summary = ""
+            self.summary_upto = 0
+            self.window_start = 0
+            self._pending = None
+            self._earlier = None
+
+    def summarize_earlier(self, load):
+        """
+        Fold messages older than those passed to select into the summary.
+
+        Used when only the recent part of a conversation is kept in memory,
+        e.g. after a session is restored. The next select with an API key
+        summarizes them in the background.
+
+        Args:
+            load: Callable returning the older messages, oldest first
+        """
+        with self._lock:
+            self._earlier = load
+
+    def release(self, limit, multiple=1):
+        """
+        Drop leading messages the summary covers from the selection.
+
+        Args:
+            limit: Maximum number of messages to drop
+            multiple: The count is rounded down to a multiple of this
+
+        Returns:
+            The number of messages the caller must remove from the front of
+            the list it passes to select; nothing is dropped while a summary
+            is in progress
+        """
+        with self._lock:
+            if self._pending is not None or self._earlier is not None:
+                return 0
+            count = min(limit, self.summary_upto, self.window_start) // multiple * multiple
+            self.summary_upto -= count
+            self.window_start -= count
+            return count
+
+    def select(self, messages, budget, api_key=None):
+        """
+        Choose what to send for a conversation.
+
+        Args:
+            messages: Previous chat messages, oldest first
+            budget: Token budget for the summary plus verbatim messages
+            api_key: API key of the session, for a summary started by this call
+
+        Returns:
+            (summary, start) where messages[start:] are sent verbatim
+        """
+        if len(messages) < self.window_start:
+            self.reset()
+
+        with self._lock:
+            summary_tokens = estimate_tokens(self.summary) if self.summary else 0
+            sizes = [estimate_tokens(msg["content"]) for msg in messages[self.window_start:]]
+            if summary_tokens + sum(sizes) > budget:
+                target = budget * WINDOW_SHRINK_RATIO - summary_tokens
+                start = self.window_start
+                total = sum(sizes)
+                # Drop whole turns so the window always starts with a user message
+                while start < len(messages) and total > target:
+                    total -= sizes[start - self.window_start]
+                    start += 1
+                    while start < len(messages) and messages[start]["role"] != "user":
+                        total -= sizes[start - self.window_start]
+                        start += 1
+                self.window_start = start
+
+            if self._earlier is not None:
+                if self._pending is None and api_key:
+                    self._schedule_earlier(api_key)
+            elif self.summary_upto < self.window_start and self._pending is None:
+                self._schedule(messages[self.summary_upto:self.window_start], self.window_start, api_key)
+
+            return self.summary, min(self.summary_upto, self.window_start)
+
+    def _schedule(self, messages, upto, api_key):
+        """Start summarizing messages in the background; the lock must be held."""
+        pending = _summary_executor.submit(summarize_messages, self.summary, list(messages), api_key)
+        self._pending = pending
+        pending.add_done_callback(lambda future: self._apply(future, upto))
+
+    def _schedule_earlier(self, api_key):
+        """Start summarizing the messages before the selection; the lock must be held."""
+        load = self._earlier
+        pending = _summary_executor.submit(lambda: summarize_messages("", load(), api_key))
+        self._pending = pending
+        pending.add_done_callback(lambda future: self._apply(future, 0, earlier=True))
+
+    def _apply(self, future, upto, earlier=False):
+        """Install a finished summary unless the history was reset in the meantime."""
+        with self._lock:
+            if future is not self._pending:
+                return
+            self._pending = None
+            if future.exception() is None:
+                self.summary = future.result()
+                self.summary_upto = upto
+                if earlier:
+                    self._earlier = None
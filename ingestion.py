@@ -0,0 +1,300 @@
+# ingestion.py
+
+import hashlib
+import json
+import mmap
+import multiprocessing
+import os
+import shutil
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+
+import response_cache
+import retrieval
+
+DOCUMENT_CACHE_DIR = os.path.join(response_cache.CACHE_DIR, "documents")
+
+# Upper bound on worker processes used to parse documents
+MAX_WORKERS = min(8, os.cpu_count() or 1)
+
+# PDF pages extracted per job; at most MAX_WORKERS * 2 jobs are in flight per file,
+# so only a bounded number of pages is ever held in memory
+PDF_BATCH_PAGES = 8
+
+# Maximum extracted text a single session may attach, in bytes
+SESSION_TEXT_LIMIT = int(os.environ.get("CHATBOT_SESSION_TEXT_LIMIT", 64 * 1024 * 1024))
+
+# Maximum extracted text memory-mapped by the whole process, in bytes
+GLOBAL_MAPPED_LIMIT = int(os.environ.get("CHATBOT_GLOBAL_MAPPED_LIMIT", 512 * 1024 * 1024))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    Return the process pool shared by all sessions for document parsing.
+
+    Workers come from a fork server (spawned where there is none) rather than
+    being forked from the app, whose threads may hold locks at fork time.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _executor = ProcessPoolExecutor(max_workers=MAX_WORKERS, mp_context=multiprocessing.get_context(method))
+        return _executor
+
+
+def content_hash(data):
+    """Return the SHA-256 hex digest of a file's bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def extract_pdf_pages(path, start, end):
+    """Extract the text of pages [start, end) of a PDF file."""
+    import PyPDF2
+    reader = PyPDF2.PdfReader(path)
+    return "".join(reader.pages[i].extract_text() + "\n" for i in range(start, end))
+
+
+def extract_docx(path):
+    """Extract the paragraph text of a DOCX file."""
+    import docx
+    doc = docx.Document(path)
+    return "".join(para.text + "\n" for para in doc.paragraphs)
+
+
+def extract_text(path):
+    """Decode a plain text file."""
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read() + "\n"
+
+
+def count_pdf_pages(path):
+    """Return the number of pages in a PDF file."""
+    import PyPDF2
+    return len(PyPDF2.PdfReader(path).pages)
+
+
+def extraction_jobs(name, path):
+    """Return the (function, args) jobs that extract a file, in document order."""
+    if name.endswith(".pdf"):
+        num_pages = count_pdf_pages(path)
+        return [
+            (extract_pdf_pages, (path, start, min(start + PDF_BATCH_PAGES, num_pages)))
+            for start in range(0, num_pages, PDF_BATCH_PAGES)
+        ]
+    if name.endswith(".docx"):
+        return [(extract_docx, (path,))]
+    return [(extract_text, (path,))]  # assume text file
+
+
+def run_jobs(jobs):
+    """Run jobs on the process pool with a bounded window, yielding results in order."""
+    executor = get_executor()
+    pending = deque()
+    for function, args in jobs:
+        pending.append(executor.submit(function, *args))
+        if len(pending) >= MAX_WORKERS * 2:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+class SpillWriter:
+    """
+    Writes extracted text to a spill file piece by piece and records chunk offsets.
+
+    Chunks never span two pieces. Offsets are byte positions in the UTF-8 file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        self.file = open(self.temp_path, "wb")
+        self.size = 0
+        self.spans = []
+
+    def write(self, text):
+        """Append a piece of text and chunk it."""
+        spans = list(retrieval.chunk_spans(text))
+        boundaries = sorted({position for span in spans for position in span})
+        offsets = {}
+        char_position = 0
+        byte_position = self.size
+        for boundary in boundaries:
+            byte_position += len(text[char_position:boundary].encode("utf-8"))
+            char_position = boundary
+            offsets[boundary] = byte_position
+        self.spans.extend([offsets[start], offsets[end]] for start, end in spans)
+
+        data = text.encode("utf-8")
+        self.file.write(data)
+        self.size += len(data)
+
+    def commit(self):
+        """Close the spill file and move it into place."""
+        self.file.close()
+        with open(f"{self.path}.spans.json", "w") as f:
+            json.dump(self.spans, f)
+        os.replace(self.temp_path, self.path)
+
+    def abort(self):
+        """Close and delete an incomplete spill file."""
+        self.file.close()
+        os.remove(self.temp_path)
+
+
+class DocumentCache:
+    """Extracted document text spilled to disk, keyed by content hash and shared across sessions."""
+
+    def __init__(self, directory=DOCUMENT_CACHE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, digest):
+        return os.path.join(self.directory, f"{digest}.txt")
+
+    def get_spans(self, digest):
+        """Return the chunk byte spans of a cached document, or None if it is not cached."""
+        try:
+            with open(f"{self.path(digest)}.spans.json", "r") as f:
+                spans = json.load(f)
+        except FileNotFoundError:
+            return None
+        if not os.path.exists(self.path(digest)):
+            return None
+        return spans
+
+    def size(self, digest):
+        """Return the size of a cached document's text in bytes."""
+        return os.path.getsize(self.path(digest))
+
+    def writer(self, digest):
+        return SpillWriter(self.path(digest))
+
+    def add(self, digest, source, spans):
+        """Store already extracted text, read from a binary file object, with its chunk spans."""
+        path = self.path(digest)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            shutil.copyfileobj(source, f)
+        with open(f"{path}.spans.json", "w") as f:
+            json.dump(spans, f)
+        os.replace(temp_path, path)
+
+
+class MappedTexts:
+    """
+    Process-wide, memory-mapped read access to spill files.
+
+    Mappings are shared by every session and closed least recently used
+    first once their total size goes over the global limit.
+    """
+
+    def __init__(self, limit=GLOBAL_MAPPED_LIMIT):
+        self.limit = limit
+        self.mapped_bytes = 0
+        self._maps = OrderedDict()
+        self._lock = threading.Lock()
+
+    def read(self, path, start, end):
+        """Return the text between two byte offsets of a spill file."""
+        with self._lock:
+            entry = self._maps.get(path)
+            if entry is None:
+                entry = self._open(path)
+            self._maps.move_to_end(path)
+            return entry[1][start:end].decode("utf-8", errors="replace")
+
+    def stats(self):
+        with self._lock:
+            return {"mapped_bytes": self.mapped_bytes, "mapped_files": len(self._maps), "limit": self.limit}
+
+    def _open(self, path):
+        """Map a spill file, closing older mappings to stay under the limit; the lock must be held."""
+        f = open(path, "rb")
+        size = os.fstat(f.fileno()).st_size
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        while self._maps and self.mapped_bytes + size > self.limit:
+            _, (old_file, old_map, old_size) = self._maps.popitem(last=False)
+            if old_size:
+                old_map.close()
+            old_file.close()
+            self.mapped_bytes -= old_size
+        entry = (f, mapped, size)
+        self._maps[path] = entry
+        self.mapped_bytes += size
+        return entry
+
+
+_mapped_texts = MappedTexts()
+
+
+def read_chunk(chunk):
+    """Return the text of a chunk stored in a spill file."""
+    return _mapped_texts.read(chunk["path"], chunk["start"], chunk["end"])
+
+
+def mapped_stats():
+    """Return the process-wide memory-mapping counters."""
+    return _mapped_texts.stats()
+
+
+def ingest_file(name, data, cache=None):
+    """
+    Extract one file into its spill file, unless it is already cached.
+
+    The upload is written to disk once and parsed by worker processes page
+    batch by page batch, so neither the file nor its text is held in memory
+    as a whole. Only chunk offsets are returned.
+
+    Args:
+        name: File name, used to pick the parser
+        data: File contents as a bytes-like object
+
+    Returns:
+        (digest, chunks, size in bytes, cached)
+    """
+    cache = cache or DocumentCache()
+    digest = content_hash(data)
+    spans = cache.get_spans(digest)
+    cached = spans is not None
+
+    if not cached:
+        upload_path = f"{cache.path(digest)}.{os.getpid()}.{threading.get_ident()}.upload"
+        with open(upload_path, "wb") as f:
+            f.write(data)
+        writer = cache.writer(digest)
+        try:
+            for text in run_jobs(extraction_jobs(name, upload_path)):
+                writer.write(text)
+        except Exception:
+            writer.abort()
+            raise
+        finally:
+            os.remove(upload_path)
+        writer.commit()
+        spans = writer.spans
+
+    return digest, make_chunks(name, cache.path(digest), spans), cache.size(digest), cached
+
+
+def make_chunks(name, path, spans):
+    """Build the chunk records of a spill file from its byte spans."""
+    return [{"source": name, "path": path, "start": start, "end": end} for start, end in spans]
+
+
+def load_document(digest, name, cache=None):
+    """
+    Return (chunks, size in bytes) of a document that is already extracted, or None.
+
+    Used to restore a session's documents by content hash without the original file.
+    """
+    cache = cache or DocumentCache()
+    spans = cache.get_spans(digest)
+    if spans is None:
+        return None
+    return make_chunks(name, cache.path(digest), spans), cache.size(digest)
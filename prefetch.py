@@ -0,0 +1,120 @@
+# prefetch.py
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Worker threads shared by every session for answering suggested prompts ahead of time
+PREFETCH_WORKERS = int(os.environ.get("CHATBOT_PREFETCH_WORKERS", 4))
+
+# Seconds a configuration must stay unchanged before its prompts are prefetched
+PREFETCH_DELAY = float(os.environ.get("CHATBOT_PREFETCH_DELAY", 2.0))
+
+
+class Prefetcher:
+    """
+    Answers a session's suggested prompts in the background before they are clicked.
+
+    Each session has at most one prefetch generation, for one configuration
+    key. Scheduling a different key cancels the previous generation: jobs
+    that have not started are dropped and running jobs skip their call if
+    it has not been sent yet. Jobs only start once the configuration has
+    stayed the same for the debounce delay, so typing in the prompt editor
+    does not spend any calls. Jobs store their answers themselves, e.g. in
+    the response cache.
+    """
+
+    def __init__(self, workers=PREFETCH_WORKERS, delay=PREFETCH_DELAY):
+        self.delay = delay
+        self.scheduled = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.failed = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        self._generations = {}  # owner -> {"key", "cancelled", "timer", "futures"}
+        self._lock = threading.Lock()
+
+    def schedule(self, owner, key, jobs):
+        """
+        Prefetch answers for a session's configuration once it has been stable for the delay.
+
+        Args:
+            owner: ID of the session
+            key: Hash of everything the answers depend on
+            jobs: Functions taking a cancellation event, one per prompt
+        """
+        with self._lock:
+            generation = self._generations.get(owner)
+            if generation is not None and generation["key"] == key:
+                return
+            self._cancel(owner)
+            if not jobs:
+                return
+            generation = {"key": key, "cancelled": threading.Event(), "timer": None, "futures": []}
+            generation["timer"] = threading.Timer(self.delay, self._submit, (owner, generation, jobs))
+            generation["timer"].daemon = True
+            self._generations[owner] = generation
+            generation["timer"].start()
+
+    def cancel(self, owner):
+        """Cancel a session's prefetches, e.g. once it has sent its first message."""
+        with self._lock:
+            self._cancel(owner)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "scheduled": self.scheduled,
+                "completed": self.completed,
+                "cancelled": self.cancelled,
+                "failed": self.failed
+            }
+
+    def _cancel(self, owner):
+        """Cancel a session's generation; the lock must be held."""
+        generation = self._generations.pop(owner, None)
+        if generation is None:
+            return
+        generation["cancelled"].set()
+        generation["timer"].cancel()
+        for future in generation["futures"]:
+            if future.cancel():
+                self.cancelled += 1
+
+    def _submit(self, owner, generation, jobs):
+        """Start a generation's jobs once its debounce delay has passed."""
+        with self._lock:
+            if generation["cancelled"].is_set():
+                return
+            for job in jobs:
+                generation["futures"].append(self._executor.submit(self._run, job, generation["cancelled"]))
+            self.scheduled += len(jobs)
+
+    def _run(self, job, cancelled):
+        if cancelled.is_set():
+            with self._lock:
+                self.cancelled += 1
+            return
+        try:
+            job(cancelled)
+        except Exception:
+            # The prompt is simply answered when it is clicked
+            with self._lock:
+                self.failed += 1
+            return
+        with self._lock:
+            self.completed += 1
+
+
+_prefetcher = None
+_prefetcher_lock = threading.Lock()
+
+
+def get_prefetcher():
+    """Return the prefetcher shared by every session in the process."""
+    global _prefetcher
+    with _prefetcher_lock:
+        if _prefetcher is None:
+            _prefetcher = Prefetcher()
+        return _prefetcher
+
@@ -0,0 +1,138 @@
+# response_cache.py
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_DIR = os.environ.get("CHATBOT_CACHE_DIR", ".cache")
+CACHE_PATH = os.path.join(CACHE_DIR, "responses.sqlite")
+
+MEMORY_ENTRIES = 256
+DISK_ENTRIES = 5000
+TTL_SECONDS = 7 * 24 * 60 * 60
+
+
+def make_key(model, temperature, system_prompt, document_context, history, prompt):
+    """Hash everything that determines a response into a cache key."""
+    payload = json.dumps(
+        [model, temperature, system_prompt, document_context, history, prompt],
+        ensure_ascii=False,
+        separators=(",", ":")
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Two-tier response cache: an in-memory LRU in front of a SQLite table.
+
+    Entries expire after ttl seconds and the disk tier is trimmed to
+    disk_entries, oldest first. Safe to share between threads.
+    """
+
+    def __init__(self, path=CACHE_PATH, memory_entries=MEMORY_ENTRIES,
+                 disk_entries=DISK_ENTRIES, ttl=TTL_SECONDS):
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses "
+            "(key TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_created ON responses (created)")
+        self._db.commit()
+
+    def get(self, key):
+        """Return the cached response for key, or None."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry[1] <= self.ttl:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+            row = self._db.execute(
+                "SELECT response, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and now - row[1] <= self.ttl:
+                self._remember(key, row[0], row[1])
+                self.hits += 1
+                return row[0]
+
+            self._memory.pop(key, None)
+            self.misses += 1
+            return None
+
+    def put(self, key, response):
+        """Store a response in both tiers."""
+        now = time.time()
+        with self._lock:
+            self._remember(key, response, now)
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created) VALUES (?, ?, ?)",
+                (key, response, now)
+            )
+            self._evict(now)
+            self._db.commit()
+
+    def clear(self):
+        """Remove every entry and reset the counters."""
+        with self._lock:
+            self._memory.clear()
+            self._db.execute("DELETE FROM responses")
+            self._db.commit()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Return hit/miss counters and tier sizes."""
+        with self._lock:
+            disk_size = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "memory_entries": len(self._memory),
+                "disk_entries": disk_size
+            }
+
+    def _remember(self, key, response, created):
+        """Add an entry to the memory tier, evicting the least recently used."""
+        self._memory[key] = (response, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self, now):
+        """Drop expired entries and trim the disk tier to its size limit."""
+        self._db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        self._db.execute(
+            "DELETE FROM responses WHERE key IN ("
+            "SELECT key FROM responses ORDER BY created DESC LIMIT -1 OFFSET ?)",
+            (self.disk_entries,)
+        )
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """Return the process-wide response cache shared by all sessions."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+        return _cache
@@ -0,0 +1,199 @@
+# retrieval.py
+
+import re
+from collections import Counter
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+DEFAULT_CHUNK_SIZE = 800
+DEFAULT_CHUNK_OVERLAP = 100
+
+
+def tokenize(text):
+    """Split text into lowercase word tokens."""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def chunk_spans(text, chunk_size=DEFAULT_CHUNK_SIZE, overlap=DEFAULT_CHUNK_OVERLAP):
+    """
+    Yield (start, end) character spans of overlapping chunks of roughly chunk_size characters.
+
+    Chunks end on whitespace where possible so words are not cut in half, and
+    leading/trailing whitespace is left out of each span.
+    """
+    length = len(text)
+    start = 0
+    while start < length:
+        end = min(start + chunk_size, length)
+        if end < length:
+            split = text.rfind(" ", start + chunk_size // 2, end)
+            if split != -1:
+                end = split
+        chunk_start, chunk_end = start, end
+        while chunk_start < chunk_end and text[chunk_start].isspace():
+            chunk_start += 1
+        while chunk_end > chunk_start and text[chunk_end - 1].isspace():
+            chunk_end -= 1
+        if chunk_start < chunk_end:
+            yield chunk_start, chunk_end
+        if end >= length:
+            break
+        # Start the overlap at a word boundary
+        next_start = max(end - overlap, start + 1)
+        space = text.find(" ", next_start, end)
+        start = space + 1 if space != -1 else next_start
+
+
+def chunk_text(text, source, chunk_size=DEFAULT_CHUNK_SIZE, overlap=DEFAULT_CHUNK_OVERLAP):
+    """
+    Split a document into overlapping chunks of roughly chunk_size characters.
+
+    Args:
+        text: Extracted document text
+        source: Name of the document the text came from
+        chunk_size: Target chunk length in characters
+        overlap: Number of characters shared between consecutive chunks
+    """
+    return [
+        {"source": source, "text": text[start:end]}
+        for start, end in chunk_spans(text, chunk_size, overlap)
+    ]
+
+
+def stored_text(chunk):
+    """Return the text held in a chunk dict."""
+    return chunk["text"]
+
+
+class BM25Index:
+    """
+    In-memory BM25 index over document chunks.
+
+    Term weights are stored as a term-major sparse matrix (CSC-style arrays),
+    so scoring a query only touches the postings of the query terms.
+
+    Chunks may hold their text directly or refer to it elsewhere; load_text
+    returns the text for a chunk and is used while indexing and retrieving.
+    """
+
+    def __init__(self, chunks, k1=1.5, b=0.75, load_text=stored_text):
+        self.chunks = chunks
+        self.load_text = load_text
+        self.vocabulary = {}
+
+        indptr = [0]
+        indices = []
+        counts = []
+        for chunk in chunks:
+            for term, count in Counter(tokenize(load_text(chunk))).items():
+                indices.append(self.vocabulary.setdefault(term, len(self.vocabulary)))
+                counts.append(count)
+            indptr.append(len(indices))
+
+        num_docs = len(chunks)
+        num_terms = len(self.vocabulary)
+        indptr = np.asarray(indptr, dtype=np.int64)
+        indices = np.asarray(indices, dtype=np.int64)
+        tf = np.asarray(counts, dtype=np.float32)
+
+        rows = np.repeat(np.arange(num_docs), np.diff(indptr))
+        doc_lengths = np.bincount(rows, weights=tf, minlength=num_docs)
+        avg_length = doc_lengths.mean() if num_docs else 0.0
+        doc_freq = np.bincount(indices, minlength=num_terms)
+        idf = np.log(1.0 + (num_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+
+        norm = k1 * (1.0 - b + b * doc_lengths[rows] / max(avg_length, 1e-9))
+        weights = idf[indices] * tf * (k1 + 1.0) / (tf + norm)
+
+        order = np.argsort(indices, kind="stable")
+        self.term_ptr = np.concatenate(([0], np.cumsum(doc_freq))).astype(np.int64)
+        self.term_docs = rows[order]
+        self.term_weights = weights[order].astype(np.float32)
+
+    @classmethod
+    def from_arrays(cls, chunks, vocabulary, term_ptr, term_docs, term_weights, load_text=stored_text):
+        """Rebuild an index from the arrays of a saved one (see to_arrays) without reindexing."""
+        index = cls.__new__(cls)
+        index.chunks = chunks
+        index.load_text = load_text
+        index.vocabulary = vocabulary
+        index.term_ptr = term_ptr
+        index.term_docs = term_docs
+        index.term_weights = term_weights
+        return index
+
+    def to_arrays(self):
+        """Return the vocabulary and postings arrays that make up the index."""
+        return {
+            "vocabulary": self.vocabulary,
+            "term_ptr": self.term_ptr,
+            "term_docs": self.term_docs,
+            "term_weights": self.term_weights
+        }
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def memory_bytes(self):
+        """Approximate memory held by the index arrays and chunk records, in bytes."""
+        arrays = self.term_ptr.nbytes + self.term_docs.nbytes + self.term_weights.nbytes
+        # Rough per-entry overhead of the vocabulary dict and chunk dicts
+        return arrays + 100 * len(self.vocabulary) + 250 * len(self.chunks)
+
+    def search(self, query, top_k=5):
+        """Return up to top_k (chunk_index, score) pairs for the query, best first."""
+        if not self.chunks:
+            return []
+        scores = np.zeros(len(self.chunks), dtype=np.float32)
+        for term, count in Counter(tokenize(query)).items():
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, end = self.term_ptr[term_id], self.term_ptr[term_id + 1]
+            scores[self.term_docs[start:end]] += count * self.term_weights[start:end]
+
+        matches = np.flatnonzero(scores > 0)
+        if matches.size == 0:
+            return []
+        top_k = min(top_k, matches.size)
+        best = matches[np.argpartition(-scores[matches], top_k - 1)[:top_k]]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return [(int(i), float(scores[i])) for i in best]
+
+
+def build_index(documents, chunk_size=DEFAULT_CHUNK_SIZE, overlap=DEFAULT_CHUNK_OVERLAP):
+    """
+    Chunk documents and build a BM25 index over them.
+
+    Args:
+        documents: List of (source name, extracted text) pairs
+    """
+    chunks = []
+    for source, text in documents:
+        chunks.extend(chunk_text(text, source, chunk_size, overlap))
+    return BM25Index(chunks)
+
+
+def retrieve(index, query, top_k=5, budget_chars=4000):
+    """
+    Select the best matching chunks for a query within a character budget.
+
+    Returns a list of chunk dicts with an added "score" key, best first.
+    """
+    selected = []
+    used = 0
+    for chunk_index, score in index.search(query, top_k):
+        chunk = index.chunks[chunk_index]
+        text = index.load_text(chunk)
+        if selected and used + len(text) > budget_chars:
+            break
+        selected.append({**chunk, "text": text, "score": score})
+        used += len(text)
+    return selected
+
+
+def format_chunks(chunks):
+    """Format retrieved chunks as reference text for the prompt."""
+    return "\n\n".join(f"[{chunk['source']}]\n{chunk['text']}" for chunk in chunks)
@@ -0,0 +1,328 @@
+# scheduler.py
+
+import asyncio
+import hashlib
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+import telemetry
+
+# Requests per minute allowed for each (API key, model) pair
+REQUESTS_PER_MINUTE = float(os.environ.get("CHATBOT_RPM", 60))
+BURST = int(os.environ.get("CHATBOT_BURST", 5))
+
+# Requests in flight across the whole process
+MAX_IN_FLIGHT = int(os.environ.get("CHATBOT_MAX_IN_FLIGHT", 16))
+
+MAX_RETRIES = int(os.environ.get("CHATBOT_MAX_RETRIES", 4))
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 30.0
+
+# Error classes (see telemetry.classify_error) that are worth retrying
+RETRYABLE_ERRORS = ("rate_limit", "server", "timeout")
+
+
+class GeminiCallError(Exception):
+    """A Gemini call that failed, after any retries."""
+
+    def __init__(self, message, error_type="other", retryable=False):
+        super().__init__(message)
+        self.error_type = error_type
+        self.retryable = retryable
+
+    @classmethod
+    def from_exception(cls, error):
+        if isinstance(error, cls):
+            return error
+        error_type = telemetry.classify_error(error)
+        return cls(f"{type(error).__name__}: {error}", error_type, error_type in RETRYABLE_ERRORS)
+
+
+class TokenBucket:
+    """Thread-safe token bucket; reserve() takes a token and returns how long to wait for it."""
+
+    def __init__(self, rate_per_minute, burst):
+        self.interval = 60.0 / rate_per_minute
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) / self.interval)
+            self.updated = now
+            self.tokens -= 1
+            # A negative balance is paid back by waiting
+            return max(0.0, -self.tokens * self.interval)
+
+
+def backoff_delay(attempt):
+    """Exponential backoff with full jitter for a retry attempt (0-based)."""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+class HeldStream:
+    """
+    A streaming response that keeps its in-flight slot until it has been read.
+
+    The slot is released when iteration ends or fails, or when the stream is
+    closed or dropped. Other attributes, e.g. usage_metadata, are those of
+    the wrapped response.
+    """
+
+    def __init__(self, response, release):
+        self._response = response
+        self._release = release
+        self._released = False
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.__dict__["_response"], name)
+
+    def __iter__(self):
+        try:
+            yield from self._response
+        finally:
+            self.close()
+
+    def __aiter__(self):
+        return self._aiterate()
+
+    async def _aiterate(self):
+        try:
+            async for chunk in self._response:
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self):
+        """Give the slot back; safe to call more than once."""
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self._release()
+
+    def __del__(self):
+        if "_lock" in self.__dict__:
+            self.close()
+
+
+class CallScheduler:
+    """
+    Process-wide scheduler for Gemini calls.
+
+    Every call waits for a token from the bucket of its (API key, model)
+    pair and for a free in-flight slot; a streaming call keeps its slot
+    until its stream has been read. Rate-limit, server and timeout
+    errors are retried with exponential backoff and jitter. Identical
+    concurrent calls, identified by a coalesce key, share one upstream call.
+    Works for both blocking calls (Streamlit script threads) and coroutines
+    (compare mode, batch runner, HTTP server).
+    """
+
+    def __init__(self, rate_per_minute=REQUESTS_PER_MINUTE, burst=BURST,
+                 max_in_flight=MAX_IN_FLIGHT, max_retries=MAX_RETRIES):
+        self.rate_per_minute = rate_per_minute
+        self.burst = burst
+        self.max_retries = max_retries
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.retries = 0
+        self.coalesced = 0
+        self.throttled_seconds = 0.0
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._buckets = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def configure(self, rate_per_minute=None, burst=None):
+        """Change the rate limit; existing buckets are replaced."""
+        with self._lock:
+            if rate_per_minute is not None:
+                self.rate_per_minute = rate_per_minute
+            if burst is not None:
+                self.burst = burst
+            self._buckets.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "max_in_flight": self.max_in_flight,
+                "retries": self.retries,
+                "coalesced": self.coalesced,
+                "throttled_seconds": self.throttled_seconds
+            }
+
+    def _reserve(self, api_key, model):
+        """Take a rate-limit token and return the wait in seconds (0 when unlimited)."""
+        if not self.rate_per_minute:
+            return 0.0
+        bucket_key = (hashlib.sha256((api_key or "").encode()).hexdigest(), model)
+        with self._lock:
+            bucket = self._buckets.get(bucket_key)
+            if bucket is None:
+                bucket = self._buckets[bucket_key] = TokenBucket(self.rate_per_minute, self.burst)
+        wait = bucket.reserve()
+        if wait:
+            with self._lock:
+                self.throttled_seconds += wait
+        return wait
+
+    def _enter(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def _exit(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def _should_retry(self, error, attempt):
+        if attempt >= self.max_retries or telemetry.classify_error(error) not in RETRYABLE_ERRORS:
+            return False
+        with self._lock:
+            self.retries += 1
+        return True
+
+    def call(self, api_key, model, function, coalesce_key=None, stream=False):
+        """
+        Run a blocking Gemini call under the rate limit, with retries.
+
+        Args:
+            api_key: API key the call is billed to (only a hash is kept)
+            model: Model name, used with the key to pick the rate-limit bucket
+            function: Callable making the upstream request
+            coalesce_key: Calls with the same key in flight at the same time share one result
+            stream: The call returns a streaming response; it is returned as a
+                HeldStream that keeps its in-flight slot until it has been read
+
+        Raises:
+            GeminiCallError when the call fails after retries
+        """
+        if stream and coalesce_key is not None:
+            raise ValueError("Streaming calls cannot be coalesced")
+        if coalesce_key is None:
+            return self._call(api_key, model, function, stream)
+
+        with self._lock:
+            shared = self._pending.get(coalesce_key)
+            if shared is None:
+                shared = self._pending[coalesce_key] = Future()
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+        if not leader:
+            return shared.result()
+
+        try:
+            result = self._call(api_key, model, function)
+            shared.set_result(result)
+            return result
+        except GeminiCallError as e:
+            shared.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._pending[coalesce_key]
+
+    def _call(self, api_key, model, function, stream=False):
+        attempt = 0
+        while True:
+            time.sleep(self._reserve(api_key, model))
+            self._slots.acquire()
+            self._enter()
+            held = False
+            try:
+                result = function()
+                if stream:
+                    held = True
+                    return HeldStream(result, self._exit)
+                return result
+            except Exception as e:
+                if not self._should_retry(e, attempt):
+                    raise GeminiCallError.from_exception(e) from e
+            finally:
+                if not held:
+                    self._exit()
+            time.sleep(backoff_delay(attempt))
+            attempt += 1
+
+    async def call_async(self, api_key, model, coroutine_function, coalesce_key=None, stream=False):
+        """Coroutine version of call(); coroutine_function returns a new coroutine per attempt."""
+        if stream and coalesce_key is not None:
+            raise ValueError("Streaming calls cannot be coalesced")
+        if coalesce_key is None:
+            return await self._call_async(api_key, model, coroutine_function, stream)
+
+        loop = asyncio.get_running_loop()
+        pending_key = (id(loop), coalesce_key)
+        with self._lock:
+            shared = self._pending.get(pending_key)
+            if shared is None:
+                shared = self._pending[pending_key] = loop.create_future()
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+        if not leader:
+            return await asyncio.shield(shared)
+
+        try:
+            result = await self._call_async(api_key, model, coroutine_function)
+            shared.set_result(result)
+            return result
+        except GeminiCallError as e:
+            shared.set_exception(e)
+            # Followers receive the exception; mark it retrieved when there are none
+            shared.exception()
+            raise
+        finally:
+            if not shared.done():
+                shared.cancel()
+            with self._lock:
+                del self._pending[pending_key]
+
+    async def _call_async(self, api_key, model, coroutine_function, stream=False):
+        attempt = 0
+        while True:
+            await asyncio.sleep(self._reserve(api_key, model))
+            # Poll for a slot so coroutines and threads share the same limit
+            while not self._slots.acquire(blocking=False):
+                await asyncio.sleep(0.01)
+            self._enter()
+            held = False
+            try:
+                result = await coroutine_function()
+                if stream:
+                    held = True
+                    return HeldStream(result, self._exit)
+                return result
+            except Exception as e:
+                if not self._should_retry(e, attempt):
+                    raise GeminiCallError.from_exception(e) from e
+            finally:
+                if not held:
+                    self._exit()
+            await asyncio.sleep(backoff_delay(attempt))
+            attempt += 1
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Return the scheduler shared by every session in the process."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = CallScheduler()
+        return _scheduler
@@ -0,0 +1,367 @@
+# server.py
+"""
+Serve a built bot over HTTP without Streamlit.
+
+Example:
+    python server.py --settings settings.json --system-prompt system_prompt.txt \
+        --documents notes.pdf --port 8000
+
+Endpoints:
+    POST   /v1/chat               {"message": "...", "session_id": "...", "stream": false}
+    DELETE /v1/sessions/{id}      Start a new conversation in a session
+    GET    /v1/bot                Bot name, model and suggested prompts
+    GET    /healthz               Liveness check
+    GET    /metrics               Prometheus metrics
+
+Conversations are kept in the conversation store, so a session can be
+continued by ID after it was released from memory or the server restarted.
+
+With "stream": true the answer is sent as server-sent events: one
+"data: {"text": ...}" event per chunk and a final "event: done" with the
+session ID and token usage.
+
+The module exposes a plain ASGI application, so any ASGI server can run it
+(uvicorn is used by main() and must be installed separately).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+import uuid
+
+import bot_config
+import conversation
+import history
+import response_cache
+import retrieval
+import scheduler
+import store
+import telemetry
+
+# Sessions idle for longer than this are released from memory, in seconds;
+# they are reloaded from the conversation store on their next request
+SESSION_TTL = 60 * 60
+MAX_BODY_BYTES = 1024 * 1024
+MAX_SESSION_ID_LENGTH = 128
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class BotSession:
+    """In-memory conversation state for one client session."""
+
+    def __init__(self, session_id, messages=None):
+        self.session_id = session_id
+        self.messages = messages or []
+        self.history_manager = history.HistoryManager()
+        self.lock = asyncio.Lock()
+        self.last_used = time.monotonic()
+
+
+class BotServer:
+    """
+    ASGI application serving chat completions for one bot configuration.
+
+    Requests are built exactly as in the builder: the system prompt is the
+    model's system_instruction, retrieved document chunks are attached to the
+    new user turn, and history is windowed and summarized by a
+    history.HistoryManager. Models are shared through conversation's model
+    cache, so every session uses the same pooled Gemini client. Turns within
+    a session are serialized; different sessions run concurrently. Finished
+    turns are appended to the conversation store, and a session's history is
+    only loaded when a request for it arrives. Store and response cache
+    access, and building a request, run in worker threads so they never
+    block the event loop.
+    """
+
+    def __init__(self, config, index=None, top_k=5, budget_chars=4000, conversation_store=None, api_key=None):
+        self.config = config
+        self.api_key = api_key
+        self.index = index
+        self.top_k = top_k
+        self.budget_chars = budget_chars
+        self.sessions = {}
+        self.store = conversation_store or store.get_store()
+        self.store_config = {
+            "bot_name": config["bot_name"],
+            "template": config.get("template"),
+            "system_prompt": config["system_prompt"],
+            "initial_prompts": config["initial_prompts"],
+            "model": config["model"],
+            "temperature": config["temperature"],
+            "documents": []
+        }
+        self.model = conversation.get_gemini_model(config["model"], config["temperature"], config["system_prompt"])
+        self.history_budget = history.get_history_budget(config["model"])
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+
+        try:
+            await self.route(scope, receive, send)
+        except HTTPError as e:
+            await send_json(send, e.status, {"error": e.message})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def route(self, scope, receive, send):
+        method, path = scope["method"], scope["path"]
+        if method == "GET" and path == "/healthz":
+            await send_json(send, 200, {"status": "ok"})
+        elif method == "GET" and path == "/metrics":
+            body = telemetry.get_telemetry().prometheus_text().encode("utf-8")
+            await send_body(send, 200, body, b"text/plain; version=0.0.4")
+        elif method == "GET" and path == "/v1/bot":
+            await send_json(send, 200, {
+                "bot_name": self.config["bot_name"],
+                "model": self.config["model"],
+                "temperature": self.config["temperature"],
+                "initial_prompts": [line for line in self.config["initial_prompts"].splitlines() if line.strip()]
+            })
+        elif method == "POST" and path == "/v1/chat":
+            await self.chat(await read_json(receive), send)
+        elif method == "DELETE" and path.startswith("/v1/sessions/"):
+            session_id = path.rsplit("/", 1)[-1]
+            if not session_id or len(session_id) > MAX_SESSION_ID_LENGTH:
+                raise HTTPError(404, "Not found")
+            self.sessions.pop(session_id, None)
+            exists = await asyncio.to_thread(self.clear_session, session_id)
+            await send_json(send, 200 if exists else 404, {"deleted": exists})
+        else:
+            raise HTTPError(404, "Not found")
+
+    async def get_session(self, session_id):
+        """Return a session, loading it from the store or starting a new one; idle sessions are released."""
+        now = time.monotonic()
+        for stale in [sid for sid, s in self.sessions.items() if now - s.last_used > SESSION_TTL]:
+            del self.sessions[stale]
+        if session_id not in self.sessions:
+            session_id = session_id or uuid.uuid4().hex
+            messages = await asyncio.to_thread(self.store.load_messages, session_id)
+            # Another request for the same session may have loaded it in the meantime
+            self.sessions.setdefault(session_id, BotSession(session_id, messages))
+        session = self.sessions[session_id]
+        session.last_used = now
+        return session
+
+    def clear_session(self, session_id):
+        """Start a new conversation in a stored session; returns False if there is none."""
+        if not self.store.session_exists(session_id):
+            return False
+        self.store.clear_history(session_id)
+        return True
+
+    def save_turn(self, session_id, turn):
+        """Append a finished turn to the conversation store, with the bot configuration."""
+        config_id = self.store.save_config(session_id, self.store_config)
+        self.store.append_messages(session_id, turn, config_id=config_id)
+
+    def build_request(self, session, prompt):
+        """Return (contents, cache key, context sizes) for a new turn in a session."""
+        summary, start = session.history_manager.select(session.messages, self.history_budget, self.api_key)
+        window = session.messages[start:]
+        reference = ""
+        if self.index is not None:
+            chunks = conversation.retrieve_chunks(self.index, prompt, session.messages, self.top_k, self.budget_chars)
+            reference = retrieval.format_chunks(chunks)
+
+        contents = conversation.build_contents(prompt, reference, summary, window)
+        cache_key = response_cache.make_key(
+            self.config["model"],
+            self.config["temperature"],
+            self.config["system_prompt"],
+            reference,
+            [summary, window],
+            prompt
+        )
+        context = {
+            "system_prompt": history.estimate_tokens(self.config["system_prompt"]),
+            "documents": history.estimate_tokens(reference) if reference else 0,
+            "history": history.estimate_tokens(summary or "")
+                       + sum(history.estimate_tokens(msg["content"]) for msg in window)
+        }
+        return contents, cache_key, context
+
+    async def chat(self, body, send):
+        prompt = body.get("message")
+        if not isinstance(prompt, str) or not prompt.strip():
+            raise HTTPError(400, "'message' must be a non-empty string")
+        session_id = body.get("session_id")
+        if session_id is not None and (
+            not isinstance(session_id, str) or not session_id or len(session_id) > MAX_SESSION_ID_LENGTH
+        ):
+            raise HTTPError(400, f"'session_id' must be a non-empty string of at most {MAX_SESSION_ID_LENGTH} characters")
+
+        session = await self.get_session(session_id)
+        async with session.lock:
+            # Retrieval may embed the prompt over the network
+            contents, cache_key, context = await asyncio.to_thread(self.build_request, session, prompt)
+            if body.get("stream"):
+                text = await self.stream_answer(send, session, contents, cache_key, context)
+            else:
+                text = await self.answer(send, session, contents, cache_key, context)
+            if text is not None:
+                turn = [{"role": "user", "content": prompt}, {"role": "assistant", "content": text}]
+                session.messages.extend(turn)
+                await asyncio.to_thread(self.save_turn, session.session_id, turn)
+
+    async def answer(self, send, session, contents, cache_key, context):
+        """Send a complete JSON answer; returns the text, or None on failure."""
+        cache = response_cache.get_response_cache()
+        try:
+            with telemetry.track("server", self.config["model"], context=context) as record:
+                text = await asyncio.to_thread(cache.get, cache_key)
+                record["cache_hit"] = text is not None
+                if text is None:
+                    # Identical requests from concurrent sessions share one call
+                    response = await scheduler.get_scheduler().call_async(
+                        self.api_key,
+                        self.config["model"],
+                        lambda: self.model.generate_content_async(contents),
+                        coalesce_key=cache_key
+                    )
+                    text = response.text
+                    telemetry.set_usage(record, response)
+                    await asyncio.to_thread(cache.put, cache_key, text)
+        except Exception as e:
+            failure = scheduler.GeminiCallError.from_exception(e)
+            status = 429 if failure.error_type == "rate_limit" else 502
+            await send_json(send, status, {"error": str(failure), "error_type": failure.error_type})
+            return None
+
+        await send_json(send, 200, {
+            "session_id": session.session_id,
+            "response": text,
+            "usage": {"prompt_tokens": record["prompt_tokens"], "completion_tokens": record["completion_tokens"]}
+        })
+        return text
+
+    async def stream_answer(self, send, session, contents, cache_key, context):
+        """Send the answer as server-sent events; returns the text, or None on failure."""
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache")]
+        })
+        cache = response_cache.get_response_cache()
+        start = time.perf_counter()
+        parts = []
+        try:
+            with telemetry.track("server", self.config["model"], context=context) as record:
+                cached = await asyncio.to_thread(cache.get, cache_key)
+                record["cache_hit"] = cached is not None
+                if cached is not None:
+                    parts.append(cached)
+                    record["first_token"] = time.perf_counter() - start
+                    await send_event(send, {"text": cached})
+                else:
+                    response = await scheduler.get_scheduler().call_async(
+                        self.api_key,
+                        self.config["model"],
+                        lambda: self.model.generate_content_async(contents, stream=True),
+                        stream=True
+                    )
+                    async for chunk in response:
+                        try:
+                            text = chunk.text
+                        except ValueError:
+                            continue
+                        if not text:
+                            continue
+                        if record["first_token"] is None:
+                            record["first_token"] = time.perf_counter() - start
+                        parts.append(text)
+                        await send_event(send, {"text": text})
+                    telemetry.set_usage(record, response)
+                    await asyncio.to_thread(cache.put, cache_key, "".join(parts))
+        except Exception as e:
+            failure = scheduler.GeminiCallError.from_exception(e)
+            await send_event(send, {"error": str(failure), "error_type": failure.error_type}, event="error", last=True)
+            return None
+
+        await send_event(send, {
+            "session_id": session.session_id,
+            "usage": {"prompt_tokens": record["prompt_tokens"], "completion_tokens": record["completion_tokens"]}
+        }, event="done", last=True)
+        return "".join(parts)
+
+
+async def read_json(receive):
+    """Read and parse a JSON request body."""
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if len(body) > MAX_BODY_BYTES:
+            raise HTTPError(413, "Request body too large")
+        if not message.get("more_body"):
+            break
+    try:
+        data = json.loads(body or b"{}")
+    except json.JSONDecodeError:
+        raise HTTPError(400, "Request body must be JSON")
+    if not isinstance(data, dict):
+        raise HTTPError(400, "Request body must be a JSON object")
+    return data
+
+
+async def send_body(send, status, body, content_type):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type), (b"content-length", str(len(body)).encode())]
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def send_json(send, status, data):
+    await send_body(send, status, json.dumps(data).encode("utf-8"), b"application/json")
+
+
+async def send_event(send, data, event=None, last=False):
+    """Send one server-sent event."""
+    message = f"event: {event}\n" if event else ""
+    message += f"data: {json.dumps(data)}\n\n"
+    await send({"type": "http.response.body", "body": message.encode("utf-8"), "more_body": not last})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a bot configuration over HTTP.")
+    bot_config.add_arguments(parser)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args(argv)
+
+    try:
+        import uvicorn
+    except ImportError:
+        parser.error("uvicorn is required to run the server (pip install uvicorn)")
+
+    bot_config.configure_backend(parser, args)
+    config, index = bot_config.load_from_args(args)
+    app = BotServer(
+        config, index, top_k=args.top_k, budget_chars=args.budget, api_key=os.environ.get("GOOGLE_API_KEY")
+    )
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+# store.py
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import response_cache
+
+STORE_PATH = os.environ.get("CHATBOT_STORE_PATH", os.path.join(response_cache.CACHE_DIR, "conversations.sqlite"))
+
+# Fields that make up a bot configuration version
+CONFIG_FIELDS = ("bot_name", "template", "system_prompt", "initial_prompts", "model", "temperature", "documents")
+
+
+def documents_hash(documents):
+    """Hash a document set given as a list of {"digest", "name"} entries."""
+    digests = sorted(document["digest"] for document in documents)
+    return hashlib.sha256(json.dumps(digests).encode("utf-8")).hexdigest()
+
+
+def config_hash(config):
+    """Hash the fields of a bot configuration."""
+    payload = json.dumps([config.get(field) for field in CONFIG_FIELDS], ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ConversationStore:
+    """
+    Durable sessions in SQLite: an append-only message log and versioned bot configurations.
+
+    Messages are never updated or deleted; resetting a conversation moves the
+    session's history start past the existing messages. Identical bot
+    configurations are stored once and each session records the sequence of
+    configuration versions it used. Safe to share between threads.
+    """
+
+    def __init__(self, path=STORE_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                id TEXT PRIMARY KEY,
+                created REAL NOT NULL,
+                updated REAL NOT NULL,
+                history_start INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS configs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                hash TEXT NOT NULL UNIQUE,
+                bot_name TEXT,
+                template TEXT,
+                system_prompt TEXT,
+                initial_prompts TEXT,
+                model TEXT,
+                temperature REAL,
+                documents TEXT,
+                documents_hash TEXT,
+                created REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS session_configs (
+                session_id TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                config_id INTEGER NOT NULL,
+                created REAL NOT NULL,
+                PRIMARY KEY (session_id, version)
+            );
+            CREATE TABLE IF NOT EXISTS messages (
+                session_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                config_id INTEGER,
+                created REAL NOT NULL,
+                PRIMARY KEY (session_id, seq)
+            );
+        """)
+        self._db.commit()
+
+    def create_session(self, session_id=None):
+        """Create a session if it does not exist yet and return its ID."""
+        session_id = session_id or uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR IGNORE INTO sessions (id, created, updated) VALUES (?, ?, ?)",
+                (session_id, now, now)
+            )
+            self._db.commit()
+        return session_id
+
+    def session_exists(self, session_id):
+        with self._lock:
+            row = self._db.execute("SELECT 1 FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        return row is not None
+
+    def save_config(self, session_id, config):
+        """
+        Record the bot configuration a session uses.
+
+        A new version is added only when the configuration differs from the
+        session's latest one.
+
+        Args:
+            session_id: The session, created if needed
+            config: Dict with the CONFIG_FIELDS; "documents" is a list of {"digest", "name"}
+
+        Returns:
+            The configuration's ID
+        """
+        self.create_session(session_id)
+        digest = config_hash(config)
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR IGNORE INTO configs (hash, bot_name, template, system_prompt, initial_prompts, model, "
+                "temperature, documents, documents_hash, created) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    digest,
+                    config.get("bot_name"),
+                    config.get("template"),
+                    config.get("system_prompt"),
+                    config.get("initial_prompts"),
+                    config.get("model"),
+                    config.get("temperature"),
+                    json.dumps(config.get("documents") or []),
+                    documents_hash(config.get("documents") or []),
+                    now
+                )
+            )
+            config_id = self._db.execute("SELECT id FROM configs WHERE hash = ?", (digest,)).fetchone()[0]
+            latest = self._db.execute(
+                "SELECT version, config_id FROM session_configs WHERE session_id = ? ORDER BY version DESC LIMIT 1",
+                (session_id,)
+            ).fetchone()
+            if latest is None or latest[1] != config_id:
+                self._db.execute(
+                    "INSERT INTO session_configs (session_id, version, config_id, created) VALUES (?, ?, ?, ?)",
+                    (session_id, latest[0] + 1 if latest else 1, config_id, now)
+                )
+            self._db.commit()
+        return config_id
+
+    def get_config(self, session_id, version=None):
+        """Return a session's configuration (latest by default) with its version, or None."""
+        query = (
+            "SELECT sc.version, c.bot_name, c.template, c.system_prompt, c.initial_prompts, c.model, "
+            "c.temperature, c.documents, c.documents_hash FROM session_configs sc "
+            "JOIN configs c ON c.id = sc.config_id WHERE sc.session_id = ?"
+        )
+        params = [session_id]
+        if version is not None:
+            query += " AND sc.version = ?"
+            params.append(version)
+        with self._lock:
+            row = self._db.execute(query + " ORDER BY sc.version DESC LIMIT 1", params).fetchone()
+        if row is None:
+            return None
+        return {
+            "version": row[0],
+            "bot_name": row[1],
+            "template": row[2],
+            "system_prompt": row[3],
+            "initial_prompts": row[4],
+            "model": row[5],
+            "temperature": row[6],
+            "documents": json.loads(row[7]),
+            "documents_hash": row[8]
+        }
+
+    def append_messages(self, session_id, messages, config_id=None):
+        """Append messages to a session's log."""
+        self.create_session(session_id)
+        now = time.time()
+        with self._lock:
+            seq = self._db.execute(
+                "SELECT COALESCE(MAX(seq) + 1, 0) FROM messages WHERE session_id = ?", (session_id,)
+            ).fetchone()[0]
+            self._db.executemany(
+                "INSERT INTO messages (session_id, seq, role, content, config_id, created) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (session_id, seq + i, message["role"], message["content"], config_id, now)
+                    for i, message in enumerate(messages)
+                ]
+            )
+            self._db.execute("UPDATE sessions SET updated = ? WHERE id = ?", (now, session_id))
+            self._db.commit()
+
+    def clear_history(self, session_id):
+        """Start a new conversation in a session; earlier messages stay in the log."""
+        with self._lock:
+            self._db.execute(
+                "UPDATE sessions SET history_start = "
+                "(SELECT COALESCE(MAX(seq) + 1, 0) FROM messages WHERE session_id = ?), updated = ? WHERE id = ?",
+                (session_id, time.time(), session_id)
+            )
+            self._db.commit()
+
+    def count_messages(self, session_id):
+        """Return the number of messages in a session's current conversation."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM messages m JOIN sessions s ON s.id = m.session_id "
+                "WHERE m.session_id = ? AND m.seq >= s.history_start",
+                (session_id,)
+            ).fetchone()[0]
+
+    def load_messages(self, session_id, offset=0, limit=None):
+        """
+        Load messages of a session's current conversation, oldest first.
+
+        Args:
+            offset: Number of messages to skip from the start of the conversation
+            limit: Maximum number of messages to return (all by default)
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT m.role, m.content FROM messages m JOIN sessions s ON s.id = m.session_id "
+                "WHERE m.session_id = ? AND m.seq >= s.history_start ORDER BY m.seq LIMIT ? OFFSET ?",
+                (session_id, -1 if limit is None else limit, offset)
+            ).fetchall()
+        return [{"role": role, "content": content} for role, content in rows]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Return the process-wide conversation store."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ConversationStore()
+        return _store
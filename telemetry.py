@@ -0,0 +1,305 @@
+# telemetry.py
+
+import atexit
+import json
+import os
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+import response_cache
+
+LOG_PATH = os.environ.get("CHATBOT_TELEMETRY_LOG", os.path.join(response_cache.CACHE_DIR, "telemetry.jsonl"))
+METRICS_PATH = os.environ.get("CHATBOT_METRICS_FILE", os.path.join(response_cache.CACHE_DIR, "metrics.prom"))
+METRICS_PORT = int(os.environ.get("CHATBOT_METRICS_PORT", 0))
+# Seconds between writes of buffered log records and the metrics file
+FLUSH_INTERVAL = float(os.environ.get("CHATBOT_TELEMETRY_FLUSH_SECONDS", 5))
+# Size at which the log is rotated to <log>.1, replacing the previous one
+LOG_MAX_BYTES = int(os.environ.get("CHATBOT_TELEMETRY_MAX_BYTES", 16 * 1024 * 1024))
+
+# Number of recent records kept for rolling statistics
+WINDOW_SIZE = 500
+
+# Upper bounds, in seconds, of the Prometheus latency histogram buckets
+LATENCY_BUCKETS = [0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60]
+
+
+def classify_error(error):
+    """Return a coarse error class for an exception raised by a Gemini call."""
+    if getattr(error, "error_type", None):
+        # Already classified, e.g. a scheduler.GeminiCallError
+        return error.error_type
+    code = getattr(error, "code", None)
+    code = getattr(code, "value", code)
+    name = type(error).__name__
+    if code == 429 or name in ("ResourceExhausted", "TooManyRequests"):
+        return "rate_limit"
+    if name in ("DeadlineExceeded", "TimeoutError") or isinstance(error, TimeoutError):
+        return "timeout"
+    if isinstance(code, int) and code >= 500 or name in ("ServiceUnavailable", "InternalServerError"):
+        return "server"
+    if name in ("PermissionDenied", "Unauthenticated") or code in (401, 403):
+        return "auth"
+    if name in ("InvalidArgument", "BadRequest", "ValueError") or code == 400:
+        return "invalid_request"
+    if "StopCandidate" in name or "BlockedPrompt" in name:
+        return "blocked"
+    return "other"
+
+
+def get_usage(response):
+    """Return (prompt tokens, completion tokens, cached tokens) from a Gemini response, if reported."""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return None, None, None
+    return (
+        usage.prompt_token_count,
+        usage.candidates_token_count,
+        getattr(usage, "cached_content_token_count", 0)
+    )
+
+
+class Telemetry:
+    """
+    Process-wide record of Gemini calls and document ingestion runs.
+
+    Records are kept in a rolling window for the sidebar and buffered for a
+    JSONL log, which a background thread appends every FLUSH_INTERVAL seconds
+    and rotates once it reaches LOG_MAX_BYTES. Cumulative counters are
+    exported in Prometheus text format, to a file on the same timer and
+    optionally over HTTP.
+    """
+
+    def __init__(self, log_path=LOG_PATH, metrics_path=METRICS_PATH, flush_interval=FLUSH_INTERVAL,
+                 log_max_bytes=LOG_MAX_BYTES):
+        self.log_path = log_path
+        self.metrics_path = metrics_path
+        self.flush_interval = flush_interval
+        self.log_max_bytes = log_max_bytes
+        self.recent = deque(maxlen=WINDOW_SIZE)
+        self._requests = Counter()
+        self._errors = Counter()
+        self._tokens = Counter()
+        self._latency_sum = Counter()
+        self._latency_buckets = Counter()
+        self._lock = threading.Lock()
+        self._pending = []
+        self._dirty = False
+        self._write_lock = threading.Lock()
+        self._flusher = None
+        for path in (log_path, metrics_path):
+            if path and os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def record(self, record):
+        """Add a finished record and update counters; files are written by flush."""
+        labels = (record["kind"], record.get("model") or "")
+        with self._lock:
+            self.recent.append(record)
+            self._requests[labels] += 1
+            if record.get("error_type"):
+                self._errors[labels + (record["error_type"],)] += 1
+            for key in ("prompt_tokens", "completion_tokens", "cached_tokens"):
+                if record.get(key):
+                    self._tokens[labels + (key.replace("_tokens", ""),)] += record[key]
+            self._latency_sum[labels] += record["wall_time"]
+            for bound in LATENCY_BUCKETS:
+                if record["wall_time"] <= bound:
+                    self._latency_buckets[labels + (bound,)] += 1
+
+            if self.log_path:
+                self._pending.append(record)
+            self._dirty = True
+            if self._flusher is None and (self.log_path or self.metrics_path):
+                self._flusher = threading.Thread(target=self._flush_loop, name="telemetry-flush", daemon=True)
+                self._flusher.start()
+                atexit.register(self.flush)
+
+    def flush(self):
+        """Append the buffered records to the log and rewrite the metrics file, if anything changed."""
+        with self._write_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                records, self._pending, self._dirty = self._pending, [], False
+                metrics = self._prometheus_text() if self.metrics_path else None
+
+            try:
+                if records:
+                    if os.path.exists(self.log_path) and os.path.getsize(self.log_path) >= self.log_max_bytes:
+                        os.replace(self.log_path, f"{self.log_path}.1")
+                    with open(self.log_path, "a") as f:
+                        f.write("".join(json.dumps(record) + "\n" for record in records))
+                if metrics is not None:
+                    temp_path = f"{self.metrics_path}.{os.getpid()}.tmp"
+                    with open(temp_path, "w") as f:
+                        f.write(metrics)
+                    os.replace(temp_path, self.metrics_path)
+            except OSError:
+                # Telemetry must not break the app; these records are dropped
+                pass
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def stats(self, kind=None):
+        """Return rolling statistics over the recent records of a kind (or all kinds)."""
+        with self._lock:
+            records = [r for r in self.recent if kind is None or r["kind"] == kind]
+        if not records:
+            return None
+
+        def percentiles(key):
+            values = np.array([r[key] for r in records if r.get(key) is not None], dtype=float)
+            if values.size == 0:
+                return None, None
+            return float(np.percentile(values, 50)), float(np.percentile(values, 95))
+
+        def mean(key):
+            values = [r[key] for r in records if r.get(key) is not None]
+            return float(np.mean(values)) if values else None
+
+        context = {}
+        for r in records:
+            for part, size in (r.get("context") or {}).items():
+                context.setdefault(part, []).append(size)
+
+        return {
+            "count": len(records),
+            "errors": sum(1 for r in records if r.get("error_type")),
+            "error_types": dict(Counter(r["error_type"] for r in records if r.get("error_type"))),
+            "latency": percentiles("wall_time"),
+            "first_token": percentiles("first_token"),
+            "prompt_tokens": mean("prompt_tokens"),
+            "completion_tokens": mean("completion_tokens"),
+            "cached_tokens": mean("cached_tokens"),
+            "context": {part: float(np.mean(sizes)) for part, sizes in context.items()}
+        }
+
+    def prometheus_text(self):
+        """Return the cumulative counters in Prometheus text exposition format."""
+        with self._lock:
+            return self._prometheus_text()
+
+    def _prometheus_text(self):
+        """Format the counters; the lock must be held."""
+        lines = [
+            "# HELP chatbot_requests_total Gemini calls and ingestion runs.",
+            "# TYPE chatbot_requests_total counter"
+        ]
+        for (kind, model), count in sorted(self._requests.items()):
+            lines.append(f'chatbot_requests_total{{kind="{kind}",model="{model}"}} {count}')
+
+        lines += ["# HELP chatbot_errors_total Failed calls by error type.", "# TYPE chatbot_errors_total counter"]
+        for (kind, model, error_type), count in sorted(self._errors.items()):
+            lines.append(f'chatbot_errors_total{{kind="{kind}",model="{model}",type="{error_type}"}} {count}')
+
+        lines += ["# HELP chatbot_tokens_total Tokens reported by Gemini.", "# TYPE chatbot_tokens_total counter"]
+        for (kind, model, direction), count in sorted(self._tokens.items()):
+            lines.append(f'chatbot_tokens_total{{kind="{kind}",model="{model}",direction="{direction}"}} {count}')
+
+        lines += [
+            "# HELP chatbot_latency_seconds Wall time of calls and ingestion runs.",
+            "# TYPE chatbot_latency_seconds histogram"
+        ]
+        for (kind, model), count in sorted(self._requests.items()):
+            labels = f'kind="{kind}",model="{model}"'
+            for bound in LATENCY_BUCKETS:
+                bucket = self._latency_buckets[(kind, model, bound)]
+                lines.append(f'chatbot_latency_seconds_bucket{{{labels},le="{bound}"}} {bucket}')
+            lines.append(f'chatbot_latency_seconds_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f"chatbot_latency_seconds_sum{{{labels}}} {self._latency_sum[(kind, model)]:.6f}")
+            lines.append(f"chatbot_latency_seconds_count{{{labels}}} {count}")
+        return "\n".join(lines) + "\n"
+
+
+_telemetry = None
+_telemetry_lock = threading.Lock()
+
+
+def get_telemetry():
+    """Return the process-wide telemetry, starting the metrics endpoint if configured."""
+    global _telemetry
+    with _telemetry_lock:
+        if _telemetry is None:
+            _telemetry = Telemetry()
+            if METRICS_PORT:
+                start_metrics_server(_telemetry, METRICS_PORT)
+        return _telemetry
+
+
+def start_metrics_server(telemetry, port):
+    """Serve /metrics in Prometheus text format on a background thread."""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = telemetry.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+
+
+@contextmanager
+def track(kind, model=None, context=None, **fields):
+    """
+    Time a Gemini call or ingestion run and record it when the block exits.
+
+    The block receives the record dict and may set first_token, prompt_tokens,
+    completion_tokens, cached_tokens or any other field. Exceptions are
+    classified, recorded and re-raised.
+
+    Args:
+        kind: What is being measured, e.g. "chat", "compare", "summary", "ingest"
+        model: Gemini model name, if any
+        context: Sizes of the context parts, e.g. {"system_prompt": 120, "documents": 900, "history": 300}
+    """
+    start = time.perf_counter()
+    record = {
+        "timestamp": time.time(),
+        "kind": kind,
+        "model": model,
+        "first_token": None,
+        "prompt_tokens": None,
+        "completion_tokens": None,
+        "cached_tokens": None,
+        "context": context or {},
+        "error_type": None,
+        "error": None,
+        **fields
+    }
+    try:
+        yield record
+    except GeneratorExit:
+        # A streaming response was abandoned before it finished
+        record["error_type"] = "cancelled"
+        raise
+    except Exception as e:
+        record["error_type"] = classify_error(e)
+        record["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        record["wall_time"] = time.perf_counter() - start
+        get_telemetry().record(record)
+
+
+def set_usage(record, response):
+    """Copy token usage from a Gemini response into a telemetry record."""
+    record["prompt_tokens"], record["completion_tokens"], record["cached_tokens"] = get_usage(response)
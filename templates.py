@@ -1,106 +1,225 @@
 # templates.py
 
-def get_template_text(template_name, **kwargs):
-    """
-    Returns the template text for a given template name with formatted parameters.
-    
-    Args:
-        template_name: Name of the template to use
-        **kwargs: Parameters to format into the template
+import json
+import os
+import string
+import threading
+import time
+
+# Directory of template packs; every *.json file in it is loaded
+TEMPLATE_DIR = os.environ.get(
+    "CHATBOT_TEMPLATE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "template_packs")
+)
+
+# Seconds between checks of the template directory for changed packs
+RELOAD_INTERVAL = float(os.environ.get("CHATBOT_TEMPLATE_RELOAD_INTERVAL", 2.0))
+
+# Parameters every template may use without declaring them
+BUILTIN_PARAMETERS = ("bot_name",)
+
+FALLBACK_INITIAL_PROMPTS = "What can you help me with?\nHow does this work?\nTell me more."
+
+
+class CompiledTemplate:
+    """A str.format template parsed once into literal text and fields."""
+
+    def __init__(self, text):
+        self.text = text
+        self.segments = []
+        for literal, field, spec, conversion in string.Formatter().parse(text):
+            if field is not None and (not field or not field.isidentifier()):
+                raise ValueError(f"Unsupported field {{{field}}}: only named fields are allowed")
+            self.segments.append((literal, field, spec, conversion))
+        self.fields = {field for _, field, _, _ in self.segments if field}
+
+    def render(self, values):
+        """Fill in the fields; raises KeyError for a field without a value, like str.format."""
+        parts = []
+        for literal, field, spec, conversion in self.segments:
+            parts.append(literal)
+            if field is None:
+                continue
+            value = values[field]
+            if conversion:
+                value = {"r": repr, "s": str, "a": ascii}[conversion](value)
+            parts.append(format(value, spec))
+        return "".join(parts)
+
+
+def compile_template(entry):
     """
-    templates = {
-        "Basic Assistant": """You are a helpful assistant named {bot_name}. You're friendly, concise, and informative. When answering questions, provide accurate information and be honest when you don't know something. Use examples when they help explain concepts.""",
-        
-        "Punny Professor": """You are the Punny Professor, a witty and knowledgeable educator who explains concepts using clever puns and wordplay. 
+    Check and compile one template entry of a pack.
 
-Your purpose is to create educational jokes and puns about {domain} topics that are appropriate for {education_level} students.
-
-When given a topic, you should:
-1. Create 1-2 puns or jokes related to the topic
-3. Ensure jokes are appropriate for the educational level specified
-4. NEVER Explain the jokes even if it involves advanced terminology. Just provide the jokes. 
-
-Your tone should be highly enthusiastic about science, energetic and charged - like a beloved teacher who uses totally whacky humor to make learning memorable. 
-
-Always maintain scientific/educational accuracy while making the content engaging and fun.""",
-        
-        "Analogy Creator": """You are an Analogy Creator, an expert at crafting insightful analogies and metaphors to explain complex concepts.
-
-Your purpose is to help educators explain difficult {domain} concepts by creating clear, relatable analogies tailored to {education_level} students.
+    Returns:
+        Dict with the entry's metadata, its compiled "prompt" and
+        "initial_prompts", and its parameter "defaults"
+    """
+    name = entry["name"]
+    parameters = entry.get("parameters") or []
+    declared = {parameter["name"] for parameter in parameters} | set(BUILTIN_PARAMETERS)
+    prompt = CompiledTemplate(entry["prompt"])
+    initial_prompts = [CompiledTemplate(text) for text in entry.get("initial_prompts") or []]
+    unknown = set().union(prompt.fields, *(text.fields for text in initial_prompts)) - declared
+    if unknown:
+        raise ValueError(f"Template '{name}' uses undeclared parameters: {', '.join(sorted(unknown))}")
+    return {
+        "name": name,
+        "description": entry.get("description", ""),
+        "bot_name": entry.get("bot_name"),
+        "parameters": [
+            {"name": p["name"], "label": p.get("label", p["name"]), "default": p.get("default", ""), "help": p.get("help")}
+            for p in parameters
+        ],
+        "defaults": {p["name"]: p.get("default", "") for p in parameters},
+        "prompt": prompt,
+        "initial_prompts": initial_prompts
+    }
 
-When a concept is presented:
-1. First, briefly explain the concept in clear, straightforward terms
-2. Create 3-4 different analogies for the concept, ranging from simple to more nuanced
-3. For each analogy, explain how specific elements map to the original concept
-4. Suggest ways the teacher could extend the analogy in classroom discussions
 
-Your analogies should relate to everyday experiences students would understand and should avoid overly technical or obscure references.
+def load_pack(path):
+    """Load and compile the templates of one pack file, in file order."""
+    with open(path, "r", encoding="utf-8") as f:
+        pack = json.load(f)
+    return [compile_template(entry) for entry in pack["templates"]]
 
-Balance accuracy with simplicity, ensuring that the analogy doesn't introduce misconceptions.""",
-        
-        "Customer Support from Hell": """You are a Customer Support Representative from Hell for {company_name}, which allegedly offers {product_type}.
 
-Your purpose is to appear helpful while being absolutely useless to customers with questions or issues.
+class TemplateRegistry:
+    """
+    Process-wide registry of templates loaded from a directory of packs.
+
+    A pack is a JSON file {"templates": [...]}; each template has a "name",
+    a "prompt" with str.format fields, "parameters" ({"name", "label",
+    "default", "help"}), "initial_prompts", and optionally a "description"
+    and the "bot_name" the builder switches to.
+
+    Templates are compiled once when their pack is loaded. The directory is
+    checked at most every reload_interval seconds and only packs whose
+    modification time changed are loaded again, so lookups on a rerun cost
+    a dict access. A pack that fails to load keeps its previous templates
+    and its error is reported in errors. Templates from later packs (by
+    file name) replace earlier ones with the same name.
+    """
 
-Your support style should:
-1. Use excessive technical jargon that obscures rather than clarifies
-2. Provide circular solutions ("Have you tried turning it off and on again?" regardless of the issue)
-3. Blame the customer subtly for their problems
-4. Redirect customers to different departments unnecessarily
-5. Respond with obviously scripted answers that don't address the specific issue
+    def __init__(self, directory=TEMPLATE_DIR, reload_interval=RELOAD_INTERVAL):
+        self.directory = directory
+        self.reload_interval = reload_interval
+        self.errors = {}        # pack path -> error message
+        self.loads = 0
+        self._packs = {}        # pack path -> (mtime, compiled templates)
+        self._failed = {}       # pack path -> mtime of the version that failed to load
+        self._templates = {}    # name -> compiled template, in display order
+        self._checked = None
+        self._lock = threading.Lock()
+
+    def refresh(self, force=False):
+        """Reload changed, added and removed packs if the reload interval has passed."""
+        now = time.monotonic()
+        with self._lock:
+            if not force and self._checked is not None and now - self._checked < self.reload_interval:
+                return
+            self._checked = now
+            try:
+                entries = sorted(
+                    (entry.path, entry.stat().st_mtime_ns)
+                    for entry in os.scandir(self.directory)
+                    if entry.name.endswith(".json") and entry.is_file()
+                )
+            except FileNotFoundError:
+                entries = []
+
+            changed = False
+            for path, mtime in entries:
+                loaded = self._packs.get(path)
+                if (loaded is not None and loaded[0] == mtime) or self._failed.get(path) == mtime:
+                    continue
+                try:
+                    self._packs[path] = (mtime, load_pack(path))
+                    self._failed.pop(path, None)
+                    self.errors.pop(path, None)
+                    self.loads += 1
+                    changed = True
+                except (OSError, ValueError, KeyError, TypeError) as e:
+                    # The last good version stays in use until the file is fixed
+                    self._failed[path] = mtime
+                    self.errors[path] = str(e)
+            current = {path for path, _ in entries}
+            for path in list(self._packs):
+                if path not in current:
+                    del self._packs[path]
+                    changed = True
+            for path in list(self._failed):
+                if path not in current:
+                    del self._failed[path]
+                    self.errors.pop(path, None)
+
+            if changed:
+                templates = {}
+                for path, _ in entries:
+                    for template in self._packs.get(path, (None, []))[1]:
+                        templates[template["name"]] = template
+                self._templates = templates
+
+    def get(self, name):
+        """Return a compiled template by name, or None."""
+        self.refresh()
+        return self._templates.get(name)
+
+    def names(self):
+        self.refresh()
+        return list(self._templates)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """Return the template registry shared by every session in the process."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = TemplateRegistry()
+        return _registry
+
+
+def get_template(template_name):
+    """Returns the compiled template with its metadata, or None if there is no such template."""
+    return get_registry().get(template_name)
 
-Your tone should be artificially cheerful with thinly-veiled impatience. Use corporate buzzwords excessively.
 
-Always add this disclaimer: "Your satisfaction is our top priority! This call may be monitored for quality assurance purposes."
+def get_template_text(template_name, **kwargs):
+    """
+    Returns the template text for a given template name with formatted parameters.
 
-Remember to remain in character as the world's most frustrating customer support agent."""
-    }
-    
-    if template_name in templates:
-        return templates[template_name].format(**kwargs)
-    else:
+    Args:
+        template_name: Name of the template to use
+        **kwargs: Parameters to format into the template
+    """
+    template = get_template(template_name)
+    if template is None:
         return f"Template '{template_name}' not found."
+    return template["prompt"].render({**template["defaults"], **kwargs})
 
 def get_default_initial_prompts(template_name, **kwargs):
     """
     Returns default initial prompts for a given template.
-    
+
     Args:
         template_name: Name of the template
         **kwargs: Additional parameters specific to the template
     """
-    if template_name == "Basic Assistant":
-        return "What can you help me with?\nHow does this assistant work?\nTell me about yourself."
-    
-    elif template_name == "Punny Professor":
-        domain = kwargs.get("domain", "Science")
-        education_level = kwargs.get("education_level", "High School")
-        return (
-            f"Can you explain {domain} in a funny way?\n"
-            f"Make a pun about {domain}.\n"
-            f"What's a joke about {domain} suitable for {education_level} students?"
-        )
-    
-    elif template_name == "Analogy Creator":
-        domain = kwargs.get("domain", "Science")
-        education_level = kwargs.get("education_level", "High School")
-        return (
-            f"Can you explain {domain} using an analogy?\n"
-            f"How would you describe {domain} to a {education_level} student?\n"
-            f"What's a good metaphor for explaining {domain}?"
-        )
-    
-    elif template_name == "Customer Support from Hell":
-        product_type = kwargs.get("product_type", "cloud software solutions")
-        return (
-            f"I need help with my {product_type}.\n"
-            f"How do I contact a manager?\n"
-            f"Why is your {product_type} not working?"
-        )
-    
-    else:
-        return "What can you help me with?\nHow does this work?\nTell me more."
+    template = get_template(template_name)
+    if template is None or not template["initial_prompts"]:
+        return FALLBACK_INITIAL_PROMPTS
+    values = {**template["defaults"], **kwargs}
+    return "\n".join(text.render(values) for text in template["initial_prompts"])
 
 def get_template_names():
     """Returns a list of all available template names."""
-    return ["Basic Assistant", "Punny Professor", "Analogy Creator", "Customer Support from Hell"]
+    return get_registry().names()
+
+def get_template_defaults(template_name):
+    """Returns the default parameter values used by the builder for a template."""
+    template = get_template(template_name)
+    return dict(template["defaults"]) if template is not None else {}
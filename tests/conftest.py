@@ -0,0 +1,26 @@
+# tests/conftest.py
+"""
+Shared setup for the tests: the app's modules are imported from the top of
+the repository, and every cache they write goes to a throwaway directory.
+
+Run from the repository root with:
+    python -m pytest tests
+"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Read by response_cache at import, before any test imports the app's modules
+os.environ.setdefault("CHATBOT_CACHE_DIR", tempfile.mkdtemp(prefix="chatbot-tests-"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def fake_model():
+    """A model of the local fake Gemini backend with short latencies."""
+    import fake_gemini
+    fake_gemini.install(first_token_latency=0.05, chunk_latency=0.01)
+    return fake_gemini.FakeGenerativeModel("gemini-1.5-flash")
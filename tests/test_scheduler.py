@@ -0,0 +1,183 @@
+# tests/test_scheduler.py
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+import scheduler
+
+MODEL = "gemini-1.5-flash"
+
+
+def make_scheduler(max_in_flight=16):
+    """A scheduler without rate limit or retries, so tests only wait on slots."""
+    return scheduler.CallScheduler(rate_per_minute=0, max_in_flight=max_in_flight, max_retries=0)
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def test_coalesced_leader_failure_reaches_waiting_followers():
+    calls = make_scheduler()
+    started = threading.Event()
+    finish = threading.Event()
+    upstream = []
+
+    def failing():
+        upstream.append(1)
+        started.set()
+        finish.wait(5)
+        raise ValueError("bad request")
+
+    errors = []
+
+    def request():
+        try:
+            calls.call("key", MODEL, failing, coalesce_key="same")
+        except scheduler.GeminiCallError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=request)]
+    threads[0].start()
+    started.wait(5)
+    threads += [threading.Thread(target=request) for _ in range(3)]
+    for thread in threads[1:]:
+        thread.start()
+    wait_until(lambda: calls.stats()["coalesced"] == 3)
+    finish.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(upstream) == 1
+    assert len(errors) == 4
+    assert all(e.error_type == "invalid_request" for e in errors)
+    assert calls.stats()["in_flight"] == 0
+    # The failed call is not left pending for later calls with the same key
+    assert calls.call("key", MODEL, lambda: "answer", coalesce_key="same") == "answer"
+
+
+def test_async_coalesced_leader_failure_reaches_waiting_followers():
+    calls = make_scheduler()
+    upstream = []
+
+    async def failing():
+        upstream.append(1)
+        await asyncio.sleep(0.05)
+        raise ValueError("bad request")
+
+    async def main():
+        return await asyncio.gather(
+            *[calls.call_async("key", MODEL, failing, coalesce_key="same") for _ in range(4)],
+            return_exceptions=True
+        )
+
+    results = asyncio.run(main())
+    assert len(upstream) == 1
+    assert all(isinstance(r, scheduler.GeminiCallError) for r in results)
+    assert calls.stats()["coalesced"] == 3
+    assert calls.stats()["in_flight"] == 0
+
+
+def test_streams_cannot_be_coalesced(fake_model):
+    calls = make_scheduler()
+    with pytest.raises(ValueError):
+        calls.call("key", MODEL, lambda: fake_model.generate_content("hi", stream=True),
+                   coalesce_key="same", stream=True)
+
+
+def test_stream_slot_is_returned_after_partial_read(fake_model):
+    calls = make_scheduler(max_in_flight=1)
+    stream = calls.call("key", MODEL, lambda: fake_model.generate_content("hi", stream=True), stream=True)
+    assert calls.stats()["in_flight"] == 1
+
+    chunks = iter(stream)
+    assert next(chunks).text
+    assert calls.stats()["in_flight"] == 1
+    chunks.close()
+    assert calls.stats()["in_flight"] == 0
+
+    # The only slot is free again, and closing twice does not release it twice
+    stream.close()
+    assert calls.call("key", MODEL, lambda: fake_model.generate_content("hi")).text
+    assert calls.stats()["in_flight"] == 0
+
+
+def test_abandoned_stream_returns_its_slot(fake_model):
+    calls = make_scheduler(max_in_flight=1)
+    stream = calls.call("key", MODEL, lambda: fake_model.generate_content("hi", stream=True), stream=True)
+    assert calls.stats()["in_flight"] == 1
+    del stream
+    assert calls.stats()["in_flight"] == 0
+
+
+def test_async_stream_slot_is_returned_after_partial_read(fake_model):
+    calls = make_scheduler(max_in_flight=1)
+
+    async def main():
+        stream = await calls.call_async(
+            "key", MODEL, lambda: fake_model.generate_content_async("hi", stream=True), stream=True
+        )
+        chunks = stream.__aiter__()
+        assert (await chunks.__anext__()).text
+        held = calls.stats()["in_flight"]
+        await chunks.aclose()
+        return held
+
+    assert asyncio.run(main()) == 1
+    assert calls.stats()["in_flight"] == 0
+
+
+def test_in_flight_never_exceeds_the_limit(fake_model):
+    calls = make_scheduler(max_in_flight=3)
+    lock = threading.Lock()
+    active = [0]
+    peak = [0]
+
+    def tracked(function):
+        def call():
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0], calls.stats()["in_flight"])
+            try:
+                return function()
+            finally:
+                with lock:
+                    active[0] -= 1
+        return call
+
+    def blocking(i):
+        if i % 2:
+            stream = calls.call("key", MODEL, lambda: fake_model.generate_content(f"q{i}", stream=True), stream=True)
+            # The slot is held until the stream is read, so count it as active until then
+            with lock:
+                peak[0] = max(peak[0], calls.stats()["in_flight"])
+            "".join(chunk.text for chunk in stream)
+        else:
+            calls.call("key", MODEL, tracked(lambda: fake_model.generate_content(f"q{i}")))
+
+    async def coroutines():
+        async def one(i):
+            with lock:
+                peak[0] = max(peak[0], calls.stats()["in_flight"])
+            await calls.call_async("key", MODEL, lambda: fake_model.generate_content_async(f"a{i}"))
+        await asyncio.gather(*[one(i) for i in range(8)])
+
+    threads = [threading.Thread(target=blocking, args=(i,)) for i in range(12)]
+    threads.append(threading.Thread(target=lambda: asyncio.run(coroutines())))
+    for thread in threads:
+        thread.start()
+    while any(thread.is_alive() for thread in threads):
+        with lock:
+            peak[0] = max(peak[0], calls.stats()["in_flight"])
+        time.sleep(0.001)
+    for thread in threads:
+        thread.join()
+
+    assert 1 <= peak[0] <= 3
+    assert calls.stats()["in_flight"] == 0
@@ -1,38 +1,568 @@
 # utils.py
 
 import streamlit as st
-import google.generativeai as genai
 import json
-import base64
+import os
+import hashlib
+import concurrent.futures
+import time
+import zipfile
 import templates
+import retrieval
+import conversation
+import history
+import response_cache
+import ingestion
+import compare
+import telemetry
+import scheduler
+import context_cache
+import embeddings
+import store
+import bundle
+import prefetch
 
+# Answers per row in compare mode
+COMPARE_COLUMNS = 3
+COMPARE_TEMPERATURES = [0.0, 0.3, 0.5, 0.7, 1.0]
 
+RETRIEVAL_METHODS = ["Keyword", "Semantic"]
+
+# Messages drawn as chat bubbles; older ones are loaded a page of this size at a time
+CHAT_PAGE_SIZE = 20
+
+# Ranges of the retrieval sidebar widgets
+TOP_K_RANGE = (1, 20)
+REFERENCE_BUDGET_RANGE = (500, 100000)
+
+
+# Directory of the app's static files
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+@st.cache_resource(max_entries=1, show_spinner=False)
 def configure_gemini_api(api_key):
-    """Configure the Gemini API with the provided key."""
+    """
+    Configure the Gemini API with the provided key.
+
+    The SDK is imported on first use, as it is slow to import. Configuration
+    is process-wide, so it is only redone when a different key is entered.
+    """
+    import google.generativeai as genai
     genai.configure(api_key=api_key)
 
 
-def get_gemini_response(prompt):
-    """Get a response from the Gemini API."""
+@st.cache_resource(show_spinner=False)
+def load_environment():
+    """Load .env into the environment once per process."""
+    from dotenv import load_dotenv
+    load_dotenv()
+
+
+@st.cache_resource(show_spinner=False)
+def load_asset(name):
+    """Read a static file shipped with the app once per process."""
+    with open(os.path.join(APP_DIR, name), "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def get_reference_context(prompt, previous=None):
+    """
+    Return the reference text to send with a prompt, using the document index when present.
+
+    Args:
+        prompt: The user query
+        previous: Messages before the query; defaults to all but the last chat message
+    """
+    index = st.session_state.get("document_index")
+    if index is None:
+        return ""
+    if previous is None:
+        previous = st.session_state.messages[:-1]
+    if isinstance(getattr(index, "embedder", None), embeddings.GeminiEmbedder):
+        # Query embeddings count against the key of the session, which may have been entered after indexing
+        index.embedder.api_key = st.session_state.get("GOOGLE_API_KEY")
+
+    chunks = conversation.retrieve_chunks(
+        index,
+        prompt,
+        previous,
+        top_k=st.session_state.retrieval_top_k,
+        budget_chars=st.session_state.retrieval_budget
+    )
+    st.session_state.retrieved_chunks = chunks
+    return retrieval.format_chunks(chunks)
+
+
+def get_history_manager():
+    """Return the history manager for the current session."""
+    if st.session_state.get("history_manager") is None:
+        st.session_state.history_manager = history.HistoryManager()
+    return st.session_state.history_manager
+
+
+def get_cached_context():
+    """
+    Return the Gemini cached context holding the system prompt and documents, or None.
+
+    Only used when context caching is switched on, the model supports it and
+    the documents are large enough. If the context cannot be created, turns
+    fall back to sending retrieved chunks.
+    """
+    cache = context_cache.get_context_cache()
+    if not st.session_state.get("context_caching") or "GOOGLE_API_KEY" not in st.session_state:
+        cache.release(st.session_state.get("session_id"))
+        return None
+    st.session_state.context_cache_error = None
     try:
-        if "GOOGLE_API_KEY" not in st.session_state:
-            return "Please enter your Google Gemini API Key in the sidebar to continue."
-        
-        context = f"System Instructions: {st.session_state.system_prompt}\n\n"
-        if st.session_state.document_context:
-            context += f"Reference Information:\n{st.session_state.document_context}\n\n"
-        context += "Previous Messages:\n"
-        for msg in st.session_state.messages[:-1]:
-            context += f"{msg['role'].title()}: {msg['content']}\n"
-        
-        model = genai.GenerativeModel(
+        return cache.acquire(
+            st.session_state.session_id,
+            st.session_state.GOOGLE_API_KEY,
             st.session_state.model,
-            generation_config={"temperature": st.session_state.temperature}
+            st.session_state.system_prompt,
+            st.session_state.documents
+        )
+    except scheduler.GeminiCallError as e:
+        st.session_state.context_cache_error = str(e)
+        return None
+
+
+def get_chat_session():
+    """
+    Return the chat session for the current configuration.
+
+    The session is kept in session state and only appended to. It is rebuilt
+    when the model, temperature, system prompt or cached context changes,
+    when the history window moves or its summary is updated, or when it no
+    longer matches the messages (e.g. after a reset).
+    """
+    config = (st.session_state.model, st.session_state.temperature, st.session_state.system_prompt)
+    cached = st.session_state.cached_context = get_cached_context()
+    previous = st.session_state.messages[:-1]
+    budget = history.get_history_budget(st.session_state.model, st.session_state.get("history_budgets"))
+    summary, start = get_history_manager().select(previous, budget, st.session_state.GOOGLE_API_KEY)
+    base = (config, cached and cached["name"], summary, start)
+    expected_length = len(conversation.build_chat_history(summary, [])) + len(previous) - start
+
+    chat = st.session_state.get("chat_session")
+    if chat is None or st.session_state.get("chat_base") != base or len(chat.history) != expected_length:
+        if cached:
+            model = context_cache.get_context_cache().get_model(cached, st.session_state.temperature)
+        else:
+            model = conversation.get_gemini_model(*config)
+        chat = model.start_chat(history=conversation.build_chat_history(summary, previous[start:]))
+        st.session_state.chat_session = chat
+        st.session_state.chat_base = base
+    return chat
+
+
+def append_chat_turn(chat, prompt, text):
+    """Append a finished turn to the chat history, with the bare prompt so references stay out of history."""
+    import google.generativeai as genai
+    chat.history.extend([
+        genai.protos.Content(role="user", parts=[genai.protos.Part(text=prompt)]),
+        genai.protos.Content(role="model", parts=[genai.protos.Part(text=text)])
+    ])
+
+
+def get_finish_reason(response):
+    """Return the finish reason name of a response or chunk, or None while it is not finished."""
+    candidates = getattr(response, "candidates", None)
+    if not candidates:
+        return None
+    reason = candidates[0].finish_reason
+    name = getattr(reason, "name", str(reason))
+    return None if name in ("FINISH_REASON_UNSPECIFIED", "0") else name
+
+
+def check_answer(text, finish_reason):
+    """
+    Reject an answer that was blocked or cut off, so it is never cached or kept in history.
+
+    Raises:
+        scheduler.GeminiCallError with error type "blocked"
+    """
+    if not text:
+        raise scheduler.GeminiCallError(
+            f"Gemini returned no text (finish reason: {finish_reason or 'none'})", "blocked"
         )
-        response = model.generate_content(f"{context}\n\nUser Query: {prompt}")
-        return response.text
+    if finish_reason not in (None, "STOP"):
+        raise scheduler.GeminiCallError(f"Gemini stopped the answer early (finish reason: {finish_reason})", "blocked")
+
+
+def get_turn_reference(prompt):
+    """
+    Return the reference text for a chat turn.
+
+    Must be called after get_chat_session; with a cached context the whole
+    documents are already in context, so nothing is retrieved.
+    """
+    if st.session_state.get("cached_context"):
+        st.session_state.retrieved_chunks = []
+        return ""
+    return get_reference_context(prompt)
+
+
+def get_response_cache_key(prompt, reference):
+    """
+    Return the response cache key for a turn, or None when the cache is bypassed.
+
+    Must be called after get_chat_session so the history window is known.
+    """
+    if st.session_state.get("cache_fresh_samples") and st.session_state.temperature > 0:
+        return None
+    _, _, summary, start = st.session_state.chat_base
+    cached = st.session_state.get("cached_context")
+    return response_cache.make_key(
+        st.session_state.model,
+        st.session_state.temperature,
+        st.session_state.system_prompt,
+        cached["key"] if cached else reference,
+        [summary, st.session_state.messages[:-1][start:]],
+        prompt
+    )
+
+
+def record_turn_timing(first_token, total, streamed):
+    """Store time-to-first-token and total time (in seconds) for a chat turn."""
+    if "turn_timings" not in st.session_state:
+        st.session_state.turn_timings = []
+    st.session_state.turn_timings.append({
+        "first_token": first_token,
+        "total": total,
+        "streamed": streamed
+    })
+
+
+def get_context_sizes(reference):
+    """
+    Estimate the tokens in each part of the context for a turn.
+
+    Must be called after get_chat_session so the history window is known.
+    """
+    _, _, summary, start = st.session_state.chat_base
+    window = st.session_state.messages[:-1][start:]
+    cached = st.session_state.get("cached_context")
+    return {
+        "system_prompt": history.estimate_tokens(st.session_state.system_prompt),
+        "documents": cached["tokens"] if cached else history.estimate_tokens(reference) if reference else 0,
+        "history": (history.estimate_tokens(summary) if summary else 0)
+                   + sum(history.estimate_tokens(msg["content"]) for msg in window)
+    }
+
+
+MISSING_KEY_MESSAGE = "Please enter your Google Gemini API Key in the sidebar to continue."
+
+
+def send_chat_turn(chat, prompt, reference, stream=False, coalesce_key=None):
+    """
+    Send a turn on top of the chat history through the process-wide scheduler.
+
+    The chat history itself is not changed; call append_chat_turn once the
+    answer is complete.
+
+    Raises:
+        scheduler.GeminiCallError when the call fails after retries
+    """
+    contents = chat.history + [{"role": "user", "parts": [conversation.build_turn_content(prompt, reference)]}]
+    return scheduler.get_scheduler().call(
+        st.session_state.GOOGLE_API_KEY,
+        st.session_state.model,
+        lambda: chat.model.generate_content(contents, stream=stream),
+        coalesce_key=coalesce_key,
+        stream=stream
+    )
+
+
+def get_gemini_response(prompt):
+    """
+    Get a response from the Gemini API.
+
+    Raises:
+        scheduler.GeminiCallError when there is no API key or the call fails
+    """
+    if "GOOGLE_API_KEY" not in st.session_state:
+        raise scheduler.GeminiCallError(MISSING_KEY_MESSAGE, "auth")
+
+    try:
+        start = time.perf_counter()
+        chat = get_chat_session()
+        reference = get_turn_reference(prompt)
+        cache_key = get_response_cache_key(prompt, reference)
+        cache = response_cache.get_response_cache()
+        with telemetry.track("chat", st.session_state.model, context=get_context_sizes(reference)) as record:
+            # Empty entries are never written, but may be left from earlier versions
+            text = (cache.get(cache_key) if cache_key else None) or None
+            record["cache_hit"] = text is not None
+            if text is None:
+                # Identical requests from other sessions in flight share one call
+                response = send_chat_turn(chat, prompt, reference, coalesce_key=cache_key)
+                telemetry.set_usage(record, response)
+                try:
+                    text = response.text
+                except ValueError:
+                    # No text parts, e.g. a blocked answer
+                    text = ""
+                check_answer(text, get_finish_reason(response))
+                if cache_key:
+                    cache.put(cache_key, text)
+            append_chat_turn(chat, prompt, text)
+            elapsed = time.perf_counter() - start
+            record["first_token"] = elapsed
+        record_turn_timing(elapsed, elapsed, streamed=False)
+        return text
     except Exception as e:
-        return f"Error: {str(e)}"
+        st.session_state.chat_session = None
+        raise scheduler.GeminiCallError.from_exception(e) from e
+
+
+def stream_gemini_response(prompt):
+    """
+    Yield a response from the Gemini API chunk by chunk as it is generated.
+
+    Raises:
+        scheduler.GeminiCallError when there is no API key or the call fails
+    """
+    if "GOOGLE_API_KEY" not in st.session_state:
+        raise scheduler.GeminiCallError(MISSING_KEY_MESSAGE, "auth")
+
+    start = time.perf_counter()
+    first_token = None
+    try:
+        chat = get_chat_session()
+        reference = get_turn_reference(prompt)
+        cache_key = get_response_cache_key(prompt, reference)
+        cache = response_cache.get_response_cache()
+        with telemetry.track("chat", st.session_state.model, context=get_context_sizes(reference)) as record:
+            cached = (cache.get(cache_key) if cache_key else None) or None
+            record["cache_hit"] = cached is not None
+            if cached is not None:
+                append_chat_turn(chat, prompt, cached)
+                first_token = record["first_token"] = time.perf_counter() - start
+                yield cached
+                return
+
+            parts = []
+            finish_reason = None
+            response = send_chat_turn(chat, prompt, reference, stream=True)
+            for chunk in response:
+                finish_reason = get_finish_reason(chunk) or finish_reason
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # Chunks without text parts (e.g. safety metadata only)
+                    continue
+                if not text:
+                    continue
+                if first_token is None:
+                    first_token = record["first_token"] = time.perf_counter() - start
+                parts.append(text)
+                yield text
+            telemetry.set_usage(record, response)
+            # Chunks without text may be all there is when the answer was blocked
+            text = "".join(parts)
+            check_answer(text, finish_reason)
+            append_chat_turn(chat, prompt, text)
+            if cache_key:
+                cache.put(cache_key, text)
+    except Exception as e:
+        st.session_state.chat_session = None
+        raise scheduler.GeminiCallError.from_exception(e) from e
+    finally:
+        record_turn_timing(first_token, time.perf_counter() - start, streamed=True)
+
+
+def process_documents(uploaded_files):
+    """
+    Extract, chunk and index uploaded files, reusing work for files already seen.
+
+    Document text is spilled to disk and read back through memory maps, so
+    session state only holds chunk offsets and the index. Documents are kept
+    per content hash, so unchanged files are not parsed again and removing a
+    file only drops its own chunks. Files that would take the session over
+    its text limit are skipped.
+    """
+    documents = st.session_state.documents
+    current = {}
+    total_size = 0
+
+    progress = st.progress(0.0, text="Processing documents...")
+    for i, file in enumerate(uploaded_files):
+        try:
+            with telemetry.track("ingest", file=file.name, bytes=file.size) as record:
+                digest, chunks, size, cached = ingestion.ingest_file(file.name, file.getbuffer())
+                record.update({"chunks": len(chunks), "text_bytes": size, "cache_hit": cached})
+            if total_size + size > ingestion.SESSION_TEXT_LIMIT:
+                st.error(
+                    f"Skipped {file.name}: session document limit of "
+                    f"{ingestion.SESSION_TEXT_LIMIT / 1e6:.0f} MB reached"
+                )
+            else:
+                current[digest] = documents.get(digest) or {"name": file.name, "size": size, "chunks": chunks}
+                total_size += size
+                status = "cached" if cached else "parsed"
+                st.caption(f"{file.name}: {len(chunks)} chunks ({status})")
+        except Exception as e:
+            st.error(f"Error processing {file.name}: {e}")
+        progress.progress((i + 1) / len(uploaded_files), text=f"Processed {file.name}")
+    progress.empty()
+
+    st.session_state.documents = current
+    st.session_state.document_index = build_document_index(current)
+    st.session_state.retrieved_chunks = []
+    st.success(f"Processed {len(current)} document(s) into {len(st.session_state.document_index)} chunks")
+
+
+def build_document_index(documents):
+    """
+    Index the session's documents with the selected search method.
+
+    Semantic search embeds only documents whose vectors are not stored yet.
+    If embedding fails, keyword search is used instead.
+    """
+    chunks = [chunk for document in documents.values() for chunk in document["chunks"]]
+    if st.session_state.retrieval_method == "Semantic":
+        try:
+            with st.spinner("Embedding documents..."):
+                return embeddings.build_semantic_index(
+                    [(digest, document["chunks"]) for digest, document in documents.items()],
+                    ingestion.read_chunk,
+                    embedder=embeddings.get_embedder(api_key=st.session_state.get("GOOGLE_API_KEY"))
+                )
+        except scheduler.GeminiCallError as e:
+            st.error(f"Semantic search unavailable, using keyword search: {e}")
+    return retrieval.BM25Index(chunks, load_text=ingestion.read_chunk)
+
+
+def get_session_config():
+    """Return the current bot configuration in the form kept by the conversation store."""
+    return {
+        "bot_name": st.session_state.bot_name,
+        "template": st.session_state.previous_template,
+        "system_prompt": st.session_state.system_prompt,
+        "initial_prompts": st.session_state.initial_prompts,
+        "model": st.session_state.model,
+        "temperature": st.session_state.temperature,
+        "documents": [
+            {"digest": digest, "name": document["name"]}
+            for digest, document in st.session_state.documents.items()
+        ]
+    }
+
+
+def persist_turn(messages):
+    """Append a finished turn to the conversation store, with the configuration that produced it."""
+    conversation_store = store.get_store()
+    config = get_session_config()
+    digest = store.config_hash(config)
+    saved = st.session_state.get("saved_config")
+    if saved is None or saved[0] != digest:
+        saved = st.session_state.saved_config = (digest, conversation_store.save_config(st.session_state.session_id, config))
+    conversation_store.append_messages(st.session_state.session_id, messages, config_id=saved[1])
+    # Keep the session ID in the URL so a refresh restores the conversation
+    st.query_params["session"] = st.session_state.session_id
+
+
+def restore_session(session_id):
+    """
+    Load a stored session into session state: its conversation, bot configuration and documents.
+
+    Documents are restored from the extracted text cache by content hash;
+    those no longer cached are left out.
+
+    Returns:
+        False if there is no stored session with this ID
+    """
+    conversation_store = store.get_store()
+    if not session_id or not conversation_store.session_exists(session_id):
+        return False
+
+    context_cache.get_context_cache().release(st.session_state.get("session_id"))
+    st.session_state.session_id = session_id
+    reset_chat_state()
+    # Keep only the recent pages in memory; the pager reads older ones from the store
+    # and the history manager folds them into the summary
+    count = conversation_store.count_messages(session_id)
+    offset = max(0, (count - CHAT_PAGE_SIZE) // CHAT_PAGE_SIZE * CHAT_PAGE_SIZE)
+    st.session_state.messages = conversation_store.load_messages(session_id, offset=offset)
+    st.session_state.messages_offset = offset
+    if offset:
+        get_history_manager().summarize_earlier(
+            lambda: conversation_store.load_messages(session_id, limit=offset)
+        )
+    config = conversation_store.get_config(session_id)
+    if config is not None:
+        for field in ("bot_name", "system_prompt", "initial_prompts", "model", "temperature"):
+            st.session_state[field] = config[field]
+        st.session_state.previous_template = config["template"]
+        st.session_state.template_params = None
+        documents = {}
+        for document in config["documents"]:
+            loaded = ingestion.load_document(document["digest"], document["name"])
+            if loaded is not None:
+                chunks, size = loaded
+                documents[document["digest"]] = {"name": document["name"], "size": size, "chunks": chunks}
+        st.session_state.documents = documents
+        st.session_state.document_index = build_document_index(documents) if documents else None
+
+    st.query_params["session"] = session_id
+    return True
+
+
+def reset_chat_state():
+    """Drop the per-conversation state derived from the messages and bot configuration."""
+    st.session_state.saved_config = None
+    st.session_state.chat_session = None
+    st.session_state.failed_turn = None
+    st.session_state.retrieved_chunks = []
+    st.session_state.chat_pages_shown = 0
+    st.session_state.chat_render_cache = {}
+    st.session_state.messages_offset = 0
+    get_history_manager().reset()
+
+
+def release_summarized_messages():
+    """
+    Drop whole pages the history summary covers from the in-memory conversation.
+
+    They are no longer sent verbatim and stay in the store, where the pager
+    reads them, so a long conversation holds only its unsummarized tail.
+    """
+    messages = st.session_state.messages
+    offset = st.session_state.messages_offset
+    live_start = max(0, (offset + len(messages) - CHAT_PAGE_SIZE) // CHAT_PAGE_SIZE * CHAT_PAGE_SIZE)
+    count = get_history_manager().release(live_start - offset, multiple=CHAT_PAGE_SIZE)
+    if not count:
+        return
+    st.session_state.messages = messages[count:]
+    st.session_state.messages_offset = offset + count
+    # The selection shifted with the messages, so the chat session stays valid
+    base = st.session_state.get("chat_base")
+    if base is not None:
+        st.session_state.chat_base = base[:-1] + (base[-1] - count,)
+
+
+def render_session_section():
+    """Render the session ID and restore controls in the sidebar."""
+    with st.expander("Session"):
+        st.caption(f"Session ID: {st.session_state.session_id}")
+        session_id = st.text_input("Restore session by ID")
+        if st.button("Restore", disabled=not session_id):
+            if restore_session(session_id.strip()):
+                st.rerun()
+            st.error("No stored session with this ID")
+
+
+def render_document_memory():
+    """Report document memory use for this session and the whole process."""
+    index = st.session_state.document_index
+    text_size = sum(document["size"] for document in st.session_state.documents.values())
+    mapped = ingestion.mapped_stats()
+    st.caption(
+        f"Session: {text_size / 1e6:.1f} of {ingestion.SESSION_TEXT_LIMIT / 1e6:.0f} MB text on disk, "
+        f"{index.memory_bytes() / 1e6:.1f} MB index in memory · "
+        f"Process: {mapped['mapped_bytes'] / 1e6:.1f} of {mapped['limit'] / 1e6:.0f} MB mapped"
+    )
 
 
 def render_document_uploader():
@@ -43,60 +573,271 @@ def render_document_uploader():
         accept_multiple_files=True
     )
 
+    retrieval_method = st.radio(
+        "Search method",
+        RETRIEVAL_METHODS,
+        index=RETRIEVAL_METHODS.index(st.session_state.retrieval_method),
+        horizontal=True,
+        help="Keyword search matches words; semantic search matches meaning using embeddings"
+    )
+    if retrieval_method != st.session_state.retrieval_method:
+        st.session_state.retrieval_method = retrieval_method
+        if st.session_state.documents:
+            st.session_state.document_index = build_document_index(st.session_state.documents)
+
     if uploaded_files and st.button("Process Documents"):
-        document_text = ""
-        for file in uploaded_files:
-            try:
-                if file.name.endswith('.pdf'):
-                    import PyPDF2
-                    reader = PyPDF2.PdfReader(file)
-                    for page in reader.pages:
-                        document_text += page.extract_text() + "\n"
-                elif file.name.endswith('.docx'):
-                    import docx
-                    doc = docx.Document(file)
-                    for para in doc.paragraphs:
-                        document_text += para.text + "\n"
-                else:  # assume text file
-                    document_text += file.getvalue().decode("utf-8") + "\n"
-
-                document_text += f"\n--- End of {file.name} ---\n\n"
-            except Exception as e:
-                st.error(f"Error processing {file.name}: {e}")
-
-        st.session_state.document_context = document_text
-        st.success(f"Processed {len(uploaded_files)} document(s)")
+        process_documents(uploaded_files)
+
+    if st.session_state.get("document_index") is not None:
+        render_document_memory()
+        st.session_state.retrieval_top_k = st.slider(
+            "Chunks per message",
+            min_value=TOP_K_RANGE[0],
+            max_value=TOP_K_RANGE[1],
+            value=st.session_state.retrieval_top_k,
+            help="Maximum number of document chunks sent with each message"
+        )
+        st.session_state.retrieval_budget = st.number_input(
+            "Reference budget (characters)",
+            min_value=REFERENCE_BUDGET_RANGE[0],
+            max_value=REFERENCE_BUDGET_RANGE[1],
+            step=500,
+            value=st.session_state.retrieval_budget,
+            help="Maximum amount of document text sent with each message"
+        )
+        st.session_state.show_retrieved_chunks = st.checkbox(
+            "Show retrieved chunks",
+            value=st.session_state.show_retrieved_chunks
+        )
+        render_context_cache_controls()
+
+
+def render_context_cache_controls():
+    """Render the context caching toggle and status for the current documents."""
+    st.session_state.context_caching = st.toggle(
+        "Cache documents on Gemini",
+        value=st.session_state.context_caching,
+        help="Upload the system prompt and full documents once as a Gemini cached context "
+             "instead of sending retrieved chunks with every message"
+    )
+    if not st.session_state.context_caching:
+        return
+
+    tokens = context_cache.estimate_document_tokens(st.session_state.documents)
+    if st.session_state.model not in context_cache.CACHE_MODEL_VERSIONS:
+        st.caption(f"{st.session_state.model} does not support context caching; chunks are sent instead.")
+    elif tokens < context_cache.MIN_CACHE_TOKENS:
+        st.caption(
+            f"Documents are about {tokens} tokens; Gemini caches contexts of at least "
+            f"{context_cache.MIN_CACHE_TOKENS}, so chunks are sent instead."
+        )
+    elif st.session_state.get("cached_context"):
+        st.caption(f"Cached context: {st.session_state.cached_context['tokens']} tokens")
+    if st.session_state.get("context_cache_error"):
+        st.caption(f"Context cache unavailable: {st.session_state.context_cache_error}")
+
+
+def render_cache_section():
+    """Render the response cache counters and controls in the sidebar."""
+    st.header("Response Cache")
+    cache = response_cache.get_response_cache()
+    stats = cache.stats()
+    st.caption(
+        f"{stats['hits']} hits · {stats['misses']} misses · "
+        f"{stats['disk_entries']} stored responses"
+    )
+    prefetched = prefetch.get_prefetcher().stats()
+    if prefetched["scheduled"]:
+        st.caption(
+            f"Starter prompts prefetched: {prefetched['completed']} answered · "
+            f"{prefetched['cancelled']} cancelled · {prefetched['failed']} failed"
+        )
+    st.session_state.cache_fresh_samples = st.toggle(
+        "Fresh answers when temperature > 0",
+        value=st.session_state.get("cache_fresh_samples", False),
+        help="Skip the cache so repeated prompts get new samples at non-zero temperature"
+    )
+    if st.button("Clear Cache"):
+        cache.clear()
+        st.rerun()
+
+
+def render_telemetry_section():
+    """Render rolling request statistics in the sidebar."""
+    with st.expander("Telemetry"):
+        stats = telemetry.get_telemetry().stats("chat")
+        if stats is None:
+            st.caption("No chat requests yet.")
+        else:
+            latency_p50, latency_p95 = stats["latency"]
+            st.caption(
+                f"Last {stats['count']} chat requests · {stats['errors']} errors · "
+                f"latency p50 {latency_p50:.2f}s / p95 {latency_p95:.2f}s"
+            )
+            if stats["first_token"][0] is not None:
+                st.caption(f"First token p50 {stats['first_token'][0]:.2f}s / p95 {stats['first_token'][1]:.2f}s")
+            if stats["prompt_tokens"] is not None:
+                cached = f" ({stats['cached_tokens']:.0f} from context cache)" if stats["cached_tokens"] else ""
+                st.caption(
+                    f"Average tokens: {stats['prompt_tokens']:.0f} prompt{cached} / "
+                    f"{stats['completion_tokens']:.0f} completion"
+                )
+            if stats["context"]:
+                st.caption("Average context (est. tokens): " + " · ".join(
+                    f"{part.replace('_', ' ')} {size:.0f}" for part, size in stats["context"].items()
+                ))
+            if stats["error_types"]:
+                st.caption("Errors: " + ", ".join(f"{kind} ×{count}" for kind, count in stats["error_types"].items()))
+
+        calls = scheduler.get_scheduler().stats()
+        st.caption(
+            f"Scheduler: {calls['in_flight']}/{calls['max_in_flight']} in flight · {calls['retries']} retries · "
+            f"{calls['coalesced']} coalesced · {calls['throttled_seconds']:.1f}s throttled"
+        )
+
+        ingest = telemetry.get_telemetry().stats("ingest")
+        if ingest is not None:
+            st.caption(f"Document ingestion p50 {ingest['latency'][0]:.2f}s over {ingest['count']} files")
+        st.caption(f"Log: {telemetry.LOG_PATH} · Prometheus: {telemetry.METRICS_PATH}")
+
+
+def get_bundle_data():
+    """Return a function that builds the current bot's bundle, for a deferred download."""
+    config = get_session_config()
+    documents = dict(st.session_state.documents)
+    index = st.session_state.get("document_index")
+    template_params = st.session_state.get("template_params") or templates.get_template_defaults(
+        st.session_state.previous_template
+    )
+    retrieval_settings = {
+        "method": st.session_state.retrieval_method,
+        "top_k": st.session_state.retrieval_top_k,
+        "budget": st.session_state.retrieval_budget
+    }
+    # Runs when the button is clicked, outside the script run, so it only uses this snapshot
+    return lambda: bundle.export_bundle(config, documents, index, template_params, retrieval_settings)
+
+
+def apply_bundle(imported):
+    """
+    Load an imported bot bundle into session state and start a new conversation with it.
+
+    Settings were type-checked by bundle.import_bundle; numbers are fitted
+    to the ranges of the sidebar widgets here.
+
+    Args:
+        imported: The dict returned by bundle.import_bundle
+    """
+    config = imported["config"]
+    for field in ("bot_name", "system_prompt", "initial_prompts", "model"):
+        if config.get(field) is not None:
+            st.session_state[field] = config[field]
+    if config.get("temperature") is not None:
+        st.session_state.temperature = float(config["temperature"])
+    if config.get("template") in templates.get_template_names():
+        st.session_state.previous_template = config["template"]
+
+    settings = imported["retrieval"]
+    if settings.get("method") in RETRIEVAL_METHODS:
+        st.session_state.retrieval_method = settings["method"]
+    if settings.get("top_k") is not None:
+        st.session_state.retrieval_top_k = min(max(settings["top_k"], TOP_K_RANGE[0]), TOP_K_RANGE[1])
+    if settings.get("budget") is not None:
+        st.session_state.retrieval_budget = min(
+            max(settings["budget"], REFERENCE_BUDGET_RANGE[0]), REFERENCE_BUDGET_RANGE[1]
+        )
+    st.session_state.template_params = imported["template_params"]
+    st.session_state.documents = imported["documents"]
+    st.session_state.document_index = imported["index"]
+
+    context_cache.get_context_cache().release(st.session_state.session_id)
+    store.get_store().clear_history(st.session_state.session_id)
+    st.session_state.messages = []
+    reset_chat_state()
 
 
 def render_export_section():
-    """Render the export configuration section in the sidebar."""
+    """Render the bot export and import section in the sidebar."""
     st.header("Export Configuration")
-    
-    if st.button("Export Settings"):
+
+    file_name = "".join(c if c.isalnum() else "_" for c in st.session_state.bot_name).strip("_") or "bot"
+    st.download_button(
+        "Download Bot Bundle",
+        data=get_bundle_data(),
+        file_name=f"{file_name}.zip",
+        mime="application/zip",
+        on_click="ignore",
+        help="Settings, prompts, extracted document text and the search index in one zip file"
+    )
+
+    with st.expander("Individual files"):
         settings = {
             "bot_name": st.session_state.bot_name,
             "temperature": st.session_state.temperature,
             "model": st.session_state.model
         }
-        settings_json = json.dumps(settings, indent=2)
+        st.download_button(
+            "settings.json", json.dumps(settings, indent=2), "settings.json", "application/json", on_click="ignore"
+        )
+        st.download_button(
+            "system_prompt.txt", st.session_state.system_prompt, "system_prompt.txt", "text/plain", on_click="ignore"
+        )
+        st.download_button(
+            "initial_prompts.txt", st.session_state.initial_prompts, "initial_prompts.txt", "text/plain",
+            on_click="ignore"
+        )
+
+    uploaded_bundle = st.file_uploader("Import a bot bundle", type="zip")
+    if uploaded_bundle is not None and st.button("Import Bundle"):
+        try:
+            with st.spinner("Importing bot..."):
+                imported = bundle.import_bundle(uploaded_bundle, api_key=st.session_state.get("GOOGLE_API_KEY"))
+        except (ValueError, KeyError, zipfile.BadZipFile) as e:
+            st.error(f"Could not import {uploaded_bundle.name}: {e}")
+        else:
+            apply_bundle(imported)
+            st.rerun()
+
+
+def apply_template(template_name, params, bot_name=None):
+    """
+    Fill in the system prompt and initial prompts from a template.
+
+    Args:
+        template_name: Name of the template
+        params: Values for the template's parameters
+        bot_name: Name the template gives the bot, or None to keep the current one
+    """
+    if bot_name:
+        st.session_state.bot_name = bot_name
+    values = {"bot_name": st.session_state.bot_name, **params}
+    st.session_state.system_prompt = templates.get_template_text(template_name, **values)
+    st.session_state.initial_prompts = templates.get_default_initial_prompts(template_name, **values)
+    st.session_state.template_params = dict(params)
+    st.session_state.previous_template = template_name
 
-        st.markdown("### Download Configuration Files")
-        
-        # settings.json
-        settings_b64 = base64.b64encode(settings_json.encode()).decode()
-        settings_href = f'<a href="data:application/json;base64,{settings_b64}" download="settings.json">Download settings.json</a>'
-        st.markdown(settings_href, unsafe_allow_html=True)
-        
-        # system_prompt.txt
-        prompt_b64 = base64.b64encode(st.session_state.system_prompt.encode()).decode()
-        prompt_href = f'<a href="data:text/plain;base64,{prompt_b64}" download="system_prompt.txt">Download system_prompt.txt</a>'
-        st.markdown(prompt_href, unsafe_allow_html=True)
 
-        # initial_prompts.txt
-        sample_prompts = st.session_state.initial_prompts
-        prompts_b64 = base64.b64encode(sample_prompts.encode()).decode()
-        prompts_href = f'<a href="data:text/plain;base64,{prompts_b64}" download="initial_prompts.txt">Download initial_prompts.txt</a>'
-        st.markdown(prompts_href, unsafe_allow_html=True)
+def render_template_parameters(template):
+    """Render inputs for a template's parameters, as described by its metadata."""
+    if template["description"]:
+        st.caption(template["description"])
+    if not template["parameters"]:
+        return
+    current = st.session_state.get("template_params") or template["defaults"]
+    with st.expander("Template parameters"):
+        with st.form(f"template_params_{template['name']}", border=False):
+            params = {
+                parameter["name"]: st.text_input(
+                    parameter["label"],
+                    value=current.get(parameter["name"], parameter["default"]),
+                    help=parameter["help"]
+                )
+                for parameter in template["parameters"]
+            }
+            applied = st.form_submit_button("Apply to prompt", help="Replaces the system prompt and initial prompts")
+        if applied:
+            apply_template(template["name"], params)
+            st.rerun()
 
 
 def render_bot_builder():
@@ -115,54 +856,26 @@ def render_bot_builder():
     selected_template = st.selectbox(
         "Choose a template:",
         options=template_names,
-        index=template_names.index("Basic Assistant") if "Basic Assistant" in template_names else 0
+        index=template_names.index(st.session_state.previous_template)
+        if st.session_state.previous_template in template_names else 0
     )
 
+    for path, error in templates.get_registry().errors.items():
+        st.warning(f"Template pack {os.path.basename(path)} could not be loaded: {error}")
+
     # Check if template has changed and needs immediate update
     template_changed = selected_template != st.session_state.previous_template
-    
-    # Handle all templates in a simplified way
-    if template_changed:
-        if selected_template == "Punny Professor":
-            # Set default values without showing extra inputs
-            domain = "Science"
-            education_level = "High School"
-            prompt_text = templates.get_template_text(selected_template, domain=domain, education_level=education_level)
-            st.session_state.bot_name = "Punny Professor"
-            st.session_state.initial_prompts = templates.get_default_initial_prompts(
-                selected_template, domain=domain, education_level=education_level
-            )
-            
-        elif selected_template == "Analogy Creator":
-            # Set default values without showing extra inputs
-            domain = "Science"
-            education_level = "High School"
-            prompt_text = templates.get_template_text(selected_template, domain=domain, education_level=education_level)
-            st.session_state.bot_name = "Analogy Creator"
-            st.session_state.initial_prompts = templates.get_default_initial_prompts(
-                selected_template, domain=domain, education_level=education_level
-            )
-            
-        elif selected_template == "Customer Support from Hell":
-            # Set default values without showing extra inputs
-            company_name = "TechCorp"
-            product_type = "cloud software solutions"
-            prompt_text = templates.get_template_text(selected_template, company_name=company_name, product_type=product_type)
-            st.session_state.bot_name = "Customer Support"
-            st.session_state.initial_prompts = templates.get_default_initial_prompts(
-                selected_template, product_type=product_type
-            )
-            
-        else:  # Basic Assistant
-            prompt_text = templates.get_template_text(selected_template, bot_name=st.session_state.bot_name)
-            st.session_state.initial_prompts = templates.get_default_initial_prompts(selected_template)
-            # For Basic Assistant, we keep the current bot name
-        
-        # Update the system prompt and template state
-        st.session_state.system_prompt = prompt_text
-        st.session_state.previous_template = selected_template
+    template = templates.get_template(selected_template)
+
+    # Switching templates fills in the prompt and starters with the template's defaults; if the
+    # previous template was removed from the packs, the prompt is kept
+    if template_changed and template is not None and st.session_state.previous_template in template_names:
+        apply_template(selected_template, template["defaults"], template["bot_name"])
         st.rerun()
 
+    if template is not None:
+        render_template_parameters(template)
+
     # This section is still needed but won't get executed after a st.rerun()
     if st.session_state.previous_template != selected_template:
         st.session_state.previous_template = selected_template
@@ -202,24 +915,357 @@ def render_bot_builder():
     st.markdown("---")  # Horizontal line
     st.subheader("Test Your Bot")
     # Remove the caption line
-    render_chat_interface()
-    
-def render_chat_interface():
-    """Render the chat interface for testing the bot."""
-    # Removed the duplicate subheader
-    for message in st.session_state.messages:
+    test_mode = st.radio(
+        "Test mode",
+        ["Chat", "Compare"],
+        horizontal=True,
+        label_visibility="collapsed",
+        help="Compare sends the same message to several models or temperatures at once"
+    )
+    if test_mode == "Compare":
+        render_compare_mode()
+    else:
+        render_chat_interface()
+
+
+def render_compare_mode():
+    """Send one message to several models and temperatures concurrently and show the answers side by side."""
+    model_options = list(history.DEFAULT_HISTORY_BUDGETS)
+    col1, col2 = st.columns(2)
+    with col1:
+        models = st.multiselect("Models", model_options, default=[st.session_state.model])
+    with col2:
+        temperature_options = sorted(set(COMPARE_TEMPERATURES) | {st.session_state.temperature})
+        temperatures = st.multiselect(
+            "Temperatures",
+            temperature_options,
+            default=[st.session_state.temperature]
+        )
+    prompt = st.text_area("Message to compare", height=100)
+    st.caption("Uses the current system prompt, documents and chat history. Answers are not added to the chat.")
+
+    if st.button("Compare", disabled=not (prompt and models and temperatures)):
+        if "GOOGLE_API_KEY" not in st.session_state:
+            st.warning("Please enter your Google Gemini API Key in the sidebar to continue.")
+            return
+
+        previous = st.session_state.messages
+        budget = history.get_history_budget(st.session_state.model, st.session_state.get("history_budgets"))
+        summary, start = get_history_manager().select(previous, budget, st.session_state.GOOGLE_API_KEY)
+        reference = get_reference_context(prompt, previous)
+        contents = conversation.build_contents(prompt, reference, summary, previous[start:])
+
+        runs = [
+            (
+                f"{model} · T={temperature}",
+                model,
+                conversation.get_gemini_model(model, temperature, st.session_state.system_prompt)
+            )
+            for model in models for temperature in temperatures
+        ]
+        context = {
+            "system_prompt": history.estimate_tokens(st.session_state.system_prompt),
+            "documents": history.estimate_tokens(reference) if reference else 0,
+            "history": history.estimate_tokens(summary or "")
+                       + sum(history.estimate_tokens(msg["content"]) for msg in previous[start:])
+        }
+        futures = compare.start_comparison(runs, contents, context, st.session_state.GOOGLE_API_KEY)
+
+        # Show each answer in its own column as soon as it finishes
+        placeholders = {}
+        for row_start in range(0, len(runs), COMPARE_COLUMNS):
+            row = runs[row_start:row_start + COMPARE_COLUMNS]
+            for (label, _, _), column in zip(row, st.columns(COMPARE_COLUMNS)):
+                with column:
+                    st.markdown(f"**{label}**")
+                    placeholders[label] = st.empty()
+                    placeholders[label].caption("Waiting...")
+
+        results = []
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            results.append(result)
+            with placeholders[result["label"]].container():
+                render_compare_result(result)
+        order = [label for label, _, _ in runs]
+        st.session_state.compare_results = sorted(results, key=lambda result: order.index(result["label"]))
+
+    elif st.session_state.get("compare_results"):
+        results = st.session_state.compare_results
+        for row_start in range(0, len(results), COMPARE_COLUMNS):
+            row = results[row_start:row_start + COMPARE_COLUMNS]
+            for result, column in zip(row, st.columns(COMPARE_COLUMNS)):
+                with column:
+                    st.markdown(f"**{result['label']}**")
+                    render_compare_result(result)
+
+
+def render_compare_result(result):
+    """Show one comparison answer with its latency and token usage."""
+    if result["error"]:
+        st.error(result["error"])
+    else:
+        st.markdown(result["text"])
+    tokens = ""
+    if result["prompt_tokens"] is not None:
+        tokens = f" · {result['prompt_tokens']} in / {result['completion_tokens']} out tokens"
+    st.caption(f"{result['latency']:.2f}s{tokens}")
+
+
+def get_transcript_page(start, end):
+    """
+    Return messages start to end of the conversation as one markdown transcript.
+
+    Pages before messages_offset are read from the conversation store.
+    Transcripts are kept in session state; stored pages are formatted once,
+    in-memory pages are reused while their first and last message are the
+    same objects, so pages of an append-only conversation are only formatted once.
+    """
+    cache = st.session_state.setdefault("chat_render_cache", {})
+    entry = cache.get((start, end))
+    offset = st.session_state.messages_offset
+    if start < offset:
+        if entry is not None:
+            return entry[2]
+        page = store.get_store().load_messages(st.session_state.session_id, offset=start, limit=end - start)
+    else:
+        page = st.session_state.messages[start - offset:end - offset]
+        if entry is not None and entry[0] is page[0] and entry[1] is page[-1]:
+            return entry[2]
+
+    bot_name = st.session_state.bot_name
+    text = "\n\n---\n\n".join(
+        f"**{'You' if message['role'] == 'user' else bot_name}:**\n\n{message['content']}"
+        for message in page
+    )
+    cache[(start, end)] = (page[0], page[-1], text)
+    return text
+
+
+def render_chat_history():
+    """
+    Render the conversation, paging long histories.
+
+    Only the most recent messages are drawn as chat bubbles. Older messages
+    are split into fixed pages that are loaded on demand, each drawn as a
+    single cached transcript, so a rerun caused by another widget does not
+    redraw hundreds of messages.
+    """
+    messages = st.session_state.messages
+    offset = st.session_state.messages_offset
+    # Pages are aligned to the start of the conversation so they stay stable as messages are added
+    live_start = max(0, (offset + len(messages) - CHAT_PAGE_SIZE) // CHAT_PAGE_SIZE * CHAT_PAGE_SIZE)
+    pages_shown = min(st.session_state.get("chat_pages_shown", 0), live_start // CHAT_PAGE_SIZE)
+    shown_start = live_start - pages_shown * CHAT_PAGE_SIZE
+
+    if shown_start > 0:
+        if st.button(f"Load older messages ({shown_start} hidden)"):
+            st.session_state.chat_pages_shown = pages_shown + 1
+            st.rerun()
+    if pages_shown:
+        if st.button("Hide older messages"):
+            st.session_state.chat_pages_shown = 0
+            st.rerun()
+        for start in range(shown_start, live_start, CHAT_PAGE_SIZE):
+            with st.container(border=True):
+                st.caption(f"Messages {start + 1}–{start + CHAT_PAGE_SIZE}")
+                st.markdown(get_transcript_page(start, start + CHAT_PAGE_SIZE))
+
+    for message in messages[max(0, live_start - offset):]:
         with st.chat_message(message["role"]):
             st.markdown(message["content"])
 
-    if prompt := st.chat_input("Type a message to test your bot..."):
+
+def get_starter_prompts():
+    """Return the bot's suggested initial prompts, one per non-empty line."""
+    return [line.strip() for line in st.session_state.initial_prompts.splitlines() if line.strip()]
+
+
+def make_prefetch_job(prompt, settings):
+    """
+    Return a prefetch job that answers a starter prompt into the response cache.
+
+    The answer is stored under the key get_response_cache_key computes for
+    the same prompt as the first message, so clicking the starter is a cache hit.
+
+    Args:
+        prompt: The starter prompt
+        settings: Snapshot of the session values the answer depends on
+    """
+    def job(cancelled):
+        with telemetry.track("prefetch", settings["model"]) as record:
+            reference = ""
+            if settings["index"] is not None:
+                reference = retrieval.format_chunks(conversation.retrieve_chunks(
+                    settings["index"],
+                    prompt,
+                    [],
+                    top_k=settings["top_k"],
+                    budget_chars=settings["budget"]
+                ))
+            key = response_cache.make_key(
+                settings["model"],
+                settings["temperature"],
+                settings["system_prompt"],
+                reference,
+                [settings["summary"], []],
+                prompt
+            )
+            cache = response_cache.get_response_cache()
+            record["cache_hit"] = cache.get(key) is not None
+            if record["cache_hit"] or cancelled.is_set():
+                return
+            model = conversation.get_gemini_model(settings["model"], settings["temperature"], settings["system_prompt"])
+            contents = conversation.build_contents(prompt, reference, settings["summary"], [])
+            response = scheduler.get_scheduler().call(
+                settings["api_key"],
+                settings["model"],
+                lambda: model.generate_content(contents),
+                coalesce_key=key
+            )
+            telemetry.set_usage(record, response)
+            check_answer(response.text, get_finish_reason(response))
+            cache.put(key, response.text)
+    return job
+
+
+def schedule_starter_prefetch(prompts):
+    """
+    Prefetch the answers to the starter prompts for the current configuration.
+
+    The prefetcher waits until the configuration has been stable for a
+    moment and cancels prefetches for a configuration that has changed.
+    Nothing is prefetched without an API key, with context caching (the
+    cached context only exists after the first turn) or when answers are
+    not cached.
+    """
+    prefetcher = prefetch.get_prefetcher()
+    if ("GOOGLE_API_KEY" not in st.session_state or st.session_state.get("context_caching")
+            or (st.session_state.get("cache_fresh_samples") and st.session_state.temperature > 0)):
+        prefetcher.cancel(st.session_state.session_id)
+        return
+
+    budget = history.get_history_budget(st.session_state.model, st.session_state.get("history_budgets"))
+    summary, _ = get_history_manager().select([], budget, st.session_state.GOOGLE_API_KEY)
+    settings = {
+        "api_key": st.session_state.GOOGLE_API_KEY,
+        "model": st.session_state.model,
+        "temperature": st.session_state.temperature,
+        "system_prompt": st.session_state.system_prompt,
+        "index": st.session_state.get("document_index"),
+        "top_k": st.session_state.retrieval_top_k,
+        "budget": st.session_state.retrieval_budget,
+        "summary": summary
+    }
+    config_key = hashlib.sha256(json.dumps([
+        store.config_hash(get_session_config()),
+        st.session_state.retrieval_method,
+        settings["top_k"],
+        settings["budget"],
+        summary
+    ]).encode("utf-8")).hexdigest()
+    prefetcher.schedule(
+        st.session_state.session_id,
+        config_key,
+        [make_prefetch_job(prompt, settings) for prompt in prompts]
+    )
+
+
+def render_starter_prompts():
+    """
+    Show the suggested prompts as buttons before the first message and prefetch their answers.
+
+    Returns:
+        The clicked prompt, or None
+    """
+    # Set by the button callback before the rerun, so the buttons are gone when the answer is drawn
+    clicked = st.session_state.pop("clicked_starter", None)
+    prompts = get_starter_prompts()
+    if clicked or st.session_state.messages or st.session_state.get("failed_turn") or not prompts:
+        prefetch.get_prefetcher().cancel(st.session_state.session_id)
+        return clicked
+
+    schedule_starter_prefetch(prompts)
+    st.caption("Try asking:")
+    columns = st.columns(min(len(prompts), 3))
+    for i, prompt in enumerate(prompts):
+        columns[i % len(columns)].button(
+            prompt,
+            key=f"starter_prompt_{i}",
+            on_click=st.session_state.__setitem__,
+            args=("clicked_starter", prompt),
+            use_container_width=True
+        )
+    return None
+
+
+def render_chat_interface():
+    """Render the chat interface for testing the bot."""
+    render_chat_history()
+
+    prompt = st.chat_input("Type a message to test your bot...")
+    starter = False
+    if prompt:
+        prefetch.get_prefetcher().cancel(st.session_state.session_id)
+    else:
+        prompt = render_starter_prompts()
+        starter = prompt is not None
+
+    # A failed turn is shown apart from the conversation and never enters the history
+    failed = st.session_state.get("failed_turn")
+    if failed and not prompt:
+        with st.chat_message("user"):
+            st.markdown(failed["prompt"])
+        st.error(f"No answer ({failed['error_type'].replace('_', ' ')}): {failed['error']}")
+        if st.button("Retry"):
+            prompt = failed["prompt"]
+
+    if prompt:
+        st.session_state.failed_turn = None
         st.session_state.messages.append({"role": "user", "content": prompt})
         with st.chat_message("user"):
             st.markdown(prompt)
-        with st.chat_message("assistant"):
-            with st.spinner("Thinking..."):
-                response = get_gemini_response(prompt)
-                st.markdown(response)
+        try:
+            with st.chat_message("assistant"):
+                # A clicked starter may still be prefetching; the non-streamed call shares its request
+                if st.session_state.get("stream_responses", True) and not starter:
+                    response = st.write_stream(stream_gemini_response(prompt))
+                else:
+                    with st.spinner("Thinking..."):
+                        response = get_gemini_response(prompt)
+                        st.markdown(response)
+                render_turn_timing()
+                if st.session_state.get("show_retrieved_chunks"):
+                    render_retrieved_chunks()
+        except scheduler.GeminiCallError as e:
+            st.session_state.messages.pop()
+            st.session_state.failed_turn = {"prompt": prompt, "error": str(e), "error_type": e.error_type}
+            st.rerun()
         st.session_state.messages.append({"role": "assistant", "content": response})
+        persist_turn(st.session_state.messages[-2:])
+        release_summarized_messages()
+
+
+def render_turn_timing():
+    """Show the timing of the most recent chat turn below the response."""
+    timings = st.session_state.get("turn_timings")
+    if not timings:
+        return
+    timing = timings[-1]
+    if timing["first_token"] is None:
+        st.caption(f"No tokens received · total {timing['total']:.2f}s")
+    else:
+        st.caption(f"First token {timing['first_token']:.2f}s · total {timing['total']:.2f}s")
+
+def render_retrieved_chunks():
+    """Show the document chunks that were sent with the most recent message."""
+    chunks = st.session_state.get("retrieved_chunks") or []
+    with st.expander(f"Retrieved chunks ({len(chunks)})"):
+        if not chunks:
+            st.caption("No document chunks matched this message.")
+        for chunk in chunks:
+            st.caption(f"{chunk['source']} · score {chunk['score']:.2f}")
+            st.text(chunk["text"])
 
 def render_prompt_guidance():
     """Render the Prompt Guidance view."""